@@ -1,19 +1,939 @@
 import asyncio
 import json
 import logging
+import math
+import os
+import posixpath
 import random
 import re
+import time
 import urllib
 from abc import ABC, abstractmethod
+from collections import OrderedDict
 from datetime import datetime
 from http.cookies import SimpleCookie
 from typing import Optional, Dict
 
 import aiohttp
-from requests import session
 
+import metrics
 import settings
+from cassette import Cassette, CassetteSession
 import utils
+from RangedDownloader import RangedDownloader
+
+
+class QuarkTransport:
+    """
+    进程级共享的 HTTP 传输层
+    所有 QuarkDisk / ParseQuarkShareLInk 共用同一个连接池（按 host 保持长连接、DNS 缓存），
+    每个账号持有独立的 session 与 cookie jar，退出时统一调用 QuarkTransport.close() 关闭
+    同一账号的多个客户端通过 acquire/release 计数，最后一个客户端 release 时才关闭该账号的 session
+    """
+    LIMIT = 100  # 连接池总连接数
+    LIMIT_PER_HOST = 20  # 每个 host 的长连接上限
+    DNS_CACHE_TTL = 300
+    KEEPALIVE_TIMEOUT = 60
+    SHARE_ACCOUNT = '__share__'  # 分享链接解析共用的匿名 session
+
+    _connector: Optional[aiohttp.TCPConnector] = None
+    _sessions: dict[str, aiohttp.ClientSession] = {}
+    _refs: dict[str, int] = {}
+    _cassette: Optional[Cassette] = None
+    _cassette_sessions: dict[str, CassetteSession] = {}
+
+    @classmethod
+    def _get_connector(cls) -> aiohttp.TCPConnector:
+        if cls._connector is None or cls._connector.closed:
+            cls._connector = aiohttp.TCPConnector(
+                limit=cls.LIMIT,
+                limit_per_host=cls.LIMIT_PER_HOST,
+                use_dns_cache=True,
+                ttl_dns_cache=cls.DNS_CACHE_TTL,
+                keepalive_timeout=cls.KEEPALIVE_TIMEOUT,
+            )
+        return cls._connector
+
+    @classmethod
+    def use_cassette(cls, cassette: Optional[Cassette]):
+        """
+        之后获取的 session 改为经过录像带：录制模式包装真实 session，回放模式不访问网络，传入 None 恢复直连
+        需在创建 QuarkDisk / ParseQuarkShareLInk 之前调用，录像带在 QuarkTransport.close() 时保存
+        """
+        cls._cassette = cassette
+        cls._cassette_sessions = {}
+
+    @classmethod
+    def get_session(cls, account: str, headers: dict = None, cookie: str = None):
+        """
+        获取账号对应的 session，不存在则创建
+        :param account: 账号名，同名账号共用一个 session
+        :param headers: 默认请求头
+        :param cookie: 账号 cookie 字符串，写入该账号独立的 cookie jar
+        :return: aiohttp.ClientSession，使用录像带时为 CassetteSession
+        """
+        if cls._cassette is not None:
+            session = cls._cassette_sessions.get(account)
+            if session is None or session.closed:
+                inner = cls._get_session(account, headers, cookie) if cls._cassette.mode == 'record' else None
+                session = CassetteSession(cls._cassette, inner, scope=account)
+                cls._cassette_sessions[account] = session
+            return session
+        return cls._get_session(account, headers, cookie)
+
+    @classmethod
+    def acquire(cls, account: str, headers: dict = None, cookie: str = None):
+        """与 get_session 相同，同时为该账号的 session 增加一个引用，使用完毕后调用 release"""
+        cls._refs[account] = cls._refs.get(account, 0) + 1
+        return cls.get_session(account, headers, cookie)
+
+    @classmethod
+    def _get_session(cls, account: str, headers: dict = None, cookie: str = None) -> aiohttp.ClientSession:
+        session = cls._sessions.get(account)
+        if session is None or session.closed:
+            cookie_jar = aiohttp.CookieJar()
+            if cookie:
+                simple_cookie = SimpleCookie()
+                simple_cookie.load(cookie)
+                for key, morsel in simple_cookie.items():
+                    cookie_jar.update_cookies({key: morsel.value})
+            session = aiohttp.ClientSession(
+                connector=cls._get_connector(),
+                connector_owner=False,
+                cookie_jar=cookie_jar,
+                headers=headers,
+                trace_configs=[metrics.trace_config('quark', account)],
+            )
+            cls._sessions[account] = session
+        return session
+
+    @classmethod
+    async def release(cls, account: str):
+        """释放 acquire 得到的引用，账号不再有引用时关闭并移除其 session，连接池保持不变"""
+        refs = cls._refs.get(account, 0) - 1
+        if refs > 0:
+            cls._refs[account] = refs
+            return
+        cls._refs.pop(account, None)
+        await cls._close_session(account)
+
+    @classmethod
+    async def _close_session(cls, account: str):
+        cassette_session = cls._cassette_sessions.pop(account, None)
+        if cassette_session is not None:
+            await cassette_session.close()
+        session = cls._sessions.pop(account, None)
+        if session is not None and not session.closed:
+            await session.close()
+
+    @classmethod
+    async def close(cls):
+        """关闭所有 session 与共享连接池，使用录像带时保存录像带"""
+        for account in {*cls._sessions.keys(), *cls._cassette_sessions.keys()}:
+            await cls._close_session(account)
+        cls._refs.clear()
+        if cls._cassette is not None:
+            cls._cassette.save()
+        if cls._connector is not None and not cls._connector.closed:
+            await cls._connector.close()
+        cls._connector = None
+
+
+LS_PAGE_SIZE = 100  # 列目录接口单页允许的最大条数
+LS_CONCURRENCY = 4  # 并发拉取分页的上限
+
+
+async def fetch_pages(fetch_page, parallel: bool = True, concurrency: int = LS_CONCURRENCY) -> tuple[dict, Optional[list]]:
+    """
+    分页拉取目录列表
+    先请求第一页，parallel 时根据 metadata._total 并发请求剩余分页，按页码顺序合并；
+    响应中没有 metadata._total 时退回逐页串行请求，直到某页为空或不足一页
+    :param fetch_page: async (page) -> resp_json
+    :param parallel: False 时逐页串行请求
+    :param concurrency: 并发请求的分页数上限
+    :return: (第一页的 resp_json, 合并后的 list)；接口返回错误时为 (出错的 resp_json, None)
+    """
+    first = await fetch_page(1)
+    if first["code"] != 0:
+        return first, None
+    items = list(first["data"]["list"])
+    total = (first.get("metadata") or {}).get("_total")
+    page_size = len(items)
+    page = 2
+    if total is None:
+        while page_size:
+            resp_json = await fetch_page(page)
+            if resp_json["code"] != 0:
+                return resp_json, None
+            page_items = resp_json["data"]["list"]
+            items += page_items
+            if len(page_items) < page_size:
+                break
+            page += 1
+        return first, items
+    if parallel and items and len(items) < total:
+        # 按服务端实际返回的单页条数计算页数，接口对 _size 做了截断也能正确分页
+        page_count = math.ceil(total / len(items))
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _fetch(page_):
+            async with semaphore:
+                return await fetch_page(page_)
+
+        pages = await asyncio.gather(*[_fetch(page_) for page_ in range(2, page_count + 1)])
+        for resp_json in pages:
+            if resp_json["code"] != 0:
+                return resp_json, None
+            items += resp_json["data"]["list"]
+        page = page_count + 1
+    # 串行模式，或目录在翻页期间有新增时补齐剩余分页
+    while items and len(items) < total:
+        resp_json = await fetch_page(page)
+        if resp_json["code"] != 0:
+            return resp_json, None
+        if not resp_json["data"]["list"]:
+            break
+        items += resp_json["data"]["list"]
+        page += 1
+    return first, items
+
+
+class GetFidsError(RuntimeError):
+    """
+    get_fids 部分分组请求失败
+    failed_paths 为失败分组中的路径，fids 为其余成功分组的结果（保持输入顺序）
+    """
+    def __init__(self, message: str, failed_paths: list[str], fids: list[dict]):
+        super().__init__(message)
+        self.failed_paths = failed_paths
+        self.fids = fids
+
+
+class FidCache:
+    """
+    路径 -> fid 的 LRU 缓存，条目带过期时间，ensure_dir 的结果同样写入这里
+    目录被改名/移动/删除时按路径前缀使其下所有已缓存的路径失效；
+    写入时记录条目的已缓存祖先目录，祖先目录的条目被淘汰后仍能按其 fid 找到下面的路径。
+    文件与未按路径查询过的目录没有缓存的路径，按 fid 失效时不影响其他条目
+    """
+    def __init__(self, max_size: int = 4096, ttl: float = 600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[dict, float]] = OrderedDict()
+        self._fid_paths: dict[str, str] = {}
+        self._ancestors: dict[str, tuple[str, ...]] = {}
+        self._descendants: dict[str, set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(path: str) -> str:
+        return '/' + path.strip('/')
+
+    def get(self, path: str) -> Optional[dict]:
+        path = self.normalize(path)
+        item = self._entries.get(path)
+        if item is None or item[1] < time.monotonic():
+            if item is not None:
+                self._remove(path)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(path)
+        self.hits += 1
+        return item[0]
+
+    def put(self, path: str, entry: dict):
+        """
+        :param path: 网盘路径
+        :param entry: /file/info/path_list 返回的单个条目，至少包含 fid
+        """
+        path = self.normalize(path)
+        self._remove(path)
+        self._entries[path] = (entry, time.monotonic() + self.ttl)
+        self._fid_paths[entry['fid']] = path
+        parts = path.strip('/').split('/')
+        ancestors = tuple(self._entries[prefix][0]['fid'] for prefix in
+                          ('/' + '/'.join(parts[:i]) for i in range(1, len(parts))) if prefix in self._entries)
+        self._ancestors[path] = ancestors
+        for fid in ancestors:
+            self._descendants.setdefault(fid, set()).add(path)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, path: str):
+        item = self._entries.pop(path, None)
+        if item is None:
+            return
+        fid = item[0].get('fid')
+        if self._fid_paths.get(fid) == path:
+            del self._fid_paths[fid]
+        for ancestor in self._ancestors.pop(path, ()):
+            paths = self._descendants.get(ancestor)
+            if paths is not None:
+                paths.discard(path)
+                if not paths:
+                    del self._descendants[ancestor]
+
+    def invalidate(self, path: str):
+        """使路径及所有以它为前缀的路径失效，中间目录是否缓存不影响结果"""
+        path = self.normalize(path)
+        if path == '/':
+            self.clear()
+            return
+        prefix = path + '/'
+        for cached_path in [cached_path for cached_path in self._entries
+                            if cached_path == path or cached_path.startswith(prefix)]:
+            self._remove(cached_path)
+
+    def invalidate_fid(self, fid: str):
+        """使 fid 对应的路径及记录在它下面的路径失效，没有缓存的 fid（如文件）不做任何事"""
+        path = self._fid_paths.get(fid)
+        if path is not None:
+            self.invalidate(path)
+        for descendant in list(self._descendants.pop(fid, ())):
+            self.invalidate(descendant)
+
+    def clear(self):
+        """清空缓存，保留根目录"""
+        root = self._entries.get('/')
+        self._entries.clear()
+        self._fid_paths.clear()
+        self._ancestors.clear()
+        self._descendants.clear()
+        if root is not None:
+            self.put('/', root[0])
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+class StokenStore:
+    """
+    分享链接 stoken 的本地持久化缓存，(pwd_id, passcode) -> {'stoken':, 'obtained_at':}
+    stoken 在服务端拒绝之前一直复用，超过 max_age 的条目在保存时清理，避免文件无限增长
+    """
+    PATH = os.path.join(settings.LOCAL_CACHE_DIR, 'quark_stokens.json')
+    MAX_AGE = 7 * 24 * 3600
+
+    def __init__(self, path: str = PATH, max_age: float = MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self._entries: Optional[dict[str, dict]] = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(pwd_id: str, passcode: str) -> str:
+        return f'{pwd_id}:{passcode or ""}'
+
+    def _load(self) -> dict[str, dict]:
+        if self._entries is None:
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def _save(self):
+        now = time.time()
+        entries = {key: entry for key, entry in self._load().items() if now - entry['obtained_at'] < self.max_age}
+        self._entries = entries
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            utils.logger.warning(f'保存 stoken 缓存失败：{e}')
+
+    def get(self, pwd_id: str, passcode: str) -> Optional[str]:
+        entry = self._load().get(self._key(pwd_id, passcode))
+        if entry is None or time.time() - entry['obtained_at'] >= self.max_age:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry['stoken']
+
+    def put(self, pwd_id: str, passcode: str, stoken: str):
+        self._load()[self._key(pwd_id, passcode)] = {'stoken': stoken, 'obtained_at': time.time()}
+        self._save()
+
+    def invalidate(self, pwd_id: str, passcode: str, stoken: str = None):
+        """stoken 不为 None 时只在缓存的仍是该 stoken 时删除，避免并发刷新后删掉新的 stoken"""
+        key = self._key(pwd_id, passcode)
+        entry = self._load().get(key)
+        if entry is not None and (stoken is None or entry['stoken'] == stoken):
+            del self._entries[key]
+            self._save()
+
+    def stats(self) -> dict:
+        return {'size': len(self._load()), 'hits': self.hits, 'misses': self.misses}
+
+
+STOKEN_EXPIRED_CODES = {41012}  # 分享 stoken 失效
+THROTTLE_STATUS = {429, 503}
+
+
+def is_throttled(resp: aiohttp.ClientResponse, message: str) -> bool:
+    """
+    是否为限流/服务端过载信号：HTTP 429、5xx 或提示请求频繁
+    41026/41028 等内容风控错误码是针对单个文件的业务结果，由调用方处理，不视为限流
+    """
+    return resp.status in THROTTLE_STATUS or resp.status >= 500 or "频繁" in message
+
+
+class TokenBucket:
+    """
+    令牌桶，速率可在 min_rate 与初始速率之间动态调整
+    """
+    def __init__(self, rate: float, burst: int, min_rate: float):
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def throttle(self):
+        """被限流时速率减半，并清空已积累的令牌"""
+        self._refill()
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = min(self.tokens, 0)
+
+    def recover(self):
+        """请求成功后线性恢复速率"""
+        self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+
+class RateLimiter:
+    """
+    账号级限速器，按接口类别（list/write/share）各自维护一个令牌桶
+    遇到限流（429、5xx、请求频繁）时对应类别自动降速，之后随成功请求逐步恢复
+    """
+    LIMITS = {
+        'list': (5, 10),  # (每秒请求数, 突发容量)
+        'write': (2, 4),
+        'share': (1, 2),
+    }
+    MIN_RATE = 0.2
+    WRITE_ENDPOINTS = ('/clouddrive/file', '/clouddrive/file/rename', '/clouddrive/file/move',
+                       '/clouddrive/file/delete', '/clouddrive/share/sharepage/save')
+    SHARE_ENDPOINTS = ('/clouddrive/share', '/clouddrive/share/password')
+
+    def __init__(self):
+        self.buckets = {
+            name: TokenBucket(rate, burst, self.MIN_RATE)
+            for name, (rate, burst) in self.LIMITS.items()
+        }
+
+    @classmethod
+    def classify(cls, url: str) -> str:
+        path = url.split('?')[0].rstrip('/')
+        if path.endswith(cls.WRITE_ENDPOINTS):
+            return 'write'
+        if path.endswith(cls.SHARE_ENDPOINTS):
+            return 'share'
+        return 'list'
+
+    async def acquire(self, endpoint_class: str):
+        await self.buckets[endpoint_class].acquire()
+
+    def feedback(self, endpoint_class: str, throttled: bool):
+        if throttled:
+            self.buckets[endpoint_class].throttle()
+            utils.logger.warning(f"{endpoint_class} 类接口触发限流，速率降至 {self.buckets[endpoint_class].rate:.2f}/s")
+        else:
+            self.buckets[endpoint_class].recover()
+
+
+async def read_api_code(resp: aiohttp.ClientResponse) -> tuple[Optional[int], str]:
+    """读取接口返回的 (code, message)，非 JSON 响应返回 (None, '')；响应体会被缓存，调用方仍可再次读取"""
+    try:
+        resp_json = await resp.json(content_type=None)
+    except (ValueError, aiohttp.ClientError):
+        return None, ''
+    if not isinstance(resp_json, dict):
+        return None, ''
+    return resp_json.get("code"), str(resp_json.get("message", ""))
+
+
+class CircuitOpenError(RuntimeError):
+    """账号熔断中，请求未发出"""
+    def __init__(self, account: str, retry_after: float):
+        super().__init__(f"账号{account}已熔断，{retry_after:.0f}s 后重试")
+        self.account = account
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    账号级熔断器，同一账号的所有实例共用
+    连续 FAILURE_THRESHOLD 次限流、5xx 或网络异常后打开（风控错误码不计入），COOLDOWN 秒内的请求直接抛出 CircuitOpenError；
+    冷却结束后进入半开状态，只放行一个探测请求，成功则关闭，失败则重新打开
+    """
+    FAILURE_THRESHOLD = 5
+    COOLDOWN = 30.0
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    _breakers: dict[str, 'CircuitBreaker'] = {}
+
+    def __init__(self, account: str):
+        self.account = account
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    @classmethod
+    def for_account(cls, account: str) -> 'CircuitBreaker':
+        if account not in cls._breakers:
+            cls._breakers[account] = cls(account)
+        return cls._breakers[account]
+
+    def _refresh_state(self):
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.COOLDOWN:
+            self.state = self.HALF_OPEN
+            self._probing = False
+
+    @property
+    def available(self) -> bool:
+        """当前是否可以发出请求（半开且已有探测请求在进行时视为不可用）"""
+        self._refresh_state()
+        return self.state == self.CLOSED or (self.state == self.HALF_OPEN and not self._probing)
+
+    def before_request(self):
+        self._refresh_state()
+        if self.state == self.OPEN:
+            raise CircuitOpenError(self.account, self.COOLDOWN - (time.monotonic() - self.opened_at))
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                raise CircuitOpenError(self.account, 0)
+            self._probing = True
+
+    def release_probe(self):
+        """探测请求未完成（如被取消）时归还半开状态下的探测名额"""
+        self._probing = False
+
+    def record(self, success: bool):
+        if success:
+            if self.state != self.CLOSED:
+                utils.logger.info(f"账号{self.account}熔断恢复")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+            return
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.FAILURE_THRESHOLD:
+            if self.state != self.OPEN:
+                utils.logger.warning(f"账号{self.account}连续失败{self.failures}次，熔断{self.COOLDOWN:.0f}s")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class RequestContext:
+    """一次逻辑请求在中间件链中传递的上下文，重试时复用"""
+    # 只读、可安全重放的 POST 接口
+    IDEMPOTENT_POST_ENDPOINTS = ('/clouddrive/file/info/path_list', '/clouddrive/file/download',
+                                 '/clouddrive/share/sharepage/token', '/clouddrive/share/password')
+
+    def __init__(self, method: str, url: str, **kwargs):
+        self.method = method.upper()
+        self.url = url
+        self.path = url.split('?')[0].rstrip('/')
+        self.kwargs = kwargs
+        self.endpoint_class = RateLimiter.classify(url)
+        self.timeout: Optional[aiohttp.ClientTimeout] = None
+        self.attempt = 0
+
+    @property
+    def idempotent(self) -> bool:
+        return self.method in ('GET', 'HEAD') or self.path.endswith(self.IDEMPOTENT_POST_ENDPOINTS)
+
+
+class MiddlewareChain:
+    """
+    请求中间件链，中间件为 async (ctx, call_next) -> ClientResponse，按列表顺序由外到内执行，
+    最内层为实际发送请求的 send(ctx)
+    """
+    def __init__(self, send, middlewares: list):
+        self.send = send
+        self.middlewares = list(middlewares)
+
+    async def __call__(self, ctx: RequestContext) -> aiohttp.ClientResponse:
+        async def _call(index, ctx_):
+            if index == len(self.middlewares):
+                return await self.send(ctx_)
+            return await self.middlewares[index](ctx_, lambda c: _call(index + 1, c))
+        return await _call(0, ctx)
+
+
+class RetryMiddleware:
+    """
+    带抖动的指数退避重试
+    幂等请求在网络异常、超时、5xx、429 时重试；非幂等的写请求只在连接建立失败（请求必然未发出）时重试
+    """
+    RETRIES = 3
+    BASE_DELAY = 0.5
+    MAX_DELAY = 8.0
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, retries: int = RETRIES):
+        self.retries = retries
+
+    def _delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.MAX_DELAY, self.BASE_DELAY * 2 ** attempt))
+
+    async def __call__(self, ctx: RequestContext, call_next):
+        while True:
+            try:
+                resp = await call_next(ctx)
+            except CircuitOpenError:
+                raise
+            except aiohttp.ClientConnectorError as e:
+                if ctx.attempt >= self.retries:
+                    raise
+                reason = e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if not ctx.idempotent or ctx.attempt >= self.retries:
+                    raise
+                reason = e
+            else:
+                if resp.status not in self.RETRY_STATUS or not ctx.idempotent or ctx.attempt >= self.retries:
+                    return resp
+                resp.release()
+                reason = f"HTTP {resp.status}"
+            delay = self._delay(ctx.attempt)
+            ctx.attempt += 1
+            utils.logger.warning(f"{ctx.method} {ctx.path} 第{ctx.attempt}次重试（{delay:.2f}s 后）：{reason!r}")
+            await asyncio.sleep(delay)
+
+
+class CircuitBreakerMiddleware:
+    """熔断打开时拒绝请求，并将限流/5xx 响应与网络异常计入失败"""
+    def __init__(self, breaker: CircuitBreaker):
+        self.breaker = breaker
+
+    async def __call__(self, ctx: RequestContext, call_next):
+        self.breaker.before_request()
+        try:
+            resp = await call_next(ctx)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.breaker.record(False)
+            raise
+        except BaseException:
+            # 取消等与账号状态无关的异常不计入失败
+            self.breaker.release_probe()
+            raise
+        _, message = await read_api_code(resp)
+        self.breaker.record(not is_throttled(resp, message))
+        return resp
+
+
+class RateLimitMiddleware:
+    """按接口类别限速，并根据响应反馈调整速率"""
+    def __init__(self, rate_limiter: RateLimiter):
+        self.rate_limiter = rate_limiter
+
+    async def __call__(self, ctx: RequestContext, call_next):
+        await self.rate_limiter.acquire(ctx.endpoint_class)
+        resp = await call_next(ctx)
+        _, message = await read_api_code(resp)
+        self.rate_limiter.feedback(ctx.endpoint_class, is_throttled(resp, message))
+        return resp
+
+
+class MetricsMiddleware:
+    """记录接口返回的非 0 错误码，HTTP 层的请求数、耗时与字节数由 session 的 TraceConfig 记录"""
+    def __init__(self, account: str):
+        self.account = account
+
+    async def __call__(self, ctx: RequestContext, call_next):
+        resp = await call_next(ctx)
+        code, _ = await read_api_code(resp)
+        if code not in (0, None):
+            metrics.registry.record_error('quark', self.account, metrics.normalize_endpoint(ctx.url), code)
+        return resp
+
+
+class TimeoutMiddleware:
+    """按接口设置超时（秒），覆盖连接建立与读取响应体"""
+    DEFAULT = 20
+    CONNECT = 10
+    TIMEOUTS = {
+        '/clouddrive/task': 10,
+        '/clouddrive/file/sort': 20,
+        '/clouddrive/share/sharepage/detail': 20,
+        '/clouddrive/file/info/path_list': 20,
+        '/clouddrive/share/sharepage/save': 30,
+        '/clouddrive/file/download': 30,
+    }
+
+    def __init__(self, timeouts: dict[str, float] = None, default: float = DEFAULT):
+        self.timeouts = {**self.TIMEOUTS, **(timeouts or {})}
+        self.default = default
+
+    def timeout_for(self, path: str) -> float:
+        for suffix, seconds in self.timeouts.items():
+            if path.endswith(suffix):
+                return seconds
+        return self.default
+
+    async def __call__(self, ctx: RequestContext, call_next):
+        seconds = self.timeout_for(ctx.path)
+        ctx.timeout = aiohttp.ClientTimeout(total=seconds, sock_connect=min(self.CONNECT, seconds))
+        return await call_next(ctx)
+
+
+class TaskPoller:
+    """
+    单个账号的后台任务轮询器
+    所有未完成的 task_id 由一个协程统一调度，轮询间隔按指数退避并带随机抖动，
+    任务结束时完成对应的 future，并记录任务从提交到完成的耗时（同时写入 metrics.registry）
+    """
+    INITIAL_INTERVAL = 0.3
+    MAX_INTERVAL = 3.0
+    BACKOFF = 1.6
+    JITTER = 0.2
+
+    def __init__(self, query, logger: logging.Logger = None, account: str = ''):
+        """
+        :param query: async (task_id, retry_index) -> resp_json，查询一次任务状态
+        :param logger:
+        :param account: 账号名，作为任务耗时指标的标签
+        """
+        self._query = query
+        self.account = account
+        self.logger = logger or utils.logger
+        self._tasks: dict[str, dict] = {}
+        self._runner: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self.completed = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    async def wait(self, task_id: str) -> dict:
+        """等待任务结束，返回最后一次 /task 查询的 resp_json"""
+        task = self._tasks.get(task_id)
+        if task is None:
+            now = time.monotonic()
+            task = {
+                'future': asyncio.get_running_loop().create_future(),
+                'submitted_at': now,
+                'next_poll_at': now,
+                'interval': self.INITIAL_INTERVAL,
+                'retry_index': 0,
+            }
+            self._tasks[task_id] = task
+            if self._runner is None or self._runner.done():
+                self._runner = asyncio.create_task(self._run())
+            self._wakeup.set()
+        return await asyncio.shield(task['future'])
+
+    async def _run(self):
+        while self._tasks:
+            now = time.monotonic()
+            due = [task_id for task_id, task in self._tasks.items() if task['next_poll_at'] <= now]
+            if due:
+                await asyncio.gather(*[self._poll(task_id) for task_id in due])
+                continue
+            next_poll_at = min(task['next_poll_at'] for task in self._tasks.values())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=next_poll_at - now)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, task_id: str):
+        task = self._tasks[task_id]
+        try:
+            resp_json = await self._query(task_id, task['retry_index'])
+            finished = resp_json.get("code") != 0 or resp_json["data"]["status"] != 0
+        except Exception as e:
+            # 只让该任务失败，轮询协程继续处理其他任务
+            del self._tasks[task_id]
+            if not task['future'].done():
+                task['future'].set_exception(e)
+            return
+        if finished:
+            del self._tasks[task_id]
+            self._record(task, resp_json)
+            if not task['future'].done():
+                task['future'].set_result(resp_json)
+            return
+        task['retry_index'] += 1
+        delay = task['interval'] * random.uniform(1 - self.JITTER, 1 + self.JITTER)
+        task['next_poll_at'] = time.monotonic() + delay
+        task['interval'] = min(task['interval'] * self.BACKOFF, self.MAX_INTERVAL)
+
+    def _record(self, task: dict, resp_json: dict):
+        elapsed = time.monotonic() - task['submitted_at']
+        self.completed += 1
+        self.total_seconds += elapsed
+        self.max_seconds = max(self.max_seconds, elapsed)
+        data = resp_json.get("data") or {}
+        metrics.registry.observe('quark_task_duration_seconds', elapsed, account=self.account,
+                                 code=resp_json.get("code"), status=data.get("status"))
+        title = data.get("task_title", "")
+        self.logger.debug(f"任务[{title}]完成，耗时{elapsed:.2f}s，轮询{task['retry_index'] + 1}次")
+
+    def stats(self) -> dict:
+        return {
+            'pending': len(self._tasks),
+            'completed': self.completed,
+            'avg_seconds': self.total_seconds / self.completed if self.completed else 0.0,
+            'max_seconds': self.max_seconds,
+        }
+
+    async def close(self):
+        if self._runner is not None and not self._runner.done():
+            self._runner.cancel()
+        for task in self._tasks.values():
+            if not task['future'].done():
+                task['future'].cancel()
+        self._tasks.clear()
+
+
+class SaveBatcher:
+    """
+    合并同一账号发往同一目录的转存请求
+    按 (pwd_id, to_pdir_fid) 分组，在 WINDOW 秒内或累计到 MAX_BATCH 个文件时合并为一次转存与一次任务轮询，
+    结果分发给每个调用方；合并后的批次失败时退回逐个请求转存，避免一个失效的 fid 拖累同批的其他请求。
+    合并转存可能在报错前已经部分完成，逐个重试前先列出目标目录，跳过已经存在的文件，避免转存出重名副本
+    """
+    WINDOW = 0.05
+    MAX_BATCH = 100
+
+    def __init__(self, save, list_names=None, window: float = WINDOW, max_batch: int = MAX_BATCH):
+        """
+        :param save: async (fid_list, fid_token_list, to_pdir_fid, pwd_id, stoken)，实际执行一次转存并等待任务结束
+        :param list_names: async (to_pdir_fid) -> 目录下已有的文件名集合，为 None 时退回逐个转存前不检查目标目录
+        """
+        self._save = save
+        self._list_names = list_names
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: dict[tuple[str, str], dict] = {}
+        self._running: set[asyncio.Task] = set()
+        self.batches = 0
+        self.requests = 0
+
+    async def submit(self, fid_list: list, fid_token_list: list, to_pdir_fid: str, pwd_id: str, stoken: str,
+                     file_names: list = None):
+        """
+        :param file_names: 与 fid_list 一一对应的文件名，合并转存失败后据此跳过目标目录中已经存在的文件
+        """
+        key = (pwd_id, to_pdir_fid)
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = {'fids': {}, 'requests': [], 'stoken': stoken, 'timer': None}
+            self._pending[key] = batch
+            batch['timer'] = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+        future = asyncio.get_running_loop().create_future()
+        batch['requests'].append((fid_list, fid_token_list, file_names, future))
+        # 同一批次内重复的 fid 只转存一次
+        for fid, token in zip(fid_list, fid_token_list):
+            batch['fids'].setdefault(fid, token)
+        batch['stoken'] = stoken
+        self.requests += 1
+        if len(batch['fids']) >= self.max_batch:
+            self._flush(key)
+        return await future
+
+    def _flush(self, key: tuple[str, str]):
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+        batch['timer'].cancel()
+        task = asyncio.ensure_future(self._run(key, batch))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, key: tuple[str, str], batch: dict):
+        pwd_id, to_pdir_fid = key
+        requests = batch['requests']
+        self.batches += 1
+        try:
+            result = await self._save(list(batch['fids'].keys()), list(batch['fids'].values()),
+                                      to_pdir_fid, pwd_id, batch['stoken'])
+        except Exception as e:
+            if len(requests) == 1:
+                self._resolve(requests[0][3], exception=e)
+                return
+            utils.logger.warning(f"合并转存 {len(batch['fids'])} 个文件失败，改为逐个请求转存：{e}")
+            existing = await self._existing_names(to_pdir_fid)
+            await asyncio.gather(*[self._run_single(request, to_pdir_fid, pwd_id, batch['stoken'], existing)
+                                   for request in requests])
+            return
+        for *_, future in requests:
+            self._resolve(future, result=result)
+
+    async def _existing_names(self, to_pdir_fid: str) -> set:
+        if self._list_names is None:
+            return set()
+        try:
+            return await self._list_names(to_pdir_fid)
+        except Exception as e:
+            utils.logger.warning(f'列出目录 {to_pdir_fid} 失败，逐个转存前不跳过已存在的文件：{e}')
+            return set()
+
+    async def _run_single(self, request: tuple, to_pdir_fid: str, pwd_id: str, stoken: str, existing: set):
+        fid_list, fid_token_list, file_names, future = request
+        if file_names is not None:
+            # 合并转存中已经落盘的文件不再重复转存
+            remaining = [(fid, token) for fid, token, name in zip(fid_list, fid_token_list, file_names)
+                         if name not in existing]
+            if not remaining:
+                self._resolve(future, result=True)
+                return
+            fid_list, fid_token_list = [list(i) for i in zip(*remaining)]
+        self.batches += 1
+        try:
+            self._resolve(future, result=await self._save(fid_list, fid_token_list, to_pdir_fid, pwd_id, stoken))
+        except Exception as e:
+            self._resolve(future, exception=e)
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result=None, exception: Exception = None):
+        if future.done():
+            return
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def stats(self) -> dict:
+        return {'requests': self.requests, 'batches': self.batches, 'pending': len(self._pending)}
+
+    async def close(self):
+        """立即发出尚在等待窗口中的批次并等待其完成"""
+        for key in list(self._pending):
+            self._flush(key)
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
 
 
 class DiskBase(ABC):
@@ -39,9 +959,16 @@ class DiskBase(ABC):
     def connect(self)->bool:
         pass
 class ParseQuarkShareLInk:
-    def __init__(self,link:str):
+    BASE_URL = "https://drive-pc.quark.cn"
+    stoken_store = StokenStore()
+    def __init__(self,link:str,base_url:str=None):
+        """
+        :param link: 分享链接
+        :param base_url: 接口地址，为 None 时使用类属性 BASE_URL（可整体指向本地模拟器）
+        """
         self.USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) quark-cloud-drive/3.14.2 Chrome/112.0.5615.165 Electron/24.1.3.8 Safari/537.36 Channel/pckk_other_ch"
-        self.BASE_URL = "https://drive-pc.quark.cn"
+        if base_url:
+            self.BASE_URL = base_url
         self.share_link = link
         self.session=None
         self.pdir_fid=None
@@ -49,6 +976,13 @@ class ParseQuarkShareLInk:
         self.passcode=None
         self._=None
         self.stoken=None
+        self.circuit_breaker=CircuitBreaker.for_account(QuarkTransport.SHARE_ACCOUNT)
+        self.request_chain=MiddlewareChain(self._send, [
+            RetryMiddleware(),
+            CircuitBreakerMiddleware(self.circuit_breaker),
+            MetricsMiddleware(QuarkTransport.SHARE_ACCOUNT),
+            TimeoutMiddleware(),
+        ])
         self._init_session()
     def _init_session(self):
         headers={
@@ -56,8 +990,16 @@ class ParseQuarkShareLInk:
             "Referer":self.BASE_URL,
 
         }
-        self.session=aiohttp.ClientSession(headers=headers)
+        # 分享链接不需要登录态，所有解析实例共用一个匿名 session
+        self.session=QuarkTransport.get_session(QuarkTransport.SHARE_ACCOUNT, headers=headers)
 
+    async def _request(self, method: str, url: str, *, params=None, json=None):
+        """经过 request_chain 发送请求，返回的响应由调用方负责释放"""
+        return await self.request_chain(RequestContext(method, url, params=params, json=json))
+
+    async def _send(self, ctx: RequestContext) -> aiohttp.ClientResponse:
+        return await self.session.request(method=ctx.method, url=ctx.url, params=ctx.kwargs.get("params"),
+                                          json=ctx.kwargs.get("json"), timeout=ctx.timeout)
 
     def _extract_url(self, url):
         # pwd_id
@@ -86,7 +1028,7 @@ class ParseQuarkShareLInk:
         url = f"{self.BASE_URL}/1/clouddrive/share/sharepage/token"
         querystring = {"pr": "ucpro", "fr": "pc"}
         payload = {"pwd_id": pwd_id, "passcode": passcode}
-        async with await self.session.request(method="post", url=url, params=querystring,json=payload) as resp:
+        async with await self._request(method="post", url=url, params=querystring,json=payload) as resp:
             resp_json = await resp.json()
 
             if resp_json.get("status") == 200:
@@ -94,17 +1036,34 @@ class ParseQuarkShareLInk:
             else:
                 return False, resp_json["message"]
 
-    async def parse_share_link(self):
-        result={}
+    async def parse_share_link(self, refresh: bool = False):
+        """
+        解析链接并获取 stoken，优先复用 stoken_store 中的 stoken，服务端拒绝时由 ls_dir 自动刷新
+        :param refresh: 忽略缓存，重新请求 stoken
+        """
         self.pwd_id,self.passcode,self.pdir_fid,self._=self. _extract_url(self.share_link)
+        stoken = None if refresh else self.stoken_store.get(self.pwd_id, self.passcode)
+        if stoken is not None:
+            self._, self.stoken = True, stoken
+            return
         self._,self.stoken = await self._get_stoken(self.pwd_id,self.passcode)
+        if self._:
+            self.stoken_store.put(self.pwd_id, self.passcode, self.stoken)
 
+    async def refresh_stoken(self) -> bool:
+        """丢弃当前 stoken 并重新获取，链接失效时返回 False，此时 stoken 为错误信息"""
+        self.stoken_store.invalidate(self.pwd_id, self.passcode, self.stoken)
+        await self.parse_share_link(refresh=True)
+        return self._
 
+    @staticmethod
+    def _is_stoken_expired(resp_json: dict) -> bool:
+        return resp_json.get("code") in STOKEN_EXPIRED_CODES or 'stoken' in str(resp_json.get("message", '')).lower()
 
-    async def ls_dir(self,pdir_fid:str,_fetch_share=0):
-        list_merge = []
-        page = 1
-        while True:
+
+
+    async def ls_dir(self,pdir_fid:str,_fetch_share=0,parallel=True):
+        async def fetch_page(page):
             url = f"{self.BASE_URL}/1/clouddrive/share/sharepage/detail"
             querystring = {
                 "pr": "ucpro",
@@ -114,60 +1073,89 @@ class ParseQuarkShareLInk:
                 "pdir_fid":pdir_fid,
                 "force": "0",
                 "_page": page,
-                "_size": "50",
+                "_size": LS_PAGE_SIZE,
                 "_fetch_banner": "0",
                 "_fetch_share": _fetch_share,
                 "_fetch_total": "1",
                 "_sort": "file_type:asc,file_name:desc",
             }
-            async with await self.session.request(method="get", url=url, params=querystring) as resp:
-                resp_json = await resp.json()
-                if resp_json["code"] != 0:
-                    return {"error": resp_json["message"]}
-                if resp_json["data"]["list"]:
-                    list_merge += resp_json["data"]["list"]
-                    page += 1
-                else:
-                    break
-                if len(list_merge) >= resp_json["metadata"]["_total"]:
-                    break
+            async with await self._request(method="get", url=url, params=querystring) as resp:
+                return await resp.json()
+
+        resp_json, list_merge = await fetch_pages(fetch_page, parallel=parallel)
+        if list_merge is None and self._is_stoken_expired(resp_json):
+            utils.logger.info(f'分享 {self.pwd_id} 的 stoken 已失效，重新获取')
+            if await self.refresh_stoken():
+                resp_json, list_merge = await fetch_pages(fetch_page, parallel=parallel)
+        if list_merge is None:
+            return {"error": resp_json["message"]}
         resp_json["data"]["list"] = list_merge
 
         return resp_json["data"]
 
     async def close(self):
-        await self.session.close()
+        # session 由 QuarkTransport 统一管理，进程退出时调用 QuarkTransport.close() 关闭
+        self.session=None
 
 class QuarkDisk(DiskBase):
-
+    ACCOUNT_URL = "https://pan.quark.cn"
+    GET_FIDS_CONCURRENCY = 4  # 每个账号同时进行的 path_list 请求数
+    RENAME_CONCURRENCY = 4  # rename_many 同时进行的改名请求数
+    SHARE_CONCURRENCY = 8  # create_share_links 同时进行的分享数
+    WALK_CONCURRENCY = 8  # walk 同时列出的目录数
+    # path_list 对不存在的路径可能不返回该条目，也可能以这些错误码拒绝整个请求，两种情况都视为路径不存在
+    PATH_NOT_FOUND_CODES = (41016,)
+    # ensure_dir 进行中的请求，键为 (账号名, 目录路径)；结果写入各实例的 fid_cache
+    _ensure_dir_inflight: dict[tuple[str, str], asyncio.Future] = {}
 
     def __init__(self,config: dict[str, any]):
         self.session=None
         self.cookie=config.get("cookie")
         self.mparam=self._parse_mparam_from_cookie()
-        self.fid_cache:dict[str, str]={"/":"0"}
+        self.fid_cache=FidCache()
+        self.fid_cache.put('/', {'fid': '0', 'file_path': '/'})
+        self._path_list_semaphore=asyncio.Semaphore(self.GET_FIDS_CONCURRENCY)
         super().__init__(config)
+        # 配置 base_url 时所有接口（含账号信息）都指向该地址，如本地模拟器 QuarkEmulator
+        self.BASE_URL=config.get("base_url", self.BASE_URL)
+        self.ACCOUNT_URL=config.get("base_url", self.ACCOUNT_URL)
+        self.task_poller=TaskPoller(self._fetch_task, self.logger, account=self.name)
+        self.save_batcher=SaveBatcher(self._save_and_wait, self._list_names)
+        self.rate_limiter=RateLimiter()
+        self.circuit_breaker=CircuitBreaker.for_account(self.name)
+        # 由外到内：重试 -> 熔断 -> 限速 -> 指标 -> 超时，每次重试都重新经过熔断与限速
+        self.request_chain=MiddlewareChain(self._send, [
+            RetryMiddleware(),
+            CircuitBreakerMiddleware(self.circuit_breaker),
+            RateLimitMiddleware(self.rate_limiter),
+            MetricsMiddleware(self.name),
+            TimeoutMiddleware(),
+        ])
+        self._write_listeners=[]
         self._init_session()
+    @property
+    def available(self) -> bool:
+        """账号未熔断，可以接收新的请求"""
+        return self.circuit_breaker.available
     async  def close(self):
-        await self.session.close()
+        await self.save_batcher.close()
+        await self.task_poller.close()
+        if self.session is not None:
+            await QuarkTransport.release(self.name)
+        self.session=None
     def _init_session(self):
 
         if not self.session:
-            self.session= aiohttp.ClientSession(
+            # 每个账号独立 cookie jar，底层连接池由 QuarkTransport 共享；同账号的其他实例仍在使用时 close 不会关闭 session
+            self.session= QuarkTransport.acquire(
+                self.name,
                 headers={"User-Agent":self.USER_AGENT,
                           "accept": "application/json, text/plain, */*",
             "origin": "https://pan.quark.cn",
             "referer": "https://pan.quark.cn/",
-            "x-request-id": str(random.randint(10**15, 10**16 - 1)),
                          },
+                cookie=self.config["cookie"],
             )
-            # 解析 Cookie
-            cookie = SimpleCookie()
-            cookie.load(self.config["cookie"])
-
-
-            for key, morsel in cookie.items():
-                self.session.cookie_jar.update_cookies({key: morsel.value})
     def _parse_mparam_from_cookie(self) -> dict[str, str]:
         mparam = {}
         kps_match = re.search(r"(?<!\w)kps=([a-zA-Z0-9%+/=]+)[;&]?", self.cookie)
@@ -182,23 +1170,27 @@ class QuarkDisk(DiskBase):
         return mparam
     async def _request(self, method: str, url: str, *,
                        params=None, data=None, json=None, headers=None):
-
-        self.session.headers.update({ "x-request-id": str(random.randint(10**15, 10**16 - 1)),})
-        # 合并默认 params 和调用时传入的 params
-
-        result=   await  self.session.request(
-            method=method,
-            url=url,
-            params=params,
-            data=data,
-            json=json
+        """经过 request_chain 发送请求，返回的响应由调用方负责释放"""
+        ctx = RequestContext(method, url, params=params, data=data, json=json, headers=headers)
+        return await self.request_chain(ctx)
+
+    async def _send(self, ctx: RequestContext) -> aiohttp.ClientResponse:
+        # x-request-id 按请求生成，避免并发请求互相覆盖 session 级的请求头
+        request_headers = {"x-request-id": str(random.randint(10**15, 10**16 - 1))}
+        if ctx.kwargs.get("headers"):
+            request_headers.update(ctx.kwargs["headers"])
+        return await self.session.request(
+            method=ctx.method,
+            url=ctx.url,
+            params=ctx.kwargs.get("params"),
+            data=ctx.kwargs.get("data"),
+            json=ctx.kwargs.get("json"),
+            headers=request_headers,
+            timeout=ctx.timeout,
         )
 
-
-        return result
-
     async  def connect(self) -> bool:
-        url="https://pan.quark.cn/account/info"
+        url=f"{self.ACCOUNT_URL}/account/info"
         params={
             'fr':'pc',
             'platform':'pc'
@@ -212,23 +1204,30 @@ class QuarkDisk(DiskBase):
             except Exception as e:
                 self.logger.error(e)
 
-    async def mkdir(self,dir_path):
-        url = f"{self.BASE_URL}/1/clouddrive/file"
-        querystring = {"pr": "ucpro", "fr": "pc", "uc_param_str": ""}
-        payload = {
-            "pdir_fid": "0",
-            "file_name": "",
-            "dir_path": dir_path,
-            "dir_init_lock": False,
-        }
-        async with await self._request(method="POST", url=url, params=querystring,json=payload) as resp:
-            resp_json=resp.json()
-            return resp_json
+    async def get_capacity(self) -> dict:
+        """
+        查询账号容量
+        :return: {'total': 总容量, 'used': 已用容量, 'free': 剩余容量}，单位字节
+        """
+        url = f"{self.BASE_URL}/1/clouddrive/member"
+        querystring = {"pr": "ucpro", "fr": "pc", "uc_param_str": "", "fetch_subscribe": "true",
+                       "_ch": "home", "fetch_identity": "true"}
+        async with await self._request("GET", url, params=querystring) as resp:
+            resp_json = await resp.json()
+        if resp_json.get("code") != 0:
+            raise RuntimeError(f"查询容量失败：{resp_json.get('message')}")
+        total = resp_json["data"]["total_capacity"]
+        used = resp_json["data"]["use_capacity"]
+        return {'total': total, 'used': used, 'free': max(total - used, 0)}
 
     async  def ls_dir(self, pdir_fid, **kwargs):
-        file_list = []
-        page = 1
-        while True:
+        """
+        列出目录下所有文件
+        :param pdir_fid:
+        :param kwargs: fetch_full_path; parallel 默认为 True，首页之后的分页并发拉取
+        :return: 文件列表，出错时返回 {"error": message}
+        """
+        async def fetch_page(page):
             url = f"{self.BASE_URL}/1/clouddrive/file/sort"
             querystring = {
                 "pr": "ucpro",
@@ -236,25 +1235,58 @@ class QuarkDisk(DiskBase):
                 "uc_param_str": "",
                 "pdir_fid": pdir_fid,
                 "_page": page,
-                "_size": "50",
+                "_size": LS_PAGE_SIZE,
                 "_fetch_total": "1",
                 "_fetch_sub_dirs": "0",
                 "_sort": "file_type:asc,file_name:desc",
                 "_fetch_full_path": kwargs.get("fetch_full_path", 0),
             }
             async with await self._request(method="GET", url=url, params=querystring) as resp:
-                resp_json = await resp.json()
-                if resp_json["code"] != 0:
-                    return {"error": resp_json["message"]}
-                if resp_json["data"]["list"]:
-                    file_list += resp_json["data"]["list"]
-                    page += 1
-                else:
-                    break
-                if len(file_list) >= resp_json["metadata"]["_total"]:
-                    break
+                return await resp.json()
+
+        resp_json, file_list = await fetch_pages(fetch_page, parallel=kwargs.get("parallel", True))
+        if file_list is None:
+            return {"error": resp_json["message"]}
         return file_list
 
+    async def walk(self, root: str = settings.STORAGE_BASE_PATH, max_depth: Optional[int] = None, predicate=None):
+        """
+        遍历目录树，流式产出 (path, entry)，entry 为 ls_dir 返回的单个文件信息
+        已发现的目录并发列出，并发数受 WALK_CONCURRENCY 限制，遍历到的目录会写入 fid_cache
+        :param root: 起始目录路径
+        :param max_depth: 最大深度，root 下的直接子项深度为 0，为 None 时不限制
+        :param predicate: (dir_name) -> bool，返回 False 时不进入该目录（目录本身仍会产出）
+        :return:
+        """
+        root = FidCache.normalize(root)
+        fids = await self.get_fids([root])
+        if not fids:
+            raise RuntimeError(f'目录{root}不存在')
+        semaphore = asyncio.Semaphore(self.WALK_CONCURRENCY)
+
+        async def _list(path, fid, depth):
+            async with semaphore:
+                return path, depth, await self.ls_dir(fid)
+
+        pending = {asyncio.ensure_future(_list(root, fids[0]['fid'], 0))}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    path, depth, file_list = task.result()
+                    if isinstance(file_list, dict):
+                        raise RuntimeError(f'列出目录{path}失败：{file_list["error"]}')
+                    for entry in file_list:
+                        entry_path = posixpath.join(path, entry['file_name'])
+                        if entry['file_type'] == 0:
+                            self.fid_cache.put(entry_path, {'fid': entry['fid'], 'file_path': entry_path})
+                            if (max_depth is None or depth < max_depth) and (predicate is None or predicate(entry['file_name'])):
+                                pending.add(asyncio.ensure_future(_list(entry_path, entry['fid'], depth + 1)))
+                        yield entry_path, entry
+        finally:
+            for task in pending:
+                task.cancel()
+
     async def download(self, fids):
         url = f"{self.BASE_URL}/1/clouddrive/file/download"
         querystring = {"pr": "ucpro", "fr": "pc", "uc_param_str": ""}
@@ -264,39 +1296,128 @@ class QuarkDisk(DiskBase):
             # cookie_str = "; ".join([f"{key}={value}" for key, value in set_cookie.items()])
             return await resp.json(), set_cookie_headers
 
+    async def download_to(self, fid: str, dest: str, connections: int = RangedDownloader.CONNECTIONS) -> str:
+        """
+        多连接分段下载网盘文件到本地，支持断点续传
+        :param fid: 文件 fid
+        :param dest: 目标文件路径，为已存在的目录时使用网盘中的文件名
+        :param connections: 同时下载的分段数
+        :return: 本地文件路径
+        """
+        resp_json, _ = await self.download([fid])
+        if resp_json.get("code") != 0 or not resp_json.get("data"):
+            raise RuntimeError(f"获取下载地址失败：{resp_json.get('message')}")
+        file_info = resp_json["data"][0]
+        if os.path.isdir(dest):
+            dest = os.path.join(dest, file_info["file_name"])
+        # 下载接口返回的 Set-Cookie 已写入账号的 cookie jar
+        headers = {
+            "User-Agent": self.USER_AGENT,
+            "Referer": "https://pan.quark.cn/",
+            "Cookie": await utils.get_cookie_str(self.session),
+        }
+        downloader = RangedDownloader(QuarkTransport.get_session('__download__'), connections=connections)
+        return await downloader.download(file_info["download_url"], dest, headers=headers,
+                                         expected_size=file_info.get("size"))
+
     async  def get_fids(self, file_paths:list[str]):
         """
-        批量根据文件路径获取文件fid
+        批量根据文件路径获取文件fid，命中 fid_cache 的路径不再请求接口
         :param file_paths:
-        :return:
+        :return: 与输入顺序一致的条目列表，不存在的路径不返回
+        :raise GetFidsError: 有分组请求失败时抛出，携带失败的路径与其余分组的结果
          """
+        results = {}
+        missing_paths = []
+        for file_path in file_paths:
+            path = FidCache.normalize(file_path)
+            if path in results or path in missing_paths:
+                continue
+            entry = self.fid_cache.get(path)
+            if entry is not None:
+                results[path] = entry
+            else:
+                missing_paths.append(path)
+
+        # 未命中缓存的路径按 50 个一组并发请求，并发数受账号级信号量限制
+        chunks = [missing_paths[i:i + 50] for i in range(0, len(missing_paths), 50)]
+        chunk_results = await asyncio.gather(*[self._get_fids_chunk(chunk) for chunk in chunks],
+                                             return_exceptions=True)
+        errors = []
+        for chunk, chunk_result in zip(chunks, chunk_results):
+            if isinstance(chunk_result, asyncio.CancelledError):
+                raise chunk_result
+            if isinstance(chunk_result, BaseException):
+                errors.append((chunk, chunk_result))
+                continue
+            for path, entry in chunk_result:
+                self.fid_cache.put(path, entry)
+                results[path] = entry
+
+        fids = [
+            results[FidCache.normalize(file_path)]
+            for file_path in file_paths
+            if FidCache.normalize(file_path) in results
+        ]
+        if errors:
+            failed_paths = [path for chunk, _ in errors for path in chunk]
+            message = '; '.join(str(e) for _, e in errors)
+            self.logger.error(f"获取目录ID失败：{failed_paths}, {message}")
+            raise GetFidsError(f"获取目录ID：失败, {message}", failed_paths=failed_paths, fids=fids)
+        return fids
 
-        fids = []
-        # for file_path in file_paths:
-        #     if self.fid_cache.get(file_path) is not None:
-        #         fids.append( self.fid_cache[file_paths])
-        while True:
-            url = f"{self.BASE_URL}/1/clouddrive/file/info/path_list"
-            querystring = {"pr": "ucpro", "fr": "pc"}
-            payload = {"file_path": file_paths[:50], "namespace": "0"}
+    async def _get_fids_chunk(self, chunk: list[str]) -> list[tuple[str, dict]]:
+        url = f"{self.BASE_URL}/1/clouddrive/file/info/path_list"
+        querystring = {"pr": "ucpro", "fr": "pc"}
+        payload = {"file_path": chunk, "namespace": "0"}
+        async with self._path_list_semaphore:
             async with await self._request(method="post", url=url, params=querystring,json=payload) as resp:
                 resp_json = await resp.json()
-                if resp_json["code"] == 0:
-                    fids += resp_json["data"]
-                    file_paths = file_paths[50:]
-                else:
-                    self.logger.info()
-                    raise RuntimeError(f"获取目录ID：失败, {resp_json['message']}")
-                if len(file_paths) == 0:
-                    break
+        if resp_json["code"] in self.PATH_NOT_FOUND_CODES:
+            if len(chunk) == 1:
+                return []
+            # 整组被拒绝时无法得知是哪些路径不存在，逐个查询
+            results = await asyncio.gather(*[self._get_fids_chunk([path]) for path in chunk])
+            return [item for result in results for item in result]
+        if resp_json["code"] != 0:
+            raise RuntimeError(resp_json['message'])
+        return self._match_path_list(chunk, resp_json["data"])
 
-        return fids
-    async def mkdir(self, dir_path:str)->bool:
+    @staticmethod
+    def _match_path_list(paths: list[str], data: list[dict]) -> list[tuple[str, dict]]:
+        """将 path_list 接口返回的条目与请求路径对应，优先按 file_path 匹配，匹配不上时按顺序对应"""
+        by_path = {
+            FidCache.normalize(entry['file_path']): entry
+            for entry in data if entry.get('file_path')
+        }
+        if len(data) == len(paths) and not all(path in by_path for path in paths):
+            return list(zip(paths, data))
+        return [(path, by_path[path]) for path in paths if path in by_path]
+
+    def add_write_listener(self, listener):
         """
-        可跨级创建目录
-        :param dir_path:例如：‘/1级目录/2级目录’
-        :return:true/false
+        注册写操作监听器，写操作成功后以 listener(event, payload) 的形式同步调用
+        event 为 mkdir/rename/move/delete/save 之一；mkdir 的 ancestor_fids 为根目录到父目录各级的 fid，无法确定时为 None
         """
+        self._write_listeners.append(listener)
+
+    def remove_write_listener(self, listener):
+        if listener in self._write_listeners:
+            self._write_listeners.remove(listener)
+
+    def _notify_write(self, event: str, **payload):
+        for listener in list(self._write_listeners):
+            try:
+                listener(event, payload)
+            except Exception as e:
+                self.logger.error(f"写操作监听器处理{event}失败：{e}")
+
+    def _invalidate_fids(self, fid_list: list[str]):
+        """写操作成功后使相关路径的缓存失效"""
+        for fid in fid_list:
+            self.fid_cache.invalidate_fid(fid)
+
+    async def _mkdir(self, dir_path:str)->dict:
         url = f"{self.BASE_URL}/1/clouddrive/file"
         querystring = {"pr": "ucpro", "fr": "pc", "uc_param_str": ""}
         payload = {
@@ -307,11 +1428,75 @@ class QuarkDisk(DiskBase):
         }
         async with await self._request(method="post",params=querystring, url=url, json=payload) as resp:
             resp_json = await resp.json()
-            if resp_json["code"] == 0:
+        if resp_json["code"] != 0:
+            raise Exception(f'创建{dir_path}失败：{resp_json.get("message")}')
+        fid = resp_json["data"].get("fid")
+        if fid:
+            path = FidCache.normalize(dir_path)
+            self.fid_cache.put(path, {"fid": fid, "file_path": path})
+            ancestor_fids = await self._ancestor_fids(path) if self._write_listeners else None
+            self._notify_write("mkdir", path=path, fid=fid, ancestor_fids=ancestor_fids)
+        return resp_json["data"]
 
-                return resp_json["data"]["finish"]
-            else:
-                raise Exception(f'创建{dir_path}失败：{resp.text}')
+    async def _ancestor_fids(self, path: str) -> Optional[list[str]]:
+        """
+        从根目录到父目录各级目录的 fid，dir_path 会一并创建缺少的中间目录，各级都可能是新建的
+        优先读 fid_cache（删除等操作可能已清空缓存），一次 path_list 查询其余各级，查询失败时返回 None
+        """
+        parts = path.strip('/').split('/')[:-1]
+        prefixes = ['/' + '/'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+        try:
+            fids = await self.get_fids(prefixes)
+        except GetFidsError:
+            return None
+        if len(fids) != len(prefixes):
+            return None
+        return ['0'] + [entry['fid'] for entry in fids]
+
+    async def mkdir(self, dir_path:str)->bool:
+        """
+        可跨级创建目录
+        :param dir_path:例如：‘/1级目录/2级目录’
+        :return:true/false
+        """
+        return (await self._mkdir(dir_path))["finish"]
+
+    async def ensure_dir(self, dir_path:str)->str:
+        """
+        确保目录存在（相当于 mkdir -p），返回目录 fid
+        结果写入 fid_cache，随写操作一同失效，同一账号同一路径的并发调用合并为一次请求
+        :param dir_path:例如：‘/1级目录/2级目录’
+        :return: fid
+        """
+        key = (self.name, FidCache.normalize(dir_path))
+        entry = self.fid_cache.get(key[1])
+        if entry is not None:
+            return entry['fid']
+        future = QuarkDisk._ensure_dir_inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._ensure_dir(key[1]))
+            QuarkDisk._ensure_dir_inflight[key] = future
+            future.add_done_callback(lambda _: QuarkDisk._ensure_dir_inflight.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def _ensure_dir(self, dir_path:str)->str:
+        # 查询失败（网络、超时、PATH_NOT_FOUND_CODES 以外的错误码等）时直接抛出，只有确认目录不存在才创建，避免重复创建同名目录
+        fids = await self.get_fids([dir_path])
+        if fids:
+            fid = fids[0]['fid']
+        else:
+            try:
+                fid = (await self._mkdir(dir_path)).get('fid')
+            except Exception:
+                # 目录可能已被其他进程创建
+                fids = await self.get_fids([dir_path])
+                if not fids:
+                    raise
+                fid = fids[0]['fid']
+            if not fid:
+                fid = (await self.get_fids([dir_path]))[0]['fid']
+        self.fid_cache.put(dir_path, {"fid": fid, "file_path": dir_path})
+        return fid
 
     async   def _save_file(self, fid_list, fid_token_list, to_pdir_fid, pwd_id, stoken):
         url = f"{self.BASE_URL}/1/clouddrive/share/sharepage/save"
@@ -337,39 +1522,41 @@ class QuarkDisk(DiskBase):
 
             return resp_json
 
+    async def _fetch_task(self, task_id, retry_index=0):
+        url = f"{self.BASE_URL}/1/clouddrive/task"
+        querystring = {
+            "pr": "ucpro",
+            "fr": "pc",
+            "uc_param_str": "",
+            "task_id": task_id,
+            "retry_index": retry_index,
+            "__dt": int(random.uniform(1, 5) * 60 * 1000),
+            "__t": datetime.now().timestamp(),
+        }
+        async with await self._request(method="get", url=url, params=querystring) as resp:
+            return await resp.json()
+
     async def _query_task(self, task_id):
-        retry_index = 0
-        while True:
-            url = f"{self.BASE_URL}/1/clouddrive/task"
-            querystring = {
-                "pr": "ucpro",
-                "fr": "pc",
-                "uc_param_str": "",
-                "task_id": task_id,
-                "retry_index": retry_index,
-                "__dt": int(random.uniform(1, 5) * 60 * 1000),
-                "__t": datetime.now().timestamp(),
-            }
-            async with await self._request(method="get", url=url, params=querystring) as resp:
-                resp_json = await resp.json()
-                if resp_json["data"]["status"] != 0:
-                    if retry_index > 0:
-                        print()
-                    break
-                else:
-                    if retry_index == 0:
-                        print(
-                            f"正在等待[{resp_json['data']['task_title']}]执行结果",
-                            end="",
-                            flush=True,
-                        )
-                    else:
-                        print(".", end="", flush=True)
-                    retry_index += 1
-                    await asyncio.sleep(0.5)
-        return resp_json
-    async def save_file(self,fid_list, fid_token_list, to_pdir_fid:str, pwd_id, stoken):
+        """等待后台任务结束，由账号共用的 task_poller 统一轮询"""
+        return await self.task_poller.wait(task_id)
+    async def save_file(self,fid_list, fid_token_list, to_pdir_fid:str, pwd_id, stoken, batch=False, file_names=None):
+        """
+        转存分享中的文件
+        :param batch: 为 True 时经过 save_batcher 与同一目录的其他转存请求合并
+        :param file_names: 与 fid_list 对应的文件名，合并转存失败后逐个重试时跳过目标目录中已存在的文件
+        :return: True，失败时抛出异常
+        """
+        if batch:
+            return await self.save_batcher.submit(fid_list, fid_token_list, to_pdir_fid, pwd_id, stoken, file_names)
+        return await self._save_and_wait(fid_list, fid_token_list, to_pdir_fid, pwd_id, stoken)
+
+    async def _list_names(self, pdir_fid: str) -> set:
+        file_list = await self.ls_dir(pdir_fid)
+        if isinstance(file_list, dict):
+            raise RuntimeError(file_list['error'])
+        return {file['file_name'] for file in file_list}
 
+    async def _save_and_wait(self,fid_list, fid_token_list, to_pdir_fid:str, pwd_id, stoken):
         save_file_return =await self._save_file(
             fid_list, fid_token_list, to_pdir_fid, pwd_id, stoken
         )
@@ -378,6 +1565,7 @@ class QuarkDisk(DiskBase):
             task_id = save_file_return["data"]["task_id"]
             query_task_return =await self._query_task(task_id)
             if query_task_return["code"] == 0:
+                self._notify_write("save", to_pdir_fid=to_pdir_fid)
                 return True
             else:
                 err_msg = query_task_return["message"]
@@ -434,12 +1622,14 @@ class QuarkDisk(DiskBase):
             task_data = task_result.get("data", {})
             task_status = task_data.get("status")
             if task_status != 0:  # Status 1 typically means success for tasks
+                self._invalidate_fids(fid_list)
+                self._notify_write("delete", fids=fid_list)
                 return True
             else:
                 raise RuntimeError(f"删除任务失败或未成功完成,最终任务状态: {task_status}")
     @staticmethod
-    async  def parse_share_url(shari_link:str)->ParseQuarkShareLInk:
-        parse= ParseQuarkShareLInk(shari_link)
+    async  def parse_share_url(shari_link:str,base_url:str=None)->ParseQuarkShareLInk:
+        parse= ParseQuarkShareLInk(shari_link,base_url)
         await parse.parse_share_link()
         return parse
     async def _get_share_details(self, share_id: str) -> Optional[Dict]:
@@ -540,6 +1730,35 @@ class QuarkDisk(DiskBase):
                     'code':code,
                     'message':message,
                 },ensure_ascii=False))
+    async def create_share_links(self, fid_list: list, title: str = '', password: Optional[str] = None,
+                                 expired_type: int = 1, url_type: int = 1) -> dict[str, dict]:
+        """
+        为每个 fid 单独创建分享，多个分享的 创建 -> 轮询任务 -> 获取详情 流水线并发进行，
+        任务轮询由账号共用的 task_poller 合并，实际请求速率受 rate_limiter 限制
+        :param fid_list: 要分享的文件或文件夹 fid，每个 fid 一个分享
+        :return: {fid: {'share_link': 分享链接, 'code': 接口返回码, 'message': 错误信息}}，
+                 风控等任务失败时保留接口返回的 code（如 41026、41028），请求异常时 code 为 None
+        """
+        results = {}
+        semaphore = asyncio.Semaphore(self.SHARE_CONCURRENCY)
+
+        async def _create(fid):
+            async with semaphore:
+                try:
+                    share_link = await self.create_share_link([fid], title, password, expired_type, url_type)
+                    results[fid] = {'share_link': share_link, 'code': 0, 'message': ''}
+                except Exception as e:
+                    # create_share_link 在任务失败时以 {'code':, 'message':} 的 JSON 作为异常信息
+                    try:
+                        error = json.loads(str(e))
+                        code, message = error['code'], error['message']
+                    except (ValueError, TypeError, KeyError):
+                        code, message = None, str(e)
+                    results[fid] = {'share_link': None, 'code': code, 'message': message}
+
+        await asyncio.gather(*[_create(fid) for fid in dict.fromkeys(fid_list)])
+        return {fid: results[fid] for fid in fid_list}
+
     async def rename(self, fid, file_name):
         url = f"{self.BASE_URL}/1/clouddrive/file/rename"
         querystring = {"pr": "ucpro", "fr": "pc", "uc_param_str": ""}
@@ -548,8 +1767,40 @@ class QuarkDisk(DiskBase):
             "POST", url, json=payload, params=querystring
         ) as resp:
             response =await resp.json()
+            if response.get("code") == 0:
+                self._invalidate_fids([fid])
+                self._notify_write("rename", fid=fid, file_name=file_name)
             return response
 
+    async def rename_many(self, mapping: dict[str, str], current_names: dict[str, str] = None) -> dict[str, dict]:
+        """
+        并发批量改名，实际请求速率受 rate_limiter 中 write 类令牌桶限制
+        :param mapping: {fid: 新文件名}
+        :param current_names: {fid: 当前文件名}，提供时跳过名称已经正确的文件
+        :return: {fid: {'file_name': 新文件名, 'code': 接口返回码, 'message': 错误信息, 'skipped': 是否跳过}}，
+                 请求异常时 code 为 None
+        """
+        results = {}
+        semaphore = asyncio.Semaphore(self.RENAME_CONCURRENCY)
+
+        async def _rename(fid, file_name):
+            async with semaphore:
+                try:
+                    response = await self.rename(fid, file_name)
+                    results[fid] = {'file_name': file_name, 'code': response.get("code"),
+                                    'message': response.get("message", ''), 'skipped': False}
+                except Exception as e:
+                    results[fid] = {'file_name': file_name, 'code': None, 'message': str(e), 'skipped': False}
+
+        tasks = []
+        for fid, file_name in mapping.items():
+            if current_names is not None and current_names.get(fid) == file_name:
+                results[fid] = {'file_name': file_name, 'code': 0, 'message': '', 'skipped': True}
+            else:
+                tasks.append(_rename(fid, file_name))
+        await asyncio.gather(*tasks)
+        return {fid: results[fid] for fid in mapping}
+
     async def move(self,fid_list:[],pdir_fid:str):
         url = f"{self.BASE_URL}/1/clouddrive/file/move"
         querystring = {"pr": "ucpro", "fr": "pc", "uc_param_str": ""}
@@ -566,6 +1817,8 @@ class QuarkDisk(DiskBase):
                 if code == 0:
                     status = task_result["data"]["status"]
                     if status==2:
+                        self._invalidate_fids(fid_list)
+                        self._notify_write("move", fids=fid_list, to_pdir_fid=pdir_fid)
                         return True
                 raise RuntimeError(f'移动文件发生错误{task_result}')
             except Exception as e:
@@ -611,5 +1864,6 @@ async def main():
 
     await  quark_cloud.close()
     # await parse_share.close()
+    await QuarkTransport.close()
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,175 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import settings
+import utils
+from QuarkDisk import CircuitBreaker, CircuitOpenError, QuarkDisk
+
+
+class QuarkDiskPool:
+    """
+    持有所有夸克账号的 QuarkDisk，按策略把操作路由到某个账号，并记录每个账号进行中的任务数与错误情况
+    策略：
+      least_loaded  进行中任务最少、最近错误最少的可用账号
+      sticky        同一个 key（如资源的网盘路径）始终落在同一个账号，没有绑定时使用主账号（数据默认存放在主账号），
+                    因此不会把新的 key 分散到其他账号，需要分散时使用 least_loaded / quota 选出账号后再 pin
+      quota         剩余空间最多的可用账号
+    熔断中的账号不参与 least_loaded / quota 的选择
+    """
+    POLICIES = ('least_loaded', 'sticky', 'quota')
+    ERROR_PENALTY = 2  # least_loaded 中每次连续错误相当于的进行中任务数
+    CAPACITY_TTL = 600  # 容量信息的缓存时间（秒）
+
+    def __init__(self, quark_disks: list[QuarkDisk], policy: str = 'least_loaded'):
+        """
+        :param quark_disks: 第一个为主账号
+        :param policy: 默认策略
+        """
+        if not quark_disks:
+            raise ValueError('至少需要一个夸克账号')
+        if policy not in self.POLICIES:
+            raise ValueError(f'未知的策略：{policy}')
+        self.quark_disks = list(quark_disks)
+        self.disks = {quark_disk.name: quark_disk for quark_disk in quark_disks}
+        self.policy = policy
+        self._stats = {
+            quark_disk.name: {'in_flight': 0, 'completed': 0, 'errors': 0, 'consecutive_errors': 0, 'last_error': None}
+            for quark_disk in quark_disks
+        }
+        self._pins: dict[str, str] = {}
+        self._capacity: dict[str, dict] = {}
+        self._capacity_lock = asyncio.Lock()
+
+    @classmethod
+    def from_settings(cls, policy: str = 'least_loaded', names: list[str] = None) -> 'QuarkDiskPool':
+        """
+        :param names: 参与账号池的账号名，为 None 时使用 settings.QUARK_POOL_ACCOUNTS，按该顺序排列，第一个为主账号
+        """
+        names = names if names is not None else settings.QUARK_POOL_ACCOUNTS
+        configs = {config['name']: config for config in settings.STORAGE_CONFIG['quark']}
+        missing = [name for name in names if name not in configs]
+        if missing:
+            raise ValueError(f'STORAGE_CONFIG 中没有账号：{missing}')
+        return cls([QuarkDisk(configs[name]) for name in names], policy)
+
+    @property
+    def primary(self) -> QuarkDisk:
+        return self.quark_disks[0]
+
+    def others(self, name: str = None) -> list[QuarkDisk]:
+        """除 name（默认主账号）以外的账号"""
+        name = name or self.primary.name
+        return [quark_disk for quark_disk in self.quark_disks if quark_disk.name != name]
+
+    def available(self) -> list[QuarkDisk]:
+        return [quark_disk for quark_disk in self.quark_disks if quark_disk.available]
+
+    def pin(self, key: str, name: str):
+        """将 key 绑定到账号 name，之后 sticky 策略始终返回该账号"""
+        if name not in self.disks:
+            raise KeyError(f'账号{name}不在账号池中')
+        self._pins[key] = name
+
+    async def pick(self, key: str = None, policy: str = None, exclude: tuple = ()) -> QuarkDisk:
+        """
+        按策略选择账号，不占用进行中的任务数
+        :param key: sticky 策略使用的键
+        :param policy: 为 None 时使用默认策略
+        :param exclude: 不参与选择的账号名
+        """
+        policy = policy or self.policy
+        if policy == 'sticky':
+            if key is None:
+                raise ValueError('sticky 策略需要提供 key')
+            name = self._pins.setdefault(key, self.primary.name)
+            # 数据只在绑定的账号中，熔断时由调用方的请求抛出 CircuitOpenError，不切换账号
+            return self.disks[name]
+
+        candidates = [quark_disk for quark_disk in self.available() if quark_disk.name not in exclude]
+        if not candidates:
+            raise CircuitOpenError('*', CircuitBreaker.COOLDOWN)
+        if policy == 'quota':
+            capacity = await self.refresh_capacity()
+            return max(candidates, key=lambda quark_disk: (capacity.get(quark_disk.name, {}).get('free', 0),
+                                                           -self._load(quark_disk.name)))
+        return min(candidates, key=lambda quark_disk: self._load(quark_disk.name))
+
+    def _load(self, name: str) -> int:
+        stats = self._stats[name]
+        return stats['in_flight'] + stats['consecutive_errors'] * self.ERROR_PENALTY
+
+    @asynccontextmanager
+    async def use(self, name: str):
+        """使用指定账号执行一段操作，记录进行中的任务数与成功/失败"""
+        quark_disk = self.disks[name]
+        stats = self._stats[name]
+        stats['in_flight'] += 1
+        try:
+            yield quark_disk
+        except Exception as e:
+            stats['errors'] += 1
+            stats['consecutive_errors'] += 1
+            stats['last_error'] = str(e)
+            raise
+        else:
+            stats['completed'] += 1
+            stats['consecutive_errors'] = 0
+        finally:
+            stats['in_flight'] -= 1
+
+    @asynccontextmanager
+    async def acquire(self, key: str = None, policy: str = None, exclude: tuple = ()):
+        """按策略选择账号并占用，用法：async with pool.acquire(...) as quark_disk"""
+        quark_disk = await self.pick(key, policy, exclude)
+        async with self.use(quark_disk.name) as quark_disk:
+            yield quark_disk
+
+    async def run(self, operation, key: str = None, policy: str = None):
+        """
+        在选出的账号上执行 await operation(quark_disk)
+        非 sticky 策略下账号熔断时换一个账号重试，所有账号都不可用时抛出 CircuitOpenError
+        """
+        policy = policy or self.policy
+        tried = []
+        while True:
+            quark_disk = await self.pick(key, policy, exclude=tuple(tried))
+            try:
+                # 异常先离开 use 再处理，熔断的账号记为失败
+                async with self.use(quark_disk.name):
+                    return await operation(quark_disk)
+            except CircuitOpenError:
+                if policy == 'sticky':
+                    raise
+                tried.append(quark_disk.name)
+                utils.logger.warning(f'账号{quark_disk.name}熔断，切换账号')
+
+    async def refresh_capacity(self, force: bool = False) -> dict[str, dict]:
+        """
+        查询各账号容量，结果缓存 CAPACITY_TTL 秒，查询失败的账号视为没有剩余空间
+        :return: {账号名: {'total':, 'used':, 'free':, 'checked_at':}}
+        """
+        async with self._capacity_lock:
+            now = time.monotonic()
+            stale = [quark_disk for quark_disk in self.quark_disks
+                     if force or now - self._capacity.get(quark_disk.name, {}).get('checked_at', -self.CAPACITY_TTL) >= self.CAPACITY_TTL]
+            results = await asyncio.gather(*[quark_disk.get_capacity() for quark_disk in stale], return_exceptions=True)
+            for quark_disk, result in zip(stale, results):
+                if isinstance(result, Exception):
+                    utils.logger.error(f'查询账号{quark_disk.name}容量失败：{result}')
+                    result = {'total': 0, 'used': 0, 'free': 0}
+                self._capacity[quark_disk.name] = {**result, 'checked_at': now}
+            return self._capacity
+
+    def stats(self) -> dict[str, dict]:
+        return {
+            name: {**stats, 'available': self.disks[name].available,
+                   'circuit': self.disks[name].circuit_breaker.state,
+                   'free': self._capacity.get(name, {}).get('free')}
+            for name, stats in self._stats.items()
+        }
+
+    async def close(self):
+        for quark_disk in self.quark_disks:
+            await quark_disk.close()
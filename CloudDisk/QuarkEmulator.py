@@ -0,0 +1,586 @@
+import asyncio
+import hashlib
+import random
+import re
+import time
+import uuid
+from collections import Counter
+from http.cookies import SimpleCookie
+from typing import Optional
+
+from aiohttp import web
+
+import utils
+
+API_PREFIX = '/1/clouddrive'
+
+# 模拟器使用的错误码，41026/41028 与真实接口的风控错误码一致
+CODE_OK = 0
+CODE_NOT_FOUND = 41016
+CODE_NAME_CONFLICT = 23008
+CODE_SHARE_NOT_FOUND = 41006
+CODE_PASSCODE_ERROR = 41008
+CODE_STOKEN_EXPIRED = 41012
+CODE_TASK_NOT_FOUND = 32001
+CODE_THROTTLED = 32003
+RISK_CODE_MESSAGES = {
+    41026: '分享失败，文件涉及违规内容',
+    41028: '分享失败，文件存在风险',
+}
+
+
+class Drive:
+    """单个账号的内存文件树，根目录 fid 为 '0'"""
+    def __init__(self, total_capacity: int):
+        now = self.now()
+        self.nodes: dict[str, dict] = {
+            '0': {'fid': '0', 'pdir_fid': '', 'file_name': '', 'file_type': 0, 'size': 0,
+                  'created_at': now, 'updated_at': now, 'children': {}},
+        }
+        self.total_capacity = total_capacity
+
+    @staticmethod
+    def now() -> int:
+        return int(time.time() * 1000)
+
+    @staticmethod
+    def new_fid() -> str:
+        return uuid.uuid4().hex
+
+    def path_of(self, fid: str) -> str:
+        names = []
+        while fid != '0':
+            node = self.nodes[fid]
+            names.append(node['file_name'])
+            fid = node['pdir_fid']
+        return '/' + '/'.join(reversed(names))
+
+    def lookup(self, path: str) -> Optional[dict]:
+        node = self.nodes['0']
+        for name in [part for part in path.split('/') if part]:
+            fid = node.get('children', {}).get(name)
+            if fid is None:
+                return None
+            node = self.nodes[fid]
+        return node
+
+    def _touch(self, fid: str):
+        self.nodes[fid]['updated_at'] = self.now()
+
+    def add(self, pdir_fid: str, file_name: str, file_type: int, size: int = 0) -> dict:
+        parent = self.nodes[pdir_fid]
+        if file_name in parent['children']:
+            raise ApiError(CODE_NAME_CONFLICT, f'同名冲突：{file_name}')
+        now = self.now()
+        node = {'fid': self.new_fid(), 'pdir_fid': pdir_fid, 'file_name': file_name, 'file_type': file_type,
+                'size': size, 'created_at': now, 'updated_at': now}
+        if file_type == 0:
+            node['children'] = {}
+        self.nodes[node['fid']] = node
+        parent['children'][file_name] = node['fid']
+        self._touch(pdir_fid)
+        return node
+
+    def mkdir_p(self, path: str) -> dict:
+        node = self.nodes['0']
+        for name in [part for part in path.split('/') if part]:
+            fid = node['children'].get(name)
+            node = self.nodes[fid] if fid is not None else self.add(node['fid'], name, 0)
+            if node['file_type'] != 0:
+                raise ApiError(CODE_NAME_CONFLICT, f'{name} 不是目录')
+        return node
+
+    def used_capacity(self) -> int:
+        return sum(node['size'] for node in self.nodes.values())
+
+    def rename(self, fid: str, file_name: str):
+        node = self.get(fid)
+        siblings = self.nodes[node['pdir_fid']]['children']
+        if file_name in siblings and siblings[file_name] != fid:
+            raise ApiError(CODE_NAME_CONFLICT, f'同名冲突：{file_name}')
+        del siblings[node['file_name']]
+        siblings[file_name] = fid
+        node['file_name'] = file_name
+        self._touch(fid)
+        self._touch(node['pdir_fid'])
+
+    def move(self, fid: str, to_pdir_fid: str):
+        node = self.get(fid)
+        target = self.get(to_pdir_fid)
+        if node['file_name'] in target['children']:
+            raise ApiError(CODE_NAME_CONFLICT, f'同名冲突：{node["file_name"]}')
+        del self.nodes[node['pdir_fid']]['children'][node['file_name']]
+        self._touch(node['pdir_fid'])
+        target['children'][node['file_name']] = fid
+        node['pdir_fid'] = to_pdir_fid
+        self._touch(to_pdir_fid)
+
+    def delete(self, fid: str):
+        node = self.get(fid)
+        del self.nodes[node['pdir_fid']]['children'][node['file_name']]
+        self._touch(node['pdir_fid'])
+        stack = [fid]
+        while stack:
+            removed = self.nodes.pop(stack.pop())
+            stack.extend(removed.get('children', {}).values())
+
+    def copy_from(self, source: 'Drive', fid: str, to_pdir_fid: str) -> str:
+        """将 source 中的 fid（含子树）复制到本网盘的 to_pdir_fid 下，重名时自动追加序号"""
+        src = source.get(fid)
+        name = src['file_name']
+        siblings = self.get(to_pdir_fid)['children']
+        index = 1
+        while name in siblings:
+            name = f"{src['file_name']}({index})"
+            index += 1
+        node = self.add(to_pdir_fid, name, src['file_type'], src['size'])
+        for child_fid in src.get('children', {}).values():
+            self.copy_from(source, child_fid, node['fid'])
+        return node['fid']
+
+    def get(self, fid: str) -> dict:
+        node = self.nodes.get(fid)
+        if node is None:
+            raise ApiError(CODE_NOT_FOUND, f'文件不存在：{fid}')
+        return node
+
+    def entry(self, node: dict) -> dict:
+        entry = {key: value for key, value in node.items() if key != 'children'}
+        entry['dir'] = node['file_type'] == 0
+        if entry['dir']:
+            entry['include_items'] = len(node['children'])
+        return entry
+
+    def list_dir(self, pdir_fid: str, sort: str) -> list[dict]:
+        return sort_entries([self.entry(self.nodes[fid]) for fid in self.get(pdir_fid)['children'].values()], sort)
+
+
+class ApiError(Exception):
+    def __init__(self, code: int, message: str, status: int = 200):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.status = status
+
+
+def sort_entries(entries: list[dict], sort: str) -> list[dict]:
+    """按 _sort 参数（如 file_type:asc,file_name:desc）排序，从最后一个字段开始做稳定排序"""
+    for field in reversed([part for part in (sort or '').split(',') if part]):
+        key, _, order = field.partition(':')
+        default = '' if key == 'file_name' else 0
+        entries.sort(key=lambda entry: entry.get(key) or default, reverse=order == 'desc')
+    return entries
+
+
+def paginate(items: list, query) -> tuple[list, dict]:
+    page = int(query.get('_page', 1))
+    size = int(query.get('_size', 50))
+    page_items = items[(page - 1) * size: page * size]
+    return page_items, {'_total': len(items), '_page': page, '_size': size, '_count': len(page_items)}
+
+
+class QuarkEmulator:
+    """
+    夸克网盘接口的本地模拟器，用于并发改动的压测，不会触碰真实账号
+    按 cookie 中的 __uid 区分账号（没有时使用 default 账号），每个账号一棵内存文件树；
+    保存、移动、删除、分享为异步任务，task_duration 秒后由 /task 返回完成；
+    可配置单请求延迟、每账号限流以及分享任务的风控错误码注入；
+    下载地址 /download/{账号}/{fid} 支持 Range，文件内容由 file_content 按 fid 生成
+    """
+    DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, rate_limit: Optional[float] = None,
+                 task_duration: float = 0.2, risk_rates: dict[int, float] = None,
+                 total_capacity: int = 6 * 1024 ** 4, seed: Optional[int] = None,
+                 missing_path_code: Optional[int] = None):
+        """
+        :param latency: 每个请求注入的延迟（秒）
+        :param jitter: 延迟的随机抖动比例
+        :param rate_limit: 每个账号每秒允许的请求数，超出返回 429 与“请求过于频繁”，为 None 时不限流
+        :param task_duration: 异步任务完成所需时间（秒）
+        :param risk_rates: {风控错误码: 概率}，创建分享任务时按概率失败
+        :param total_capacity: 每个账号的总容量（字节）
+        :param seed: 随机数种子，便于复现
+        :param missing_path_code: path_list 中有路径不存在时以该错误码拒绝整个请求，为 None 时只省略该路径
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.task_duration = task_duration
+        self.risk_rates = risk_rates or {}
+        self.risk_fids: dict[str, int] = {}
+        self.total_capacity = total_capacity
+        self.missing_path_code = missing_path_code
+        self.random = random.Random(seed)
+        self.drives: dict[str, Drive] = {}
+        self.shares: dict[str, dict] = {}  # pwd_id -> share
+        self.share_ids: dict[str, str] = {}  # share_id -> pwd_id
+        self.tasks: dict[str, dict] = {}
+        self.request_counts: Counter = Counter()
+        self._windows: dict[str, tuple[float, int]] = {}  # 账号 -> (当前秒, 请求数)
+        self.runner: Optional[web.AppRunner] = None
+        self.base_url: Optional[str] = None
+
+    # ---------- 测试数据 ----------
+    def drive(self, account: str = 'default') -> Drive:
+        if account not in self.drives:
+            self.drives[account] = Drive(self.total_capacity)
+        return self.drives[account]
+
+    def populate(self, root: str, dir_count: int, files_per_dir: int, account: str = 'default',
+                 file_size: int = 1024 ** 3) -> list[str]:
+        """在 root 下生成 dir_count 个目录，每个目录 files_per_dir 个文件，返回目录 fid 列表"""
+        drive = self.drive(account)
+        root_node = drive.mkdir_p(root)
+        dir_fids = []
+        for i in range(dir_count):
+            dir_node = drive.add(root_node['fid'], f'目录{i:04d}', 0)
+            for j in range(files_per_dir):
+                drive.add(dir_node['fid'], f'S01E{j + 1:02d}.mp4', 1, file_size)
+            dir_fids.append(dir_node['fid'])
+        return dir_fids
+
+    def create_share(self, fids: list[str], account: str = 'default', passcode: str = '', title: str = '') -> str:
+        """直接创建分享，返回分享链接"""
+        drive = self.drive(account)
+        for fid in fids:
+            drive.get(fid)
+        pwd_id = uuid.uuid4().hex[:12]
+        share_id = uuid.uuid4().hex
+        self.shares[pwd_id] = {'pwd_id': pwd_id, 'share_id': share_id, 'account': account, 'fids': list(fids),
+                               'passcode': passcode, 'title': title, 'stokens': set()}
+        self.share_ids[share_id] = pwd_id
+        return f'https://pan.quark.cn/s/{pwd_id}'
+
+    def inject_risk(self, fid: str, code: int):
+        """分享包含 fid 的文件时返回指定风控错误码"""
+        self.risk_fids[fid] = code
+
+    def expire_stokens(self):
+        """使已发放的 stoken 全部失效"""
+        for share in self.shares.values():
+            share['stokens'].clear()
+
+    # ---------- 请求处理 ----------
+    @staticmethod
+    def _account(request: web.Request) -> str:
+        cookie = SimpleCookie()
+        cookie.load(request.headers.get('Cookie', ''))
+        return cookie['__uid'].value if '__uid' in cookie else 'default'
+
+    def _throttled(self, account: str) -> bool:
+        if self.rate_limit is None:
+            return False
+        second = int(time.monotonic())
+        window, count = self._windows.get(account, (second, 0))
+        if window != second:
+            window, count = second, 0
+        self._windows[account] = (window, count + 1)
+        return count + 1 > self.rate_limit
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        self.request_counts[request.path] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency * self.random.uniform(1 - self.jitter, 1 + self.jitter))
+        if self._throttled(self._account(request)):
+            return web.json_response({'status': 429, 'code': CODE_THROTTLED, 'message': '请求过于频繁'}, status=429)
+        try:
+            return await handler(request)
+        except ApiError as e:
+            return web.json_response({'status': e.status if e.status != 200 else 400, 'code': e.code,
+                                      'message': e.message}, status=e.status)
+
+    @staticmethod
+    def _ok(data=None, metadata: dict = None) -> web.Response:
+        resp = {'status': 200, 'code': CODE_OK, 'message': 'ok', 'data': data if data is not None else {}}
+        if metadata is not None:
+            resp['metadata'] = metadata
+        return web.json_response(resp)
+
+    def _submit_task(self, title: str, action) -> str:
+        """创建异步任务，action 在任务到期后首次被查询时执行，返回 data 中附加的字段"""
+        task_id = uuid.uuid4().hex
+        self.tasks[task_id] = {'task_id': task_id, 'task_title': title, 'action': action,
+                               'finish_at': time.monotonic() + self.task_duration, 'result': None}
+        return task_id
+
+    async def _task(self, request: web.Request):
+        task = self.tasks.get(request.query.get('task_id', ''))
+        if task is None:
+            raise ApiError(CODE_TASK_NOT_FOUND, '任务不存在')
+        data = {'task_id': task['task_id'], 'task_title': task['task_title'], 'status': 0}
+        if time.monotonic() < task['finish_at']:
+            return self._ok(data)
+        if task['result'] is None:
+            try:
+                task['result'] = (CODE_OK, 'ok', task['action']() or {})
+            except ApiError as e:
+                task['result'] = (e.code, e.message, {})
+        code, message, extra = task['result']
+        if code != CODE_OK:
+            return web.json_response({'status': 400, 'code': code, 'message': message,
+                                      'data': {**data, 'status': 3}})
+        return self._ok({**data, 'status': 2, **extra})
+
+    async def _sort(self, request: web.Request):
+        drive = self.drive(self._account(request))
+        entries = drive.list_dir(request.query.get('pdir_fid', '0'), request.query.get('_sort', ''))
+        page_items, metadata = paginate(entries, request.query)
+        return self._ok({'list': page_items}, metadata)
+
+    async def _path_list(self, request: web.Request):
+        drive = self.drive(self._account(request))
+        payload = await request.json()
+        data = []
+        for path in payload.get('file_path', []):
+            node = drive.lookup(path)
+            if node is not None:
+                data.append({**drive.entry(node), 'file_path': drive.path_of(node['fid'])})
+            elif self.missing_path_code is not None:
+                raise ApiError(self.missing_path_code, f'文件不存在：{path}')
+        return self._ok(data)
+
+    async def _mkdir(self, request: web.Request):
+        drive = self.drive(self._account(request))
+        payload = await request.json()
+        if payload.get('dir_path'):
+            if drive.lookup(payload['dir_path']) is not None:
+                raise ApiError(CODE_NAME_CONFLICT, f'同名冲突：{payload["dir_path"]}')
+            node = drive.mkdir_p(payload['dir_path'])
+        else:
+            node = drive.add(payload.get('pdir_fid', '0'), payload['file_name'], 0)
+        return self._ok({'finish': True, 'fid': node['fid']})
+
+    async def _rename(self, request: web.Request):
+        payload = await request.json()
+        self.drive(self._account(request)).rename(payload['fid'], payload['file_name'])
+        return self._ok()
+
+    async def _move(self, request: web.Request):
+        drive = self.drive(self._account(request))
+        payload = await request.json()
+        drive.get(payload['to_pdir_fid'])
+
+        def _action():
+            for fid in payload['filelist']:
+                drive.move(fid, payload['to_pdir_fid'])
+        return self._ok({'task_id': self._submit_task('移动文件', _action)})
+
+    async def _delete(self, request: web.Request):
+        drive = self.drive(self._account(request))
+        payload = await request.json()
+
+        def _action():
+            for fid in payload['filelist']:
+                drive.delete(fid)
+        return self._ok({'task_id': self._submit_task('删除文件', _action)})
+
+    async def _share(self, request: web.Request):
+        account = self._account(request)
+        drive = self.drive(account)
+        payload = await request.json()
+        for fid in payload['fid_list']:
+            drive.get(fid)
+
+        def _action():
+            for fid in payload['fid_list']:
+                if fid in self.risk_fids:
+                    code = self.risk_fids[fid]
+                    raise ApiError(code, RISK_CODE_MESSAGES.get(code, '分享失败'))
+            for code, rate in self.risk_rates.items():
+                if self.random.random() < rate:
+                    raise ApiError(code, RISK_CODE_MESSAGES.get(code, '分享失败'))
+            link = self.create_share(payload['fid_list'], account, payload.get('passcode', ''), payload.get('title', ''))
+            return {'share_id': self.shares[link.rsplit('/', 1)[1]]['share_id']}
+        return self._ok({'task_id': self._submit_task(f'分享-{payload.get("title", "")}', _action)})
+
+    async def _share_password(self, request: web.Request):
+        payload = await request.json()
+        pwd_id = self.share_ids.get(payload.get('share_id', ''))
+        if pwd_id is None:
+            raise ApiError(CODE_SHARE_NOT_FOUND, '分享不存在')
+        share = self.shares[pwd_id]
+        return self._ok({'share_id': share['share_id'], 'pwd_id': pwd_id, 'passcode': share['passcode'],
+                         'title': share['title'], 'share_url': f'https://pan.quark.cn/s/{pwd_id}'})
+
+    def _get_share(self, pwd_id: str) -> dict:
+        share = self.shares.get(pwd_id)
+        if share is None:
+            raise ApiError(CODE_SHARE_NOT_FOUND, '分享不存在或已被取消')
+        return share
+
+    def _check_stoken(self, share: dict, stoken: str):
+        if stoken not in share['stokens']:
+            raise ApiError(CODE_STOKEN_EXPIRED, '分享的stoken过期')
+
+    @staticmethod
+    def _fid_token(pwd_id: str, fid: str) -> str:
+        return hashlib.md5(f'{pwd_id}:{fid}'.encode()).hexdigest()
+
+    async def _share_token(self, request: web.Request):
+        payload = await request.json()
+        share = self._get_share(payload.get('pwd_id', ''))
+        if share['passcode'] and share['passcode'] != payload.get('passcode', ''):
+            raise ApiError(CODE_PASSCODE_ERROR, '提取码错误')
+        stoken = uuid.uuid4().hex
+        share['stokens'].add(stoken)
+        return self._ok({'stoken': stoken, 'title': share['title']})
+
+    async def _share_detail(self, request: web.Request):
+        query = request.query
+        share = self._get_share(query.get('pwd_id', ''))
+        self._check_stoken(share, query.get('stoken', ''))
+        drive = self.drive(share['account'])
+        pdir_fid = query.get('pdir_fid', '0')
+        if pdir_fid in ('', '0'):
+            nodes = [drive.get(fid) for fid in share['fids']]
+        else:
+            nodes = [drive.nodes[fid] for fid in drive.get(pdir_fid)['children'].values()]
+        entries = sort_entries([{**drive.entry(node), 'share_fid_token': self._fid_token(share['pwd_id'], node['fid'])}
+                                for node in nodes], query.get('_sort', ''))
+        page_items, metadata = paginate(entries, query)
+        data = {'list': page_items}
+        if query.get('_fetch_share') in ('1', 'true'):
+            data['share'] = {'title': share['title'], 'share_id': share['share_id'], 'pwd_id': share['pwd_id']}
+        return self._ok(data, metadata)
+
+    async def _share_save(self, request: web.Request):
+        drive = self.drive(self._account(request))
+        payload = await request.json()
+        share = self._get_share(payload.get('pwd_id', ''))
+        self._check_stoken(share, payload.get('stoken', ''))
+        source = self.drive(share['account'])
+        for fid, token in zip(payload['fid_list'], payload['fid_token_list']):
+            if token != self._fid_token(share['pwd_id'], fid):
+                raise ApiError(CODE_NOT_FOUND, f'share_fid_token 无效：{fid}')
+        drive.get(payload['to_pdir_fid'])
+
+        def _action():
+            top_fids = [drive.copy_from(source, fid, payload['to_pdir_fid']) for fid in payload['fid_list']]
+            return {'save_as': {'save_as_top_fids': top_fids, 'to_pdir_fid': payload['to_pdir_fid']}}
+        return self._ok({'task_id': self._submit_task('转存', _action)})
+
+    async def _download(self, request: web.Request):
+        account = self._account(request)
+        drive = self.drive(account)
+        payload = await request.json()
+        # 真实接口返回带签名的 CDN 地址，这里把账号放进地址中，下载时不依赖 Cookie
+        data = [{**drive.entry(drive.get(fid)), 'download_url': f'{self.base_url}/download/{account}/{fid}'}
+                for fid in payload['fids']]
+        return self._ok(data)
+
+    @staticmethod
+    def file_content(fid: str, start: int, end: int) -> bytes:
+        """文件 [start, end) 的内容，按 fid 生成的 16 字节序列循环填充，不在内存中保存文件数据"""
+        block = hashlib.md5(fid.encode()).digest()
+        offset = start % len(block)
+        count = (end - start + offset) // len(block) + 1
+        return (block * count)[offset:offset + end - start]
+
+    async def _download_file(self, request: web.Request):
+        """按 file_content 返回文件内容，支持 bytes=start-end、bytes=start- 与 bytes=-suffix 形式的单个 Range"""
+        drive = self.drives.get(request.match_info['account'])
+        node = drive.nodes.get(request.match_info['fid']) if drive is not None else None
+        if node is None or node['file_type'] == 0:
+            raise web.HTTPNotFound()
+        size = node['size']
+        range_header = request.headers.get('Range')
+        status, start, end = 200, 0, size
+        if range_header:
+            match = re.fullmatch(r'bytes=(\d*)-(\d*)', range_header.strip())
+            if match is None or not any(match.groups()):
+                raise web.HTTPRequestRangeNotSatisfiable(headers={'Content-Range': f'bytes */{size}'})
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)) + 1, size) if match.group(2) else size
+            else:
+                start = max(size - int(match.group(2)), 0)
+            if start >= end:
+                raise web.HTTPRequestRangeNotSatisfiable(headers={'Content-Range': f'bytes */{size}'})
+            status = 206
+        resp = web.StreamResponse(status=status, headers={'Accept-Ranges': 'bytes'})
+        resp.content_length = end - start
+        if status == 206:
+            resp.headers['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+        await resp.prepare(request)
+        for chunk_start in range(start, end, self.DOWNLOAD_CHUNK_SIZE):
+            await resp.write(self.file_content(node['fid'], chunk_start, min(chunk_start + self.DOWNLOAD_CHUNK_SIZE, end)))
+        await resp.write_eof()
+        return resp
+
+    async def _account_info(self, request: web.Request):
+        return web.json_response({'success': True, 'code': 'OK',
+                                  'data': {'nickname': f'emulator-{self._account(request)}'}})
+
+    async def _member(self, request: web.Request):
+        drive = self.drive(self._account(request))
+        return self._ok({'member_type': 'NORMAL', 'total_capacity': drive.total_capacity,
+                         'use_capacity': drive.used_capacity()})
+
+    def make_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_get(f'{API_PREFIX}/file/sort', self._sort)
+        app.router.add_post(f'{API_PREFIX}/file/info/path_list', self._path_list)
+        app.router.add_post(f'{API_PREFIX}/file', self._mkdir)
+        app.router.add_post(f'{API_PREFIX}/file/rename', self._rename)
+        app.router.add_post(f'{API_PREFIX}/file/move', self._move)
+        app.router.add_post(f'{API_PREFIX}/file/delete', self._delete)
+        app.router.add_post(f'{API_PREFIX}/file/download', self._download)
+        app.router.add_post(f'{API_PREFIX}/share', self._share)
+        app.router.add_post(f'{API_PREFIX}/share/password', self._share_password)
+        app.router.add_post(f'{API_PREFIX}/share/sharepage/token', self._share_token)
+        app.router.add_get(f'{API_PREFIX}/share/sharepage/detail', self._share_detail)
+        app.router.add_post(f'{API_PREFIX}/share/sharepage/save', self._share_save)
+        app.router.add_get(f'{API_PREFIX}/task', self._task)
+        app.router.add_get(f'{API_PREFIX}/member', self._member)
+        app.router.add_get('/account/info', self._account_info)
+        app.router.add_get('/download/{account}/{fid}', self._download_file)
+        return app
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """启动模拟器，返回 base_url，可作为 QuarkDisk 配置中的 base_url"""
+        self.runner = web.AppRunner(self.make_app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f'http://{host}:{port}'
+        return self.base_url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+async def main():
+    """启动一个带 1 万个文件的模拟器，列出并分享一个目录后打印各接口请求数"""
+    from QuarkDisk import ParseQuarkShareLInk, QuarkDisk, QuarkTransport
+
+    emulator = QuarkEmulator(latency=0.02, jitter=0.5, seed=0)
+    dir_fids = emulator.populate('/资源分享', dir_count=400, files_per_dir=25)
+    base_url = await emulator.start()
+    ParseQuarkShareLInk.BASE_URL = base_url
+    quark_disk = QuarkDisk({'name': 'emulator', 'cookie': '', 'base_url': base_url})
+    # 模拟器无需保护账号，放开客户端限速以测出并发上限
+    for bucket in quark_disk.rate_limiter.buckets.values():
+        bucket.rate = bucket.max_rate = 1000
+        bucket.capacity = 1000
+    try:
+        start = time.perf_counter()
+        entries = [entry async for entry in quark_disk.walk('/资源分享')]
+        utils.logger.info(f'walk 共 {len(entries)} 个条目，耗时 {time.perf_counter() - start:.2f}s')
+        share_url = await quark_disk.create_share_link(dir_fids[:1], title='emulator')
+        share = await QuarkDisk.parse_share_url(share_url)
+        utils.logger.info(f'{share_url} 包含 {len((await share.ls_dir("0"))["list"])} 个条目')
+        for path, count in emulator.request_counts.most_common():
+            print(f'{count:>6}  {path}')
+    finally:
+        await quark_disk.close()
+        await QuarkTransport.close()
+        await emulator.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
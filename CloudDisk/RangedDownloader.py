@@ -0,0 +1,190 @@
+import asyncio
+import json
+import os
+import re
+import tempfile
+from typing import Optional
+
+import aiohttp
+
+import utils
+
+
+class RangedDownloader:
+    """
+    多连接分段下载器
+    按 Range 并发拉取各分段，直接写入预分配好大小的目标文件，
+    已完成的分段记录在 <目标文件>.progress 中，中断后再次下载会跳过这些分段
+    """
+    CHUNK_SIZE = 8 * 1024 * 1024
+    CONNECTIONS = 8
+    READ_SIZE = 256 * 1024
+    RETRY = 3
+
+    def __init__(self, session: aiohttp.ClientSession, connections: int = CONNECTIONS, chunk_size: int = CHUNK_SIZE):
+        """
+        :param session: 发起请求的 session，由调用方负责关闭
+        :param connections: 同时下载的分段数
+        :param chunk_size: 分段大小
+        """
+        self.session = session
+        self.connections = connections
+        self.chunk_size = chunk_size
+        self.timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60)
+
+    async def _probe(self, url: str, headers: dict) -> tuple[int, bool]:
+        """
+        请求首字节，获取文件大小以及服务端是否支持 Range
+        :return: (文件大小, 是否支持 Range)
+        """
+        async with self.session.get(url, headers={**headers, 'Range': 'bytes=0-0'}, timeout=self.timeout) as resp:
+            if resp.status == 206:
+                match = re.search(r'/(\d+)$', resp.headers.get('Content-Range', ''))
+                if match:
+                    return int(match.group(1)), True
+            if resp.status in (200, 206) and resp.content_length is not None:
+                return resp.content_length, False
+            raise RuntimeError(f'获取文件大小失败：HTTP {resp.status}')
+
+    @staticmethod
+    def _pwrite(fd: int, data: bytes, offset: int):
+        if hasattr(os, 'pwrite'):
+            os.pwrite(fd, data, offset)
+        else:
+            # Windows 没有 pwrite，lseek 与 write 之间没有 await，协程间不会交错
+            os.lseek(fd, offset, os.SEEK_SET)
+            os.write(fd, data)
+
+    def _load_progress(self, progress_path: str, size: int) -> set[int]:
+        try:
+            with open(progress_path, encoding='utf-8') as f:
+                progress = json.load(f)
+        except (OSError, ValueError):
+            return set()
+        if progress.get('size') != size or progress.get('chunk_size') != self.chunk_size:
+            return set()
+        return set(progress.get('done', []))
+
+    def _save_progress(self, progress_path: str, size: int, done: set[int]):
+        # 先写临时文件再替换，避免中断时留下损坏的进度文件
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(progress_path) or '.')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'size': size, 'chunk_size': self.chunk_size, 'done': sorted(done)}, f)
+        os.replace(tmp_path, progress_path)
+
+    async def _fetch_chunk(self, url: str, headers: dict, fd: int, start: int, end: int):
+        async with self.session.get(url, headers={**headers, 'Range': f'bytes={start}-{end}'},
+                                    timeout=self.timeout) as resp:
+            if resp.status != 206:
+                raise RuntimeError(f'分段 {start}-{end} 请求失败：HTTP {resp.status}')
+            offset = start
+            async for data in resp.content.iter_chunked(self.READ_SIZE):
+                self._pwrite(fd, data, offset)
+                offset += len(data)
+        if offset != end + 1:
+            raise RuntimeError(f'分段 {start}-{end} 数据不完整，实际写入到 {offset - 1}')
+
+    async def _fetch_stream(self, url: str, headers: dict, fd: int) -> int:
+        """服务端不支持 Range 时单连接顺序写入，返回实际写入的字节数"""
+        async with self.session.get(url, headers=headers, timeout=self.timeout) as resp:
+            if resp.status != 200:
+                raise RuntimeError(f'下载失败：HTTP {resp.status}')
+            offset = 0
+            async for data in resp.content.iter_chunked(self.READ_SIZE):
+                self._pwrite(fd, data, offset)
+                offset += len(data)
+        return offset
+
+    async def download(self, url: str, dest: str, headers: dict = None, expected_size: Optional[int] = None) -> str:
+        """
+        下载文件到 dest，支持断点续传
+        :param url: 下载地址
+        :param dest: 目标文件路径
+        :param headers: 请求头，如 Cookie、User-Agent
+        :param expected_size: 期望的文件大小，与服务端不一致时抛出异常
+        :return: dest
+        """
+        headers = headers or {}
+        size, ranged = await self._probe(url, headers)
+        if expected_size is not None and size != expected_size:
+            raise RuntimeError(f'文件大小不一致：服务端 {size}，期望 {expected_size}')
+        os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+        progress_path = f'{dest}.progress'
+        done = self._load_progress(progress_path, size) if ranged and os.path.exists(dest) else set()
+
+        fd = os.open(dest, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0))
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            if not ranged:
+                # 文件已预分配为 size，只能通过实际写入的字节数发现响应体被截断
+                written = await self._fetch_stream(url, headers, fd)
+                if written != size:
+                    raise RuntimeError(f'{dest} 数据不完整：写入 {written}，期望 {size}')
+            else:
+                chunk_count = (size + self.chunk_size - 1) // self.chunk_size
+                queue = asyncio.Queue()
+                for index in range(chunk_count):
+                    if index not in done:
+                        queue.put_nowait(index)
+                if len(done) > 0:
+                    utils.logger.info(f'{dest} 续传，已完成 {len(done)}/{chunk_count} 个分段')
+
+                async def _worker():
+                    while not queue.empty():
+                        index = queue.get_nowait()
+                        start = index * self.chunk_size
+                        end = min(start + self.chunk_size, size) - 1
+                        for retry in range(self.RETRY):
+                            try:
+                                await self._fetch_chunk(url, headers, fd, start, end)
+                                break
+                            except (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError) as e:
+                                if retry == self.RETRY - 1:
+                                    raise
+                                utils.logger.warning(f'{dest} 分段 {index} 下载失败，重试：{e}')
+                        done.add(index)
+                        self._save_progress(progress_path, size, done)
+
+                workers = [asyncio.create_task(_worker()) for _ in range(min(self.connections, queue.qsize()))]
+                try:
+                    await asyncio.gather(*workers)
+                except BaseException:
+                    for worker in workers:
+                        worker.cancel()
+                    await asyncio.gather(*workers, return_exceptions=True)
+                    raise
+                if len(done) != chunk_count:
+                    raise RuntimeError(f'{dest} 下载未完成：{len(done)}/{chunk_count}')
+        finally:
+            os.close(fd)
+        if os.path.exists(progress_path):
+            os.remove(progress_path)
+        return dest
+
+
+async def main():
+    """在本地起一个支持 Range 的静态文件服务，验证分段下载、续传与大小校验"""
+    from aiohttp import web
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src_path = os.path.join(tmp_dir, 'source.bin')
+        with open(src_path, 'wb') as f:
+            f.write(os.urandom(5 * 1024 * 1024 + 123))
+        app = web.Application()
+        app.router.add_get('/source.bin', lambda request: web.FileResponse(src_path))
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', 18766).start()
+        async with aiohttp.ClientSession() as session:
+            downloader = RangedDownloader(session, connections=4, chunk_size=1024 * 1024)
+            dest = os.path.join(tmp_dir, 'dest.bin')
+            await downloader.download('http://127.0.0.1:18766/source.bin', dest,
+                                      expected_size=os.path.getsize(src_path))
+            with open(src_path, 'rb') as f1, open(dest, 'rb') as f2:
+                utils.logger.info('内容一致' if f1.read() == f2.read() else '内容不一致')
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -5,6 +5,7 @@ import aiohttp
 from aiohttp import ClientSession
 from requests import session
 
+import metrics
 from models.resource import ResourceCategory
 
 
@@ -18,6 +19,7 @@ class CrawlerDouban:
         }
         self.session = aiohttp.ClientSession(
             headers=headers,
+            trace_configs=[metrics.trace_config('douban')],
         )
     async def __aenter__(self):
         self._init()
@@ -12,13 +12,17 @@ import traceback # 用于打印详细错误堆栈
 from sqlalchemy.orm.attributes import flag_modified
 from sqlmodel import Session, select
 
+import metrics
 import settings
 from database import engine
 from models.resource import Resource
 
 
 class AlistAPI:
-    def __init__(self):
+    def __init__(self, session=None):
+        """
+        :param session: 自定义 session（如 CassetteSession），需自带 Authorization 请求头，为 None 时创建新的 ClientSession
+        """
         self.base_url = settings.alist.get('url')  # AList 访问地址
         self.token = settings.alist.get('key')  # AList API Token
         # 构建通用的请求头
@@ -26,7 +30,7 @@ class AlistAPI:
             "Authorization": self.token,
             "Content-Type": "application/json",
         }
-        self.session = aiohttp.ClientSession(headers=self.headers)
+        self.session = session or aiohttp.ClientSession(headers=self.headers, trace_configs=[metrics.trace_config('alist')])
 
     async def copy(self, path_list_dict:[],base_src:str,base_dst:str) :
         """
@@ -6,6 +6,7 @@ import requests
 from aiohttp import ClientSession
 from sqlmodel import Session, select
 
+import metrics
 import settings
 from QuarkDisk import QuarkDisk
 from database import engine
@@ -18,7 +19,7 @@ class Aria2API:
         self.api = "http://192.168.31.201:6800/jsonrpc"
         # 消息id，aria2会原样返回这个id，可以自动生成也可以用其他唯一标识
         self.id = "QXJpYU5nXzE2NzUxMzUwMDFfMC42Mzc0MDA5MTc2NjAzNDM="
-        self.session=ClientSession()
+        self.session=ClientSession(trace_configs=[metrics.trace_config('aria2')])
     async def close(self):
         await self.session.close()
     async   def addUri(self, url, path,headers, file=None, proxy=None,):
@@ -4,6 +4,7 @@ from typing import Optional
 
 import aiohttp
 
+import metrics
 import Services.crawler_resource.crawler
 from Services.crawler_resource.crawler import SearchResult, ResourceType
 from Services.episode_namer_dir.bu_tai_lin_episode_namer import BuTaiLinEpisodeNamer
@@ -11,7 +12,7 @@ from Services.episode_namer_dir.bu_tai_lin_episode_namer import BuTaiLinEpisodeN
 
 class BuTaiLinCrawler:
     def __init__(self):
-        self.session=aiohttp.ClientSession()
+        self.session=aiohttp.ClientSession(trace_configs=[metrics.trace_config('bu_tai_lin')])
         self.app_id='83768d9ad4'
         self.identity='23734adac0301bccdcb107c4aa21f96c'
         self.base_url='https://www.3bt0.com'
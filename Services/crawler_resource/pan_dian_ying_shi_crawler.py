@@ -4,13 +4,14 @@ import aiohttp
 
 from lxml import html
 
+import metrics
 from Services.crawler_resource.crawler import SearchResult, Resource, ResourceType
 
 
 class PanDianCrawler:
     def __init__(self):
         headers={}
-        self.session = aiohttp.ClientSession(headers=headers)
+        self.session = aiohttp.ClientSession(headers=headers, trace_configs=[metrics.trace_config('pan_dian')])
         self.base_url='https://www.dyttgou.com'
     async def _search(self,title):
         url=self.base_url+'/e/search/index.php'
@@ -1,15 +1,21 @@
+from typing import Optional
+
 from Services.crawler_resource.crawler import QuarkFile, ResourceQuark, SearchResult
 from Services.episode_namer_dir.public_episode_namer import PublicEpisodeNamer
-from Services.quark_share_dir_tree import QuarkShareDirTree
+from Services.quark_share_dir_tree import DirPredicate, QuarkShareDirTree
 
 
 class QuarkShareCrawler:
-    def __init__(self):
-        pass
+    def __init__(self, dir_predicate: Optional[DirPredicate] = None):
+        """
+        :param dir_predicate: 可选的目录剪枝条件，如 all_of(skip_extras, prefer_4k)；默认列出分享中的所有目录
+        """
+        self.dir_predicate = dir_predicate
+
     async def parse_quark_share(self, share_link: str):
         quark_dir_tree = QuarkShareDirTree.get_quark_share_tree(share_link)
-        await quark_dir_tree.parse(10, refresh=True)
-        video_list = quark_dir_tree.get_video_node_info()
+        await quark_dir_tree.parse(10, refresh=True, dir_predicate=self.dir_predicate)
+        video_list = quark_dir_tree.get_video_node_info(dir_predicate=self.dir_predicate)
         return video_list
 
     async def search(self,share_link:str,title:str):
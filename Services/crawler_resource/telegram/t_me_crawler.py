@@ -2,10 +2,12 @@ import asyncio
 
 import aiohttp
 
+import metrics
+
 
 class TMeCrawler:
     def __init__(self,t_me_url:str) -> None:
-        self.session=aiohttp.ClientSession()
+        self.session=aiohttp.ClientSession(trace_configs=[metrics.trace_config('t_me')])
         self.t_me_url=t_me_url
     async def request(self,method,url,params=None,json=None,data=None,headers=None):
 
@@ -4,10 +4,13 @@ import os
 
 from sqlalchemy.orm.attributes import flag_modified
 from sqlmodel import Session, select
+import metrics
 import settings
 import utils
-from QuarkDisk import QuarkDisk
+from QuarkDisk import QuarkDisk, QuarkTransport, GetFidsError
+from QuarkDiskPool import QuarkDiskPool
 from Services.alist_api import AlistAPI
+from Services.quark_mirror import QuarkMirror
 from Services.quark_share_dir_tree import QuarkShareDirTree
 from Services.risk_handle import RiskHandle
 from database import engine
@@ -15,10 +18,15 @@ from models.resource import Resource, ResourceCategory
 
 
 class CreateShareLink:
-    def __init__(self,quark_disk_list:[QuarkDisk],risk:RiskHandle):
-        self.quark_disk_list = quark_disk_list
-        self.default_quark_disk = quark_disk_list[0]
-        self.other_quark_disks = quark_disk_list[1:]
+    def __init__(self,pool:QuarkDiskPool,risk:RiskHandle):
+        """
+        :param pool: 账号池，主账号存放资源并创建默认分享，其余账号从默认分享转存后各自创建分享
+        :param risk:
+        """
+        self.pool = pool
+        self.quark_disk_list = pool.quark_disks
+        self.default_quark_disk = pool.primary
+        self.other_quark_disks = pool.others()
         self.risk = risk
 
     @staticmethod
@@ -31,7 +39,7 @@ class CreateShareLink:
         :param quark_disk: 被转存的quark对象
         :return:
         """
-        share_file = quark_share_dir_tree.get_node_info(f'{src_path}')
+        share_file = await quark_share_dir_tree.get_node_info(f'{src_path}', expand=False)
         share_file_fid = share_file['fid']
         print(share_file)
         share_file_token = share_file['share_fid_token']
@@ -43,18 +51,14 @@ class CreateShareLink:
         except Exception as e:
             pass
 
-        try:
-            resp=  await quark_disk.get_fids([save_pdir])
-            pdir_fid=resp[0]['fid']
-        except Exception as e:
-            await quark_disk.mkdir(save_pdir)
-            resp = await quark_disk.get_fids([save_pdir])
-            pdir_fid = resp[0]['fid']
+        pdir_fid=await quark_disk.ensure_dir(save_pdir)
 
-        pwd_id=quark_share_dir_tree.ParseQuarkShareLInk.pwd_id
-        stoken=quark_share_dir_tree.ParseQuarkShareLInk.stoken
+        share_client=await quark_share_dir_tree.ensure_share_client()
+        pwd_id=share_client.pwd_id
+        stoken=share_client.stoken
         try:
-            return await quark_disk.save_file([share_file_fid],  fid_token_list=[share_file_token], to_pdir_fid=pdir_fid,stoken=stoken,pwd_id=pwd_id)
+            return await quark_disk.save_file([share_file_fid],  fid_token_list=[share_file_token], to_pdir_fid=pdir_fid,stoken=stoken,pwd_id=pwd_id,
+                                              batch=True, file_names=[share_file['file_name']])
         except Exception as e:
             raise e
     @staticmethod
@@ -104,7 +108,9 @@ class CreateShareLink:
                'account':quark_disk.name,
            }
         try:
-           result.update({'share_link':await CreateShareLink.save_and_craete_link(quark_share_dir_tree, src_path, save_pdir,quark_disk=quark_disk)})
+            # 经过账号池记录各账号进行中的任务与失败情况，熔断中的账号会直接失败
+            async with self.pool.use(quark_disk.name):
+                result.update({'share_link':await CreateShareLink.save_and_craete_link(quark_share_dir_tree, src_path, save_pdir,quark_disk=quark_disk)})
 
         except Exception as e:
             result.update({'exception':str(e)})
@@ -133,67 +139,74 @@ class CreateShareLink:
         if len(resource_map.items())==0:
             return
         path_list = [resource.cloud_storage_path for resource in resources]
-        resp_json=await self.default_quark_disk.get_fids(path_list)
-        print(resp_json)
         share_results=[]
+        try:
+            resp_json=await self.default_quark_disk.get_fids(path_list)
+        except GetFidsError as e:
+            # 部分分组失败时继续处理成功的路径，失败的路径记录到结果中
+            resp_json=e.fids
+            for failed_path in e.failed_paths:
+                share_results.append({
+                    'src_path': failed_path,
+                    'account': self.default_quark_disk.name,
+                    'exception': str(e)
+                })
+        print(resp_json)
+        # 先确定每个资源可延用的默认分享链接，其余的一次性并发创建
+        default_share_links={}
+        for resp in resp_json:
+            resource=resource_map[resp['file_path']]
+            share_list= resource.share_handle.get('share_list',[])
+            for share in share_list:
+                if share['account'] == self.default_quark_disk.name:
+                    default_share_link=share.get('share_link',None)
+                    if default_share_link is not None:
+                        try:
+                            quark_share_dir_tree = QuarkShareDirTree.get_quark_share_tree(default_share_link)
+                            await quark_share_dir_tree.parse()
+                            print(f'延用可用的分享链接：{default_share_link}')
+                            default_share_links[resp['fid']]=default_share_link
+                        except Exception as e:
+                            print(f'链接失效，重新创建:{default_share_link}')
+                    break
+        create_results=await self.default_quark_disk.create_share_links(
+            [resp['fid'] for resp in resp_json if resp['fid'] not in default_share_links],title='')
         for resp in resp_json:
             file_path=resp["file_path"]
             pdir_file_path=os.path.dirname(file_path)
             resource=resource_map[resp['file_path']]
             share_file_name=os.path.basename(file_path)
             fid=resp['fid']
-            try:
-                share_list= resource.share_handle.get('share_list',[])
-                default_share_link=None
-                for share in share_list:
-                    if share['account'] == self.default_quark_disk.name:
-                        default_share_link=share.get('share_link',None)
-
-                        break
-                if default_share_link is None:
-                    default_share_link = await self.default_quark_disk.create_share_link([fid],title='')
-                else:
+            default_share_link=default_share_links.get(fid)
+            if default_share_link is None:
+                create_result=create_results[fid]
+                if create_result['share_link'] is None:
+                    code=create_result['code']
+                    share_results.append({
+                        'src_path': file_path,
+                        'account': self.default_quark_disk.name,
+                        'exception': json.dumps({'code':code,'message':create_result['message']},ensure_ascii=False)
+                    })
+                    utils.logger.error(f"{file_path} 创建分享失败：{create_result['message']} (Code: {code})")
+                    src_path = resource.cloud_storage_path
                     try:
-                        quark_share_dir_tree = QuarkShareDirTree.get_quark_share_tree(default_share_link)
-                        await quark_share_dir_tree.parse()
-                        print(f'延用可用的分享链接：{default_share_link}')
+                        if code==41028:
+                            await self.risk.risk_file_handle_41028(resource.storage_path,src_path,self.default_quark_disk)
+                        elif code==41026:
+                            await self.risk.risk_file_handle_41026(src_path, self.default_quark_disk)
                     except Exception as e:
-                        default_share_link = await self.default_quark_disk.create_share_link([fid], title='')
-                        print(f'链接失效，重新创建:{default_share_link}')
-
-
-                share_results.append({
-                    'src_path': file_path,
-                    'account': self.default_quark_disk.name,
-                    'share_link': default_share_link
-                })
-
-
-            except Exception as e:
-                share_results.append({
-                    'src_path': file_path,
-                    'account': self.default_quark_disk.name,
-                    'exception': str(e)
-                })
-                utils.logger.error(e)
-                try:
-
-                    e_json= json.loads(str(e))
-                    message=e_json['message']
-                    code=e_json['code']
-                    src_path = resource.cloud_storage_path
-
-                    if code==41028:
-                        await self.risk.risk_file_handle_41028(resource.storage_path,src_path,self.default_quark_disk)
                         pass
-                    elif code==41026:
-                        await self.risk.risk_file_handle_41026(src_path, self.default_quark_disk)
-                except Exception as e:
-                    pass
-                continue
+                    continue
+                default_share_link=create_result['share_link']
+
+            share_results.append({
+                'src_path': file_path,
+                'account': self.default_quark_disk.name,
+                'share_link': default_share_link
+            })
             await self.risk.detect_1(resource.storage_path,file_path,default_share_link,self.default_quark_disk)
+            # save_from_share 通过 get_node_info 按需列出要转存的路径，无需先 parse
             quark_share_dir_tree=QuarkShareDirTree.get_quark_share_tree(default_share_link)
-            await quark_share_dir_tree.parse()
             tasks=[
              self._save_and_craete_link(quark_share_dir_tree,src_path=f'/{share_file_name}',save_pdir=pdir_file_path,quark_disk=other_quark_disk)
                 for other_quark_disk in self.other_quark_disks
@@ -218,16 +231,23 @@ class CreateShareLink:
 
 
 async def main():
-    # quark_disk_list=[QuarkDisk(setting) for setting in settings.STORAGE_CONFIG['quark']]
-    quark_disk_list=[QuarkDisk(settings.STORAGE_CONFIG['quark'][0])]
+    metrics.registry.start_snapshot_writer()
+    # 参与的账号由 settings.QUARK_POOL_ACCOUNTS 指定，默认只有第一个账号
+    pool=QuarkDiskPool.from_settings()
     alist=AlistAPI()
-    risk=RiskHandle(alist)
-    create_share_link=CreateShareLink(quark_disk_list,risk)
+    # 风控检测只针对主账号，只为主账号建立镜像
+    mirrors=await QuarkMirror.refresh_all([pool.primary])
+    risk=RiskHandle(alist,mirrors)
+    create_share_link=CreateShareLink(pool,risk)
     await create_share_link.zhuancun()
-    for quark_disk in quark_disk_list:
-        await quark_disk.close()
+    utils.logger.info(f'账号池状态：{pool.stats()}')
+    for mirror in mirrors.values():
+        mirror.close()
+    await pool.close()
 
 
     await QuarkShareDirTree.close()
+    await QuarkTransport.close()
+    await metrics.registry.stop_snapshot_writer()
 if __name__ == '__main__':
     asyncio.run(main())
\ No newline at end of file
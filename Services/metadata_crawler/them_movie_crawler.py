@@ -3,13 +3,14 @@ import asyncio
 import aiohttp
 from lxml import html
 
+import metrics
 from Services.metadata_crawler.crawler import ResourceMetadata, SearchResults
 
 
 class ThemMovieCrawler:
     def __init__(self, ):
 
-        self.session=aiohttp.ClientSession()
+        self.session=aiohttp.ClientSession(trace_configs=[metrics.trace_config('themoviedb')])
         self.base_url='https://www.themoviedb.org'
     async def __aenter__(self):
 
@@ -0,0 +1,213 @@
+import asyncio
+import os
+import sqlite3
+import time
+
+import settings
+import utils
+from QuarkDisk import QuarkDisk, QuarkTransport
+
+
+class QuarkMirror:
+    """
+    夸克账号网盘元数据的本地 SQLite 镜像，以 (账号, fid) 为键
+    refresh 时目录只有在 updated_at 变化后才重新列出，本进程内的写操作通过 QuarkDisk 的写事件同步到镜像
+    """
+    DB_PATH = os.path.join(settings.LOCAL_CACHE_DIR, 'quark_mirror.db')
+    REFRESH_CONCURRENCY = 8
+
+    def __init__(self, quark_disk: QuarkDisk, db_path: str = None):
+        self.quark_disk = quark_disk
+        self.account = quark_disk.name
+        db_path = db_path or self.DB_PATH
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self._init_db()
+        quark_disk.add_write_listener(self._on_write)
+
+    def _init_db(self):
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                account TEXT NOT NULL,
+                fid TEXT NOT NULL,
+                pdir_fid TEXT,
+                file_name TEXT NOT NULL,
+                size INTEGER,
+                file_type INTEGER,
+                updated_at INTEGER,
+                PRIMARY KEY (account, fid)
+            );
+            CREATE INDEX IF NOT EXISTS idx_entries_pdir ON entries (account, pdir_fid);
+            -- 已列出过子项的目录，updated_at 为列出时该目录的 updated_at
+            CREATE TABLE IF NOT EXISTS dirs (
+                account TEXT NOT NULL,
+                fid TEXT NOT NULL,
+                updated_at INTEGER,
+                has_subdirs INTEGER NOT NULL DEFAULT 0,
+                synced_at REAL,
+                PRIMARY KEY (account, fid)
+            );
+        """)
+        self.conn.commit()
+
+    async def refresh(self, root: str = settings.STORAGE_BASE_PATH) -> dict:
+        """
+        增量刷新 root 下的镜像
+        含子目录的目录每次都重新列出以获得子目录最新的 updated_at，
+        只含文件的目录在 updated_at 未变化时跳过
+        :param root:
+        :return: {'listed': 重新列出的目录数, 'skipped': 跳过的目录数, 'seconds': 耗时}
+        """
+        start = time.monotonic()
+        fids = await self.quark_disk.get_fids([root])
+        if not fids:
+            raise RuntimeError(f'目录{root}不存在')
+        stats = {'listed': 0, 'skipped': 0}
+        semaphore = asyncio.Semaphore(self.REFRESH_CONCURRENCY)
+
+        async def _refresh_dir(fid, updated_at):
+            stored = self._get_dir(fid)
+            if updated_at is not None and stored is not None \
+                    and stored['updated_at'] == updated_at and not stored['has_subdirs']:
+                stats['skipped'] += 1
+                return []
+            async with semaphore:
+                file_list = await self.quark_disk.ls_dir(fid)
+            if isinstance(file_list, dict):
+                raise RuntimeError(f'列出目录{fid}失败：{file_list["error"]}')
+            self._store_listing(fid, file_list, updated_at)
+            stats['listed'] += 1
+            return [(file['fid'], file.get('updated_at')) for file in file_list if file['file_type'] == 0]
+
+        level = [(fids[0]['fid'], None)]
+        while level:
+            results = await asyncio.gather(*[_refresh_dir(fid, updated_at) for fid, updated_at in level])
+            level = [child for children in results for child in children]
+        stats['seconds'] = time.monotonic() - start
+        utils.logger.info(f'{self.account} 镜像刷新完成：{stats}')
+        return stats
+
+    async def ls_dir(self, pdir_fid: str) -> list[dict]:
+        """
+        优先从镜像读取目录列表，目录未同步过或已被本进程的写操作标记为过期时实时列出并写入镜像
+        :param pdir_fid:
+        :return: 与 QuarkDisk.ls_dir 相同结构的文件列表，出错时返回 {"error": message}
+        """
+        if self._get_dir(pdir_fid) is not None:
+            rows = self.conn.execute(
+                "SELECT * FROM entries WHERE account = ? AND pdir_fid = ? ORDER BY file_type ASC, file_name DESC",
+                (self.account, pdir_fid)).fetchall()
+            return [self._row_to_entry(row) for row in rows]
+        file_list = await self.quark_disk.ls_dir(pdir_fid)
+        if not isinstance(file_list, dict):
+            self._store_listing(pdir_fid, file_list, None)
+        return file_list
+
+    @staticmethod
+    def _row_to_entry(row: sqlite3.Row) -> dict:
+        return {
+            'fid': row['fid'],
+            'pdir_fid': row['pdir_fid'],
+            'file_name': row['file_name'],
+            'size': row['size'],
+            'file_type': row['file_type'],
+            'updated_at': row['updated_at'],
+        }
+
+    def _get_dir(self, fid: str):
+        return self.conn.execute("SELECT * FROM dirs WHERE account = ? AND fid = ?",
+                                 (self.account, fid)).fetchone()
+
+    def _store_listing(self, pdir_fid: str, file_list: list[dict], updated_at):
+        new_fids = {file['fid'] for file in file_list}
+        old_fids = {row['fid'] for row in self.conn.execute(
+            "SELECT fid FROM entries WHERE account = ? AND pdir_fid = ?", (self.account, pdir_fid))}
+        self._delete_subtree(list(old_fids - new_fids))
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO entries (account, fid, pdir_fid, file_name, size, file_type, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(self.account, file['fid'], pdir_fid, file['file_name'], file.get('size'), file['file_type'],
+              file.get('updated_at')) for file in file_list])
+        has_subdirs = any(file['file_type'] == 0 for file in file_list)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO dirs (account, fid, updated_at, has_subdirs, synced_at) VALUES (?, ?, ?, ?, ?)",
+            (self.account, pdir_fid, updated_at, int(has_subdirs), time.time()))
+        self.conn.commit()
+
+    def _delete_subtree(self, fids: list[str]):
+        while fids:
+            placeholders = ','.join('?' * len(fids))
+            children = [row['fid'] for row in self.conn.execute(
+                f"SELECT fid FROM entries WHERE account = ? AND pdir_fid IN ({placeholders})",
+                (self.account, *fids))]
+            self.conn.execute(f"DELETE FROM entries WHERE account = ? AND fid IN ({placeholders})",
+                              (self.account, *fids))
+            self.conn.execute(f"DELETE FROM dirs WHERE account = ? AND fid IN ({placeholders})",
+                              (self.account, *fids))
+            fids = children
+
+    def _has_entry(self, fid: str) -> bool:
+        return self.conn.execute("SELECT 1 FROM entries WHERE account = ? AND fid = ?",
+                                 (self.account, fid)).fetchone() is not None
+
+    def _mark_dirty(self, fid: str):
+        """目录内容已变化但无法得知具体结果，下次读取时重新列出"""
+        self.conn.execute("DELETE FROM dirs WHERE account = ? AND fid = ?", (self.account, fid))
+
+    def _on_write(self, event: str, payload: dict):
+        if event == 'mkdir':
+            ancestor_fids = payload.get('ancestor_fids')
+            if ancestor_fids is not None:
+                # 父目录一定变化；镜像中没有的中间目录是一并新建的（或从未同步过），它的父目录同样变化
+                self._mark_dirty(ancestor_fids[-1])
+                for parent_fid, fid in zip(ancestor_fids, ancestor_fids[1:]):
+                    if not self._has_entry(fid):
+                        self._mark_dirty(parent_fid)
+            else:
+                # 不知道新目录建在哪里，所有目录在下次读取时重新列出
+                self.conn.execute("DELETE FROM dirs WHERE account = ?", (self.account,))
+            # 新建的目录为空，无需再列出
+            self._store_listing(payload['fid'], [], None)
+        elif event == 'rename':
+            self.conn.execute("UPDATE entries SET file_name = ? WHERE account = ? AND fid = ?",
+                              (payload['file_name'], self.account, payload['fid']))
+        elif event == 'move':
+            for fid in payload['fids']:
+                updated = self.conn.execute("UPDATE entries SET pdir_fid = ? WHERE account = ? AND fid = ?",
+                                            (payload['to_pdir_fid'], self.account, fid)).rowcount
+                if not updated:
+                    self._mark_dirty(payload['to_pdir_fid'])
+        elif event == 'delete':
+            self._delete_subtree(list(payload['fids']))
+        elif event == 'save':
+            self._mark_dirty(payload['to_pdir_fid'])
+        self.conn.commit()
+
+    def close(self):
+        self.quark_disk.remove_write_listener(self._on_write)
+        self.conn.close()
+
+    @staticmethod
+    async def refresh_all(quark_disks: list[QuarkDisk], root: str = settings.STORAGE_BASE_PATH) -> dict[str, 'QuarkMirror']:
+        """
+        为每个账号建立镜像并刷新
+        :return: {账号名: QuarkMirror}
+        """
+        mirrors = {quark_disk.name: QuarkMirror(quark_disk) for quark_disk in quark_disks}
+        await asyncio.gather(*[mirror.refresh(root) for mirror in mirrors.values()])
+        return mirrors
+
+
+async def main():
+    quark_disks = [QuarkDisk(config) for config in settings.STORAGE_CONFIG['quark']]
+    mirrors = await QuarkMirror.refresh_all(quark_disks)
+    for mirror in mirrors.values():
+        mirror.close()
+    for quark_disk in quark_disks:
+        await quark_disk.close()
+    await QuarkTransport.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
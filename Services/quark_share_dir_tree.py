@@ -1,125 +1,517 @@
 import asyncio
 import json
+import os
 import re
+import sqlite3
+import time
+import zlib
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import settings
+import utils
+from QuarkDisk import ParseQuarkShareLInk, QuarkDisk, QuarkTransport
+
+MAX_DEEP_REACHED_MSG = "请增加max_deep以查看此目录,current_deep={cd},max_deep={md}"
+EMPTY_DIR_MSG = '该目录为空'
+
+# parse 的剪枝条件：dir_predicate(目录, 同级目录) 为 False 的目录不列出，file_predicate(文件) 决定文件是否计入目标，
+# stop_when(已找到的目标文件) 为 True 时停止遍历；目录与文件均为 ShareNode.to_dict() 的结果
+DirPredicate = Callable[[dict, list[dict]], bool]
+FilePredicate = Callable[[dict], bool]
+
+VIDEO_SUFFIXES = ('.mp4', '.mkv')
+# 英文只认整个目录名就是 Extras、[Sample]、Bonus Features 这类名称，避免误伤 Trailer Park Boys 等剧名；中文按包含匹配
+EXTRA_DIR_PATTERN = re.compile(r'[\W\d_]*(?:samples?|extras?|trailers?|featurettes?|bonus(?:\s+features?)?)[\W\d_]*'
+                               r'|.*(?:花絮|预告|样片|特典|幕后).*', re.IGNORECASE)
+UHD_DIR_PATTERN = re.compile(r'4k|2160p|uhd', re.IGNORECASE)
+QUALITY_DIR_PATTERN = re.compile(r'4k|2160p|uhd|1080p|720p|1080|720', re.IGNORECASE)
+SEASON_PATTERN = re.compile(r'(?:^|[^a-z])s(\d{1,2})(?!\d)|season\s*(\d{1,2})|第\s*(\d{1,2})\s*季', re.IGNORECASE)
+
+
+def is_video(file: dict) -> bool:
+    return file['file_name'].endswith(VIDEO_SUFFIXES)
+
+
+def skip_extras(directory: dict, siblings: list[dict]) -> bool:
+    """跳过花絮、预告、样片等目录"""
+    return not EXTRA_DIR_PATTERN.fullmatch(directory['file_name'])
+
+
+def prefer_4k(directory: dict, siblings: list[dict]) -> bool:
+    """同级存在 4K 目录时跳过其他清晰度的目录"""
+    if not QUALITY_DIR_PATTERN.search(directory['file_name']) or UHD_DIR_PATTERN.search(directory['file_name']):
+        return True
+    return not any(UHD_DIR_PATTERN.search(sibling['file_name']) for sibling in siblings)
+
+
+def only_season(season: int) -> DirPredicate:
+    """跳过名称中标明为其他季的目录，未标明季数的目录保留"""
+    def _predicate(directory: dict, siblings: list[dict]) -> bool:
+        match = SEASON_PATTERN.search(directory['file_name'])
+        return match is None or int(next(group for group in match.groups() if group)) == season
+    return _predicate
+
+
+def all_of(*predicates: DirPredicate) -> DirPredicate:
+    def _predicate(directory: dict, siblings: list[dict]) -> bool:
+        return all(predicate(directory, siblings) for predicate in predicates)
+    return _predicate
+
+
+class ShareNode:
+    """
+    分享目录树中的一个节点
+    目录的 state 为 truncated（受 max_deep 限制尚未列出）或 expanded（已列出，children 为子节点 fid），文件的 state 为 None
+    """
+    __slots__ = ('fid', 'file_name', 'file_type', 'pdir_fid', 'share_fid_token', 'depth', 'state', 'children',
+                 'fingerprint')
+
+    TRUNCATED = 'truncated'
+    EXPANDED = 'expanded'
+
+    def __init__(self, fid: str, file_name: str, file_type: int, pdir_fid: Optional[str], share_fid_token: Optional[str],
+                 depth: int):
+        self.fid = fid
+        self.file_name = file_name
+        self.file_type = file_type
+        self.pdir_fid = pdir_fid
+        self.share_fid_token = share_fid_token
+        self.depth = depth  # 根目录为 -1，根目录的子节点为 0
+        self.state = self.TRUNCATED if file_type == 0 else None
+        self.children: Optional[list[str]] = None
+        # 父目录列表中的 [updated_at, include_items]，用于判断目录自上次列出后是否变化
+        self.fingerprint: Optional[list] = None
+
+    @property
+    def is_dir(self) -> bool:
+        return self.file_type == 0
+
+    def to_dict(self) -> dict:
+        return {
+            'fid': self.fid,
+            'file_name': self.file_name,
+            'file_type': self.file_type,
+            'pdir_fid': self.pdir_fid,
+            'share_fid_token': self.share_fid_token,
+        }
+
+
+class ShareTreeCache:
+    """
+    分享链接 -> QuarkShareDirTree 的 LRU 缓存，条目带过期时间
+    同一次运行内同一个分享复用同一棵树。淘汰（超出 max_size 或超过 ttl）只把条目移出缓存，
+    调用方可能仍持有被淘汰的树，由持有者决定何时关闭，缓存不会关闭它
+    """
+    MAX_SIZE = 64
+    TTL = 1800
+
+    def __init__(self, max_size: int = MAX_SIZE, ttl: float = TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple['QuarkShareDirTree', float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, share_link: str, factory) -> 'QuarkShareDirTree':
+        """
+        :param factory: 未命中时调用 factory(share_link) 创建目录树
+        """
+        entry = self._entries.get(share_link)
+        if entry is not None and time.monotonic() < entry[1]:
+            self._entries.move_to_end(share_link)
+            self.hits += 1
+            return entry[0]
+        if entry is not None:
+            self._evict(share_link)
+        self.misses += 1
+        quark_share_tree = factory(share_link)
+        self._entries[share_link] = (quark_share_tree, time.monotonic() + self.ttl)
+        while len(self._entries) > self.max_size:
+            self._evict(next(iter(self._entries)))
+        return quark_share_tree
+
+    def _evict(self, share_link: str):
+        self._entries.pop(share_link)
+        self.evictions += 1
+
+    def values(self) -> list['QuarkShareDirTree']:
+        return [quark_share_tree for quark_share_tree, _ in self._entries.values()]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+    async def close(self):
+        """进程退出前关闭缓存中的所有目录树并清空缓存"""
+        trees = self.values()
+        self._entries.clear()
+        for quark_share_tree in trees:
+            await quark_share_tree.close_()
+
+
+class ShareTreeSnapshotStore:
+    """
+    已解析目录树的本地快照，以分享链接为键保存在 SQLite 中，节点表以 zlib 压缩的 JSON 存放
+    同时保存 stoken 与根目录指纹（条目数与最新的 updated_at），下次运行时只需列出根目录校验
+    """
+    DB_PATH = os.path.join(settings.LOCAL_CACHE_DIR, 'share_trees.db')
+    MAX_AGE = 24 * 3600  # 超过该时间的快照不再使用，避免深层目录的变化无法从指纹中发现
+
+    def __init__(self, db_path: str = DB_PATH, max_age: float = MAX_AGE):
+        self.db_path = db_path
+        self.max_age = max_age
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS share_trees (
+                    share_link TEXT PRIMARY KEY,
+                    pwd_id TEXT,
+                    passcode TEXT,
+                    stoken TEXT,
+                    fingerprint TEXT,
+                    max_deep INTEGER,
+                    nodes BLOB,
+                    saved_at REAL
+                )
+            """)
+            self._conn.commit()
+        return self._conn
+
+    def load(self, share_link: str) -> Optional[dict]:
+        row = self.conn.execute(
+            'SELECT pwd_id, passcode, stoken, fingerprint, max_deep, nodes, saved_at FROM share_trees WHERE share_link = ?',
+            (share_link,)).fetchone()
+        if row is None or time.time() - row[6] >= self.max_age:
+            return None
+        try:
+            nodes = json.loads(zlib.decompress(row[5]))
+        except (zlib.error, ValueError):
+            return None
+        # 每个节点的父目录必须排在它之前，否则为损坏或旧格式（根目录下条目指向分享者目录）的快照
+        seen = set()
+        for node in nodes:
+            if node[3] is not None and node[3] not in seen:
+                return None
+            seen.add(node[0])
+        return {'pwd_id': row[0], 'passcode': row[1], 'stoken': row[2], 'fingerprint': json.loads(row[3]),
+                'max_deep': row[4], 'nodes': nodes}
+
+    def save(self, share_link: str, pwd_id: str, passcode: str, stoken: str, fingerprint: list, max_deep: int,
+             nodes: list[list]):
+        """
+        :param nodes: 按父目录在前的顺序排列的 [fid, file_name, file_type, pdir_fid, share_fid_token, depth, state, fingerprint]
+        """
+        blob = zlib.compress(json.dumps(nodes, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        self.conn.execute('INSERT OR REPLACE INTO share_trees VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                          (share_link, pwd_id, passcode, stoken, json.dumps(fingerprint), max_deep, blob, time.time()))
+        self.conn.commit()
+
+    def delete(self, share_link: str):
+        self.conn.execute('DELETE FROM share_trees WHERE share_link = ?', (share_link,))
+        self.conn.commit()
 
-from QuarkDisk import ParseQuarkShareLInk, QuarkDisk
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
 
 
 class QuarkShareDirTree:
-    def __init__(self, share_link: str):
-        self.tree = None
+    """
+    分享链接的目录树
+    解析结果写入 snapshot_store，下次运行时先列出根目录，根目录指纹未变化则直接复用快照，
+    变化时只重新列出 [updated_at, include_items] 发生变化的目录
+    """
+    CONCURRENCY = 8  # 同一层同时列出的目录数
+
+    def __init__(self, share_link: str, concurrency: int = CONCURRENCY):
+        """
+        :param share_link: 分享链接
+        :param concurrency: 按层遍历时同时列出的目录数
+        """
         self.share_link = share_link
         self.ParseQuarkShareLInk = None
         self.current_max_deep = -1  # Tracks the max_deep the current tree was built/expanded with
-
-    async def _traverse_dir(self, current_deep: int, max_deep: int, fid='0'):
-        # This message format is crucial for incremental parsing
-        max_deep_reached_msg_template = "请增加max_deep以查看此目录,current_deep={cd},max_deep={md}"
-
-        if current_deep > max_deep:
-            # print(f"DEBUG: _traverse_dir for fid={fid}, current_deep={current_deep} > max_deep={max_deep}. Returning message.")
-            return max_deep_reached_msg_template.format(cd=current_deep, md=max_deep)
-
-        # print(f"DEBUG: _traverse_dir for fid={fid}, current_deep={current_deep}, max_deep={max_deep}")
-        file_detail_list_response = await self.ParseQuarkShareLInk.ls_dir(fid)
+        self.concurrency = concurrency
+        # 扁平的节点表：fid -> 节点，(父目录 fid, 文件名) -> fid；frontier 为受 max_deep 限制尚未列出的目录
+        self.nodes: dict[str, ShareNode] = {}
+        self._name_index: dict[tuple[str, str], str] = {}
+        self.frontier: set[str] = set()
+        self.root_fingerprint: Optional[list] = None  # 根目录的 [条目数, 最新的 updated_at]
+        self._listing: dict[str, asyncio.Future] = {}  # get_node_info 中进行中的 ls_dir，键为目录 fid
+        self._request_count = 0
+        # 最近一次 parse 的 ls_dir 次数（每个目录一次，分页已合并）与耗时
+        self.last_parse_stats = {'requests': 0, 'seconds': 0.0, 'max_deep': -1}
+
+    @property
+    def root(self) -> Optional[ShareNode]:
+        return self.nodes.get('0')
+
+    @property
+    def tree(self) -> Optional[dict]:
+        """与原嵌套结构一致的只读视图，未列出的目录与空目录的 child 为提示字符串"""
+        if self.root is None:
+            return None
+        return self._node_view(self.root)
+
+    def _reset(self):
+        self.nodes.clear()
+        self._name_index.clear()
+        self.frontier.clear()
+        self.root_fingerprint = None
+        self.current_max_deep = -1
+
+    def _add_node(self, node: ShareNode):
+        self.nodes[node.fid] = node
+        if node.pdir_fid is not None:
+            self._name_index[(node.pdir_fid, node.file_name)] = node.fid
+        if node.state == ShareNode.TRUNCATED:
+            self.frontier.add(node.fid)
+
+    def _drop_node(self, node: ShareNode):
+        """从节点表中移除 node 及其下所有节点"""
+        for fid in node.children or []:
+            child = self.nodes.get(fid)
+            if child is not None:
+                self._drop_node(child)
+        self.nodes.pop(node.fid, None)
+        if self._name_index.get((node.pdir_fid, node.file_name)) == node.fid:
+            del self._name_index[(node.pdir_fid, node.file_name)]
+        self.frontier.discard(node.fid)
+
+    def _children_view(self, node: ShareNode):
+        if node.state == ShareNode.TRUNCATED:
+            return MAX_DEEP_REACHED_MSG.format(cd=node.depth + 1, md=self.current_max_deep)
+        if not node.children:
+            return EMPTY_DIR_MSG
+        return [self._node_view(self.nodes[fid]) for fid in node.children]
+
+    def _node_view(self, node: ShareNode) -> dict:
+        view = node.to_dict()
+        if node.is_dir:
+            view['child'] = self._children_view(node)
+        return view
+
+    async def _list(self, node: ShareNode) -> list[dict]:
+        self._request_count += 1
+        file_detail_list_response = await self.ParseQuarkShareLInk.ls_dir(node.fid)
         if not file_detail_list_response or 'list' not in file_detail_list_response:
-            raise Exception(f"Warning: ls_dir for fid {fid} returned an unexpected response,可能为链接已失效: {file_detail_list_response}")
+            raise Exception(f"Warning: ls_dir for fid {node.fid} returned an unexpected response,可能为链接已失效: {file_detail_list_response}")
+        return file_detail_list_response['list']
 
-        file_detail_list = file_detail_list_response['list']
-        if len(file_detail_list) == 0:
-            return '该目录为空'
+    @staticmethod
+    def _listing_fingerprint(file_detail_list: list[dict]) -> list:
+        return [len(file_detail_list), max((file_detail.get('updated_at') or 0 for file_detail in file_detail_list), default=0)]
 
-        result_detail_list = []
+    def _apply_listing(self, node: ShareNode, file_detail_list: list[dict]) -> list[ShareNode]:
+        """
+        用目录的最新列表替换其子节点
+        已展开且 [updated_at, include_items] 未变化的子目录保留原有子树；其余目录作为待列出的目录返回，
+        其中变化了的目录标记为未列出并保留旧的子节点，列出时再逐级比较，只重新列出真正变化的部分
+        """
+        previous = {fid: self.nodes[fid] for fid in node.children or [] if fid in self.nodes}
+        for child in previous.values():
+            self._name_index.pop((node.fid, child.file_name), None)
+        children, pending = [], []
         for file_detail in file_detail_list:
-            node_data = {
-                'fid': file_detail['fid'],
-                'file_name': file_detail['file_name'],
-                'file_type': file_detail['file_type'],
-                'pdir_fid': file_detail['pdir_fid'],
-                'share_fid_token': file_detail['share_fid_token'],
-            }
-            if node_data['file_type'] == 0:  # 0 typically means directory
-                node_data['child'] = await self._traverse_dir(current_deep + 1, max_deep, node_data['fid'])
-            result_detail_list.append(node_data)
-        return result_detail_list
-
-    async def _expand_tree_incrementally(self, node_to_expand, depth_of_node_to_expand: int, new_max_deep: int):
+            fingerprint = [file_detail.get('updated_at'), file_detail.get('include_items')]
+            cached = previous.pop(file_detail['fid'], None)
+            if cached is not None and cached.is_dir and file_detail['file_type'] == 0:
+                child = cached
+                child.file_name = file_detail['file_name']
+                child.share_fid_token = file_detail['share_fid_token']
+                if child.state != ShareNode.EXPANDED or fingerprint[0] is None or child.fingerprint != fingerprint:
+                    child.fingerprint = fingerprint
+                    # 变化了的目录在重新列出之前视为未列出，超出本次遍历深度时留在 frontier 中，不会以旧的子节点返回或写入快照
+                    child.state = ShareNode.TRUNCATED
+                    self.frontier.add(child.fid)
+                    pending.append(child)
+            else:
+                if cached is not None:
+                    self._drop_node(cached)
+                # 分享根目录下条目的 pdir_fid 是分享者网盘中的目录，不是 '0'，统一记为树中的父目录
+                child = ShareNode(file_detail['fid'], file_detail['file_name'], file_detail['file_type'],
+                                  node.fid, file_detail['share_fid_token'], node.depth + 1)
+                child.fingerprint = fingerprint
+                if child.is_dir:
+                    pending.append(child)
+            self._add_node(child)
+            children.append(child.fid)
+        for child in previous.values():
+            self._drop_node(child)
+        node.children = children
+        node.state = ShareNode.EXPANDED
+        self.frontier.discard(node.fid)
+        if node.fid == '0':
+            self.root_fingerprint = self._listing_fingerprint(file_detail_list)
+        return pending
+
+    def _admit(self, nodes: list[ShareNode], dir_predicate: Optional[DirPredicate]) -> list[ShareNode]:
+        """过滤掉 dir_predicate 为 False 的目录，被剪掉的目录保持 truncated，之后不带条件 parse 时仍可展开"""
+        if dir_predicate is None:
+            return nodes
+        siblings_by_parent = {}
+        admitted = []
+        for node in nodes:
+            parent = self.nodes.get(node.pdir_fid)
+            if parent is None:
+                admitted.append(node)
+                continue
+            if parent.fid not in siblings_by_parent:
+                siblings_by_parent[parent.fid] = [self.nodes[fid].to_dict() for fid in parent.children if self.nodes[fid].is_dir]
+            if dir_predicate(node.to_dict(), siblings_by_parent[parent.fid]):
+                admitted.append(node)
+        return admitted
+
+    async def _expand_bfs(self, frontier: list[ShareNode], max_deep: int, dir_predicate: Optional[DirPredicate] = None,
+                          file_predicate: Optional[FilePredicate] = None,
+                          stop_when: Optional[Callable[[list[dict]], bool]] = None):
         """
-        Recursively expands parts of the tree that were previously limited by max_deep.
-        :param node_to_expand: The current dictionary node in the tree to examine/expand.
-        :param depth_of_node_to_expand: The depth of node_to_expand in the overall tree.
-        :param new_max_deep: The new maximum depth to parse to.
+        按层展开目录，同一层的目录在 concurrency 限制下并发列出
+        :param frontier: 待列出的目录节点
+        :param max_deep: 子节点深度超过该值的目录不再列出，保持 truncated 留在 self.frontier 中供之后增量展开
+        :param dir_predicate: 为 False 的目录不列出
+        :param file_predicate: 计入 stop_when 的文件，为 None 时计入所有文件
+        :param stop_when: 以本次遍历找到的文件调用，返回 True 后不再列出新的目录
         """
-        if not isinstance(node_to_expand, dict) or node_to_expand.get('file_type') != 0:  # Only expand directories
+        semaphore = asyncio.Semaphore(self.concurrency)
+        found = []
+        stopped = False
+
+        async def _expand(node):
+            nonlocal stopped
+            async with semaphore:
+                if stopped:
+                    return []
+                pending = self._apply_listing(node, await self._list(node))
+            if stop_when is not None:
+                found.extend(child.to_dict() for child in map(self.nodes.get, node.children)
+                             if not child.is_dir and (file_predicate is None or file_predicate(child.to_dict())))
+                if not stopped and stop_when(found):
+                    utils.logger.debug(f'分享 {self.share_link} 满足停止条件：{self._request_count} 次 ls_dir，'
+                                       f'找到 {len(found)} 个文件')
+                    stopped = True
+            return pending
+
+        while frontier and not stopped:
+            to_fetch = self._admit([node for node in frontier if node.depth + 1 <= max_deep], dir_predicate)
+            results = await asyncio.gather(*[_expand(node) for node in to_fetch])
+            frontier = [child for pending in results for child in pending]
+
+    def _restore_snapshot(self, snapshot: dict):
+        self._reset()
+        for fid, file_name, file_type, pdir_fid, share_fid_token, depth, state, fingerprint in snapshot['nodes']:
+            node = ShareNode(fid, file_name, file_type, pdir_fid, share_fid_token, depth)
+            node.state = state
+            node.fingerprint = fingerprint
+            if state == ShareNode.EXPANDED:
+                node.children = []
+            self._add_node(node)
+            if pdir_fid is not None:
+                self.nodes[pdir_fid].children.append(fid)
+        self.root_fingerprint = snapshot['fingerprint']
+        self.current_max_deep = snapshot['max_deep']
+
+    async def _revalidate(self):
+        """列出根目录校验快照，指纹变化时只重新列出变化的子树"""
+        file_detail_list = await self._list(self.root)
+        if self._listing_fingerprint(file_detail_list) == self.root_fingerprint:
             return
-
-        children_content = node_to_expand.get('child')
-        # Regex to parse the "max_deep reached" message
-        max_deep_msg_regex = r"请增加max_deep以查看此目录,current_deep=(\d+),max_deep=(\d+)"
-
-        if isinstance(children_content, str):
-            match = re.fullmatch(max_deep_msg_regex, children_content)
-            if match:
-                msg_current_deep = int(
-                    match.group(1))  # Depth at which original traversal stopped for this node's children
-                # msg_original_max_deep = int(match.group(2)) # Original max_deep that caused the stop
-
-                # If the depth where it previously stopped is now within the new_max_deep, we can expand this node's children
-                if msg_current_deep <= new_max_deep:
-                    print(
-                        f"  Incrementally expanding children of '{node_to_expand.get('file_name')}' (fid: {node_to_expand['fid']}). Original stop depth for children: {msg_current_deep}, new_max_deep: {new_max_deep}")
-
-                    # Re-fetch children for this node, starting traversal from where it left off (msg_current_deep)
-                    node_to_expand['child'] = await self._traverse_dir(
-                        current_deep=msg_current_deep,  # This is the depth of the children being fetched
-                        max_deep=new_max_deep,
-                        fid=node_to_expand['fid']
-                    )
-                    # After expanding this node, its new children (if they are directories) might also need expansion.
-                    # The _traverse_dir call above would have placed new "max_deep_reached" messages if applicable.
-                    # So, we need to recursively call _expand_tree_incrementally on these newly fetched children.
-                    if isinstance(node_to_expand['child'], list):
-                        for newly_fetched_child_node in node_to_expand['child']:
-                            # The newly_fetched_child_node itself is at depth 'msg_current_deep'.
-                            await self._expand_tree_incrementally(newly_fetched_child_node, msg_current_deep,
-                                                                  new_max_deep)
-        elif isinstance(children_content, list):
-            # If children are already a list (not a message string), recurse into them
-            # to see if their sub-branches need expansion.
-            # The children of 'node_to_expand' are at depth 'depth_of_node_to_expand + 1'.
-            child_depth = depth_of_node_to_expand + 1
-            for child_node in children_content:
-                await self._expand_tree_incrementally(child_node, child_depth, new_max_deep)
-
-    async def parse(self, max_deep: int = 1,refresh: bool = False):
+        utils.logger.info(f'分享 {self.share_link} 的快照已变化，重新列出变化的子树')
+        await self._expand_bfs(self._apply_listing(self.root, file_detail_list), self.current_max_deep)
+
+    def _save_snapshot(self):
+        rows, stack = [], [self.root]
+        while stack:
+            node = stack.pop()
+            rows.append([node.fid, node.file_name, node.file_type, node.pdir_fid, node.share_fid_token, node.depth,
+                         node.state, node.fingerprint])
+            if node.state == ShareNode.EXPANDED:
+                stack.extend(self.nodes[fid] for fid in reversed(node.children))
+        share_client = self.ParseQuarkShareLInk
+        try:
+            self.snapshot_store.save(self.share_link, share_client.pwd_id, share_client.passcode, share_client.stoken,
+                                     self.root_fingerprint, self.current_max_deep, rows)
+        except sqlite3.Error as e:
+            utils.logger.warning(f'保存分享目录树快照失败：{e}')
+
+    def _expandable(self, max_deep: int) -> list[ShareNode]:
+        """frontier 中在 max_deep 下可以继续列出的目录（更深的目录、被剪枝或提前停止时未列出的目录）"""
+        return [self.nodes[fid] for fid in self.frontier if self.nodes[fid].depth + 1 <= max_deep]
+
+    async def _expand_tree_incrementally(self, new_max_deep: int, **conditions):
+        """展开 frontier 中在 new_max_deep 下可以继续列出的目录，合并为一次按层遍历"""
+        frontier = sorted(self._expandable(new_max_deep), key=lambda node: node.depth)
+        if frontier:
+            utils.logger.debug(f'分享 {self.share_link} 增量展开 {len(frontier)} 个目录，new_max_deep={new_max_deep}')
+        await self._expand_bfs(frontier, new_max_deep, **conditions)
+
+    async def parse(self, max_deep: int = 1,refresh: bool = False, use_snapshot: bool = True,
+                    dir_predicate: Optional[DirPredicate] = None, file_predicate: Optional[FilePredicate] = None,
+                    stop_when: Optional[Callable[[list[dict]], bool]] = None):
+        """
+        :param max_deep: 列出的最大深度，根目录的子节点深度为 0
+        :param refresh: 丢弃内存中的目录树并跳过快照，完整地重新列出，列出的结果会覆盖快照
+        :param use_snapshot: 内存中没有目录树且不是 refresh 时从本地快照恢复，只列出根目录校验
+        :param dir_predicate: dir_predicate(目录, 同级目录) 为 False 的目录不列出，如 all_of(skip_extras, prefer_4k)
+        :param file_predicate: 计入 stop_when 的文件，如 is_video
+        :param stop_when: stop_when(本次找到的文件) 为 True 时停止遍历，未列出的目录留待之后的 parse 展开
+        """
+        conditions = {'dir_predicate': dir_predicate, 'file_predicate': file_predicate, 'stop_when': stop_when}
         if refresh:
-            self.tree=None
-        if self.ParseQuarkShareLInk is None:
-
-            self.ParseQuarkShareLInk = await QuarkDisk.parse_share_url(self.share_link)
-
-        if self.tree is None:
-            print(f"Performing initial parse with max_deep={max_deep}...")
-            self.tree = {
-                'file_name': '/',
-                'fid': '0',
-                'file_type': 0,
-                'pdir_fid': None,
-                'share_fid_token': None,
+            self._reset()
+        snapshot = None
+        if self.root is None and use_snapshot and not refresh:
+            snapshot = self.snapshot_store.load(self.share_link)
+            if snapshot is not None and snapshot['stoken'] \
+                    and ParseQuarkShareLInk.stoken_store.get(snapshot['pwd_id'], snapshot['passcode']) is None:
+                ParseQuarkShareLInk.stoken_store.put(snapshot['pwd_id'], snapshot['passcode'], snapshot['stoken'])
+        await self.ensure_share_client()
+
+        self._request_count = 0
+        start = time.perf_counter()
+        if self.root is None and snapshot is not None:
+            self._restore_snapshot(snapshot)
+            try:
+                await self._revalidate()
+            except Exception:
+                self._reset()
+                self.snapshot_store.delete(self.share_link)
+                raise
+        if self.root is None:
+            utils.logger.debug(f'首次解析分享 {self.share_link}，max_deep={max_deep}')
+            root = ShareNode('0', '/', 0, None, None, depth=-1)
+            self._add_node(root)
+            try:
                 # Initial traversal for root's children starts at current_deep=0
-                'child': await self._traverse_dir(current_deep=0, max_deep=max_deep, fid='0'),
-            }
+                await self._expand_bfs([root], max_deep, **conditions)
+            except Exception:
+                self._reset()
+                raise
             self.current_max_deep = max_deep
-        elif max_deep > self.current_max_deep:
-
-            # The root node 'self.tree' is at an effective depth of -1 for its children to be at depth 0.
-            await self._expand_tree_incrementally(self.tree, -1, max_deep)
-            self.current_max_deep = max_deep  # Update to the new, greater max_deep
-        elif max_deep <= self.current_max_deep:
-            pass
-            # The tree data is already sufficient or deeper than requested.
-            # We don't prune the tree if max_deep is smaller; we just don't fetch more.
-            # If you need to reflect a smaller max_deep in ls_dir, that would be a display-time adjustment.
+        elif max_deep > self.current_max_deep or self._expandable(max_deep):
+            await self._expand_tree_incrementally(max_deep, **conditions)
+            self.current_max_deep = max(max_deep, self.current_max_deep)
+        # 否则已有的数据足够，不裁剪也不再请求
+        self.last_parse_stats = {'requests': self._request_count, 'seconds': time.perf_counter() - start,
+                                 'max_deep': self.current_max_deep}
+        if self._request_count:
+            self._save_snapshot()
+            utils.logger.info(f"解析分享 {self.share_link}：{self._request_count} 次 ls_dir，"
+                              f"耗时 {self.last_parse_stats['seconds']:.2f}s，共 {len(self.nodes) - 1} 个节点")
 
     def _print_tree_recursive(self, node, prefix="", is_last=True, level=0) -> list[str]:
         """
@@ -157,13 +549,14 @@ class QuarkShareDirTree:
         画出完整目录树
         :return: A string representation of the directory tree.
         """
-        if not self.tree:
+        tree = self.tree
+        if not tree:
             return "Tree has not been parsed yet. Call parse() first."
 
         output_lines = []
-        output_lines.append(self.tree.get('file_name', '/'))  # Root directory name
+        output_lines.append(tree.get('file_name', '/'))  # Root directory name
 
-        children = self.tree.get('child')
+        children = tree.get('child')
         if isinstance(children, list):
             for i, child_node in enumerate(children):
                 is_last_child = (i == len(children) - 1)
@@ -175,59 +568,74 @@ class QuarkShareDirTree:
 
         return "\n".join(output_lines)
 
-    def get_node_info(self, path: str):
-        if not self.tree:
-            print("Tree has not been parsed yet. Call parse() first.")
-            return None
-
-        if not path or path == '/':
-            return self.tree
-
-        components = [comp for comp in path.strip('/').split('/') if comp]
-        if not components:
-            return self.tree
-
-        current_node = self.tree
-        for component in components:
-            if not isinstance(current_node, dict) or 'child' not in current_node:
+    def find_node(self, path: str) -> Optional[ShareNode]:
+        """按路径查找节点，逐级使用 (父目录 fid, 文件名) 索引"""
+        node = self.root
+        for component in [comp for comp in path.strip('/').split('/') if comp]:
+            if node is None or node.state != ShareNode.EXPANDED:
                 return None
+            fid = self._name_index.get((node.fid, component))
+            node = self.nodes.get(fid) if fid is not None else None
+        return node
 
-            children = current_node.get('child')
-            if not isinstance(children, list):  # Path leads into a branch that's a string message
-                return None
-
-            found_next_node = False
-            for child_node in children:
-                if isinstance(child_node, dict) and child_node.get('file_name') == component:
-                    current_node = child_node
-                    found_next_node = True
-                    break
-
-            if not found_next_node:
+    async def _ensure_listed(self, node: ShareNode):
+        """列出尚未列出的目录，同一目录的并发请求共用一次 ls_dir"""
+        if node.state == ShareNode.EXPANDED:
+            return
+        task = self._listing.get(node.fid)
+        if task is None:
+            async def _list_node():
+                try:
+                    self._apply_listing(node, await self._list(node))
+                finally:
+                    self._listing.pop(node.fid, None)
+
+            task = asyncio.ensure_future(_list_node())
+            self._listing[node.fid] = task
+        await asyncio.shield(task)
+
+    async def get_node_info(self, path: str, expand: bool = True):
+        """
+        按需解析路径，只列出路径上尚未列出的目录，结果写入节点表供之后复用，
+        单个路径的请求数为 O(深度)，与分享的总大小无关
+        :param path: 分享内的路径，如 /剧名/S01
+        :param expand: 目标为目录时同时列出其子节点
+        :return: 节点的 dict 视图，路径不存在时返回 None
+        """
+        await self.ensure_share_client()
+        if self.root is None:
+            # 未 parse 过时建立只有根目录的树，之后的 parse 从 frontier 增量展开
+            self._add_node(ShareNode('0', '/', 0, None, None, depth=-1))
+        node = self.root
+        for component in [comp for comp in (path or '/').strip('/').split('/') if comp]:
+            await self._ensure_listed(node)
+            fid = self._name_index.get((node.fid, component))
+            if fid is None:
                 return None
+            node = self.nodes[fid]
+        if expand and node.is_dir:
+            await self._ensure_listed(node)
+        return self._node_view(node)
 
-        return current_node
+    async def ensure_share_client(self) -> ParseQuarkShareLInk:
+        """确保分享解析客户端已初始化（从快照恢复或已关闭的目录树尚未初始化），返回该客户端"""
+        if self.ParseQuarkShareLInk is None:
+            self.ParseQuarkShareLInk = await QuarkDisk.parse_share_url(self.share_link)
+        return self.ParseQuarkShareLInk
 
     async def close_(self):
         if self.ParseQuarkShareLInk:
             await self.ParseQuarkShareLInk.close()
-            # self.ParseQuarkShareLInk = None # Reset to allow re-initialization if parse is called again.
-            # self.tree = None # Also reset tree state if closing means full reset
-            # self.current_max_deep = -1
+            # 置空后再次 parse 会重新初始化客户端，stoken 由 stoken_store 复用
+            self.ParseQuarkShareLInk = None
             print("ParseQuarkShareLInk instance has been closed.")
-        # To fully support re-parsing after close, you might want to uncomment the resets above,
-        # or ensure parse() re-initializes ParseQuarkShareLInk if it's None.
-        # The current parse() logic re-initializes ParseQuarkShareLInk if it's None.
 
-    quark_share_tree_dict = {}
+    cache = ShareTreeCache()
+    snapshot_store = ShareTreeSnapshotStore()
 
     @staticmethod
     def get_quark_share_tree(share_link: str):
-        quark_share_tree = QuarkShareDirTree.quark_share_tree_dict.get(share_link, None)
-        if quark_share_tree is None:
-            quark_share_tree = QuarkShareDirTree(share_link)
-            QuarkShareDirTree.quark_share_tree_dict.update({share_link: quark_share_tree})
-        return quark_share_tree
+        return QuarkShareDirTree.cache.get(share_link, QuarkShareDirTree)
 
     @staticmethod
     def get_video_node_info_from_tree(tree_node) -> list[dict]:
@@ -256,25 +664,40 @@ class QuarkShareDirTree:
         traverse(tree_node)
         return result
 
-    def get_video_node_info(self) -> list[dict]:
+    def get_video_node_info(self, dir_predicate: Optional[DirPredicate] = None) -> list[dict]:
         """
         遍历整个目录树，获取所有 mp4/mkv 文件的节点信息。
+        :param dir_predicate: 与 parse 相同的目录条件，跳过不满足的目录（目录树来自不带条件的解析或快照时同样生效）
         :return: 包含视频文件节点的列表。
         """
-        if not self.tree:
+        if self.root is None:
             print("Tree has not been parsed yet. Call parse() first.")
             return []
 
-        return self.get_video_node_info_from_tree(self.tree)
+        result = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if not node.is_dir:
+                if is_video(node.to_dict()):
+                    result.append(node.to_dict())
+                continue
+            children = [self.nodes[fid] for fid in node.children or []]
+            if dir_predicate is not None:
+                siblings = [child.to_dict() for child in children if child.is_dir]
+                children = [child for child in children if not child.is_dir or dir_predicate(child.to_dict(), siblings)]
+            stack.extend(reversed(children))
+        return result
     @staticmethod
     async def close():
-        for i in QuarkShareDirTree.quark_share_tree_dict.values():
-            await i.close_()
+        utils.logger.info(f'分享目录树缓存：{QuarkShareDirTree.cache.stats()}')
+        await QuarkShareDirTree.cache.close()
 async def main():
     quark_share_tree=QuarkShareDirTree('https://pan.quark.cn/s/b11805926008')
     await quark_share_tree.parse(max_deep=1)
     await quark_share_tree.parse(max_deep=2)
 
     await quark_share_tree.close()
+    await QuarkTransport.close()
 if __name__ == '__main__':
     asyncio.run(main())
\ No newline at end of file
@@ -11,6 +11,7 @@ import settings
 import utils
 from QuarkDisk import QuarkDisk
 from Services.alist_api import AlistAPI
+from Services.quark_mirror import QuarkMirror
 from Services.quark_share_dir_tree import QuarkShareDirTree
 from Services.video_edit import VideoMetadataEditor
 from database import engine
@@ -18,8 +19,10 @@ from models.resource import Resource
 
 
 class RiskHandle:
-    def __init__(self,alist:AlistAPI):
+    def __init__(self,alist:AlistAPI,mirrors:dict[str,QuarkMirror]=None):
         self.alist = alist
+        # {账号名: QuarkMirror}，提供时网盘目录列表从本地镜像读取
+        self.mirrors = mirrors or {}
         self.local_base='/downloads'
         self.cloud_base='/夸克网盘'
     async def add_copy(self,src_path,dst_path,file_name_list,base_src,base_dst):
@@ -145,11 +148,10 @@ class RiskHandle:
         pdir_path = os.path.dirname(src_path)
         item_rename = RiskHandle.rename(item_name)
         new_src_path = f"{pdir_path}/{item_rename}"
-        await quark_disk.mkdir(new_src_path)
+        to_pdir_fid = await quark_disk.ensure_dir(new_src_path)
         fid = (await quark_disk.get_fids([src_path]))[0]['fid']
         file_list = await quark_disk.ls_dir(fid)
         fid_file_list = [file['fid'] for file in file_list]
-        to_pdir_fid = (await quark_disk.get_fids([new_src_path]))[0]['fid']
         try:
             await quark_disk.move(fid_file_list, to_pdir_fid)
         except Exception as e:
@@ -180,11 +182,15 @@ class RiskHandle:
         #     return
         pdir_fid = (await  quark_disk.get_fids([cloud_src_path]))[0]['fid']
 
-        cloud_file_list = await quark_disk.ls_dir(pdir_fid)
+        mirror = self.mirrors.get(quark_disk.name)
+        if mirror is not None:
+            cloud_file_list = await mirror.ls_dir(pdir_fid)
+        else:
+            cloud_file_list = await quark_disk.ls_dir(pdir_fid)
         quark_share_dir_tree = QuarkShareDirTree.get_quark_share_tree(share_link)
-        await quark_share_dir_tree.parse(max_deep=10)
         share_file_pdir_path = f'/{os.path.basename(cloud_src_path)}'
-        share_file_list = quark_share_dir_tree.get_node_info(share_file_pdir_path)
+        # 只列出该目录及其路径上的目录，无需遍历整个分享
+        share_file_list = await quark_share_dir_tree.get_node_info(share_file_pdir_path)
         share_file_name_list = []
         if isinstance(share_file_list['child'], list):
             share_file_name_list = [share_file['file_name'] for share_file in share_file_list['child']]
@@ -10,9 +10,11 @@ from sqlalchemy.orm.attributes import flag_modified
 from sqlmodel import Session, select
 
 import Services.crawler_resource.crawler
+import metrics
 import settings
 import utils
-from QuarkDisk import QuarkDisk
+from QuarkDisk import QuarkDisk, QuarkTransport
+from QuarkDiskPool import QuarkDiskPool
 from Services.alist_api import AlistAPI
 from Services.aria2_api import Aria2API
 from Services.crawler_resource.crawler import ResourceQuark
@@ -21,15 +23,24 @@ from Services.crawler_resource.telegram.uc_quark_crawler import TMeUCQuarkCrawle
 from Services.download_torrent import DownloadTorrent
 from Services.episode_namer_dir.episode_namer import  EpisodeNamer
 from Services.episode_namer_dir.public_episode_namer import PublicEpisodeNamer
+from Services.quark_mirror import QuarkMirror
 from Services.quark_share_dir_tree import QuarkShareDirTree
 from database import engine
 from models.resource import Resource, ResourceCategory
 
 
 class SyncCloudDisk:
-    def __init__(self,quark_disk:QuarkDisk,aria2api:Aria2API,alistapi:AlistAPI,t_me_uc_crawler:TMeUCQuarkCrawler,quark_share_crawler:QuarkShareCrawler):
+    SYNC_CONCURRENCY = 4  # 同时同步的资源数
 
-        self.quark_disk = quark_disk
+    def __init__(self,pool:QuarkDiskPool,aria2api:Aria2API,alistapi:AlistAPI,t_me_uc_crawler:TMeUCQuarkCrawler,quark_share_crawler:QuarkShareCrawler,mirrors:dict[str,QuarkMirror]=None):
+        """
+        :param pool: 账号池，资源按网盘路径 sticky 到账号，未绑定的资源使用主账号
+        :param mirrors: {账号名: QuarkMirror}
+        """
+        self.pool = pool
+        self.quark_disk = pool.primary
+        # 提供镜像时目录列表从本地镜像读取，未同步或被写操作标记过期的目录才实时列出
+        self.mirrors = mirrors or {}
         self.aria2_api = aria2api
         self.alist_api = alistapi
         self.t_me_uc_crawler = t_me_uc_crawler
@@ -68,23 +79,23 @@ class SyncCloudDisk:
             print("No match found.")
 
 
-    async def get_cloud_pdir(self,path,ls_dir=True):
+    async def get_cloud_pdir(self,path,ls_dir=True,quark_disk:QuarkDisk=None):
         """
         查询网盘对应的目录，如果不存在则创建
         :param ls_dir:
         :param resource:
+        :param quark_disk: 为 None 时使用主账号
         :return:
         """
-
-        try:
-            pdir_fid = (await self.quark_disk.get_fids([path]))[0]['fid']
-        except Exception:
-            await self.quark_disk.mkdir(path)
-
-            pdir_fid = (await self.quark_disk.get_fids([path]))[0]['fid']
+        quark_disk = quark_disk or self.quark_disk
+        pdir_fid = await quark_disk.ensure_dir(path)
         file_list=None
         if ls_dir:
-            file_list = await self.quark_disk.ls_dir(pdir_fid)
+            mirror = self.mirrors.get(quark_disk.name)
+            if mirror is not None:
+                file_list = await mirror.ls_dir(pdir_fid)
+            else:
+                file_list = await quark_disk.ls_dir(pdir_fid)
 
         return pdir_fid, file_list
 
@@ -95,7 +106,7 @@ class SyncCloudDisk:
 
 
 
-    async def get_need_sync_list(self,search_result:Services.crawler_resource.crawler.SearchResult,resource:Resource)->ResourceQuark:
+    async def get_need_sync_list(self,search_result:Services.crawler_resource.crawler.SearchResult,resource:Resource,quark_disk:QuarkDisk=None)->ResourceQuark:
         """
         将爬取的资源与网盘存在的资源进行对比，找到需要更新的爬取的资源,
         :param search_result:
@@ -103,7 +114,7 @@ class SyncCloudDisk:
         :return:
         """
         crawler_episode_collection = [i.format_name for i in search_result.result[0].file_list]
-        pdir_fid, file_list = await self.get_cloud_pdir(resource.cloud_storage_path)
+        pdir_fid, file_list = await self.get_cloud_pdir(resource.cloud_storage_path,quark_disk=quark_disk)
         cloud_episode_collection = [(await PublicEpisodeNamer.generate_name([file['file_name']]))[0].format_name for file in file_list if file['file_type']!=0]
         # 作差集找到网盘中不存在的集数
 
@@ -127,65 +138,73 @@ class SyncCloudDisk:
 
 
 
-    async def ensure_cloud_dir_empty(self,resource:Resource):
+    async def ensure_cloud_dir_empty(self,resource:Resource,quark_disk:QuarkDisk=None):
         """
         确保网盘目录存在且无torrent文件
         :return:
         """
-        pdir_fid,file_list= await self.get_cloud_pdir(resource.cloud_storage_path)
+        quark_disk = quark_disk or self.quark_disk
+        pdir_fid,file_list= await self.get_cloud_pdir(resource.cloud_storage_path,quark_disk=quark_disk)
         remove_fid_list=[]
         for file in file_list:
             file_name=file['file_name']
             if file_name.endswith('.torrent'):
                 remove_fid_list.append(file['fid'])
         if len(remove_fid_list)>0:
-            await self.quark_disk.delete(remove_fid_list)
+            await quark_disk.delete(remove_fid_list)
 
-    async def save_to_cloud(self,resource_quark:ResourceQuark,resource:Resource):
+    async def save_to_cloud(self,resource_quark:ResourceQuark,resource:Resource,quark_disk:QuarkDisk=None):
+        quark_disk = quark_disk or self.quark_disk
         fid_list=[i.fid for i in resource_quark.file_list]
         share_fid_token_list=[i.share_fid_token for i in resource_quark.file_list]
 
 
-        to_pdir_fid,_= await self.get_cloud_pdir(resource.cloud_storage_path,ls_dir=False)
+        to_pdir_fid,_= await self.get_cloud_pdir(resource.cloud_storage_path,ls_dir=False,quark_disk=quark_disk)
         quark_dir_tree=QuarkShareDirTree.get_quark_share_tree(resource_quark.url)
-        stoken=quark_dir_tree.ParseQuarkShareLInk.stoken
-        pwd_id=quark_dir_tree.ParseQuarkShareLInk.pwd_id
+        share_client=await quark_dir_tree.ensure_share_client()
+        stoken=share_client.stoken
+        pwd_id=share_client.pwd_id
         title=resource.title
         to_pdir_path=resource.cloud_storage_path
         share_link=resource_quark.url
         try:
-            await  self.quark_disk.save_file(fid_list=fid_list,
+            await  quark_disk.save_file(fid_list=fid_list,
                                            fid_token_list=share_fid_token_list,
                                            to_pdir_fid=to_pdir_fid, stoken=stoken,
-                                           pwd_id=pwd_id)
+                                           pwd_id=pwd_id, batch=True,
+                                           file_names=[i.file_name for i in resource_quark.file_list])
             utils.logger.info(f'{title}|{share_link}✅转存{[i.format_name for i in resource_quark.file_list]}到{to_pdir_path}成功')
-            await asyncio.sleep(3)
-            _,file_list_=await self.get_cloud_pdir(resource.cloud_storage_path,ls_dir=True)
+            _,file_list_=await self.get_cloud_pdir(resource.cloud_storage_path,ls_dir=True,quark_disk=quark_disk)
             file_maps_={
                 file['file_name']:file['fid']
                 for file in file_list_
             }
 
             # 改名
+            rename_mapping={}
             for quark_file in resource_quark.file_list:
                 fid= file_maps_.get(quark_file.file_name)
                 suffix=quark_file.file_name.split('.')[-1]
                 new_name=f'{quark_file.format_name}.{suffix}'
                 if fid is not None:
-                    resp= await self.quark_disk.rename(fid,new_name)
-                    await asyncio.sleep(1)
+                    rename_mapping[fid]=new_name
+            current_names={fid:file_name for file_name,fid in file_maps_.items()}
+            rename_results=await quark_disk.rename_many(rename_mapping,current_names)
+            rename_failed=[r for r in rename_results.values() if r['code']!=0]
+            if len(rename_failed)>0:
+                utils.logger.error(f'{title}|{share_link}❌改名失败：{rename_failed}')
 
         except Exception as e:
 
             utils.logger.error(f'{title}|{share_link}❌转存失败，抛出异常：{str(e)}')
 
-    async def is_next_need_update(self,latest_episode:str,path):
+    async def is_next_need_update(self,latest_episode:str,path,quark_disk:QuarkDisk=None):
         """
         与全网更新的剧集对比，判断是否有剧集缺少
         :return:
         """
 
-        _,file_list=await self.get_cloud_pdir(path)
+        _,file_list=await self.get_cloud_pdir(path,quark_disk=quark_disk)
         cloud_episode_liste=[
             i.format_name
             for i in await PublicEpisodeNamer.generate_name([
@@ -200,113 +219,133 @@ class SyncCloudDisk:
 
     async def start_async(self):
         with Session(engine) as session:
-            statement = select(Resource).where(Resource.category == ResourceCategory.HOT_CN_DRAMA).order_by(
+            statement = select(Resource.id).where(Resource.category == ResourceCategory.HOT_CN_DRAMA).order_by(
                 Resource.douban_last_async.desc()).limit(settings.select_resource_num)
-            results = session.exec(statement)
-            resources = results.all()
-            # resources=[resource for resource in resources if resource.title=='狮城山海(2025)']
-            for resource in resources:
-                douban_episode_update = resource.douban_last_episode_update
-                if resource.cloud_disk_async_info is None:
-                    resource.cloud_disk_async_info={}
-                cloud_disk_async_info = resource.cloud_disk_async_info
-                if cloud_disk_async_info is None:
-                    cloud_disk_async_info = {}
-                cloud_disk_async_time = datetime.fromisoformat(
-                    cloud_disk_async_info['last_async_time']) if cloud_disk_async_info.get('last_async_time') else None
-
-                is_skip_update = cloud_disk_async_info.get('is_skip_update', False)
-                is_force_update = cloud_disk_async_info.get('is_force_update', False)
-                need_update=cloud_disk_async_info.get('need_update', False)
-                total_episodes=resource.total_episodes
-                if ((((cloud_disk_async_time is None) or (cloud_disk_async_time < douban_episode_update) or (need_update==True)) and is_skip_update == False ) or is_force_update)and (total_episodes!=''and total_episodes is not None):
-                    title = resource.title
-                    pdir_path = resource.cloud_storage_path
-                    total_episodes = resource.total_episodes
-
-                    # 从之前的分享链接中尝试同步资源
-                    if cloud_disk_async_info.get('share_links',None) is None:
-                        cloud_disk_async_info['share_links']=[]
-
-
-                    need_call_other_crawler=False
-
-                    if len(cloud_disk_async_info['share_links'])>0:
-                        share_link=cloud_disk_async_info['share_links'][0]
-                        try:
-                            search_result_=await self.quark_share_crawler.search(share_link,title=title)
-                        except Exception as e:
-                            need_call_other_crawler=True
-                            utils.logger.error(f'{title}|{share_link} 从该链接同步资源发生错误 {str(e)}')
-                    else:
-                        need_call_other_crawler=True
-                    # 调用电报爬虫爬取资源
-                    if need_call_other_crawler:
-                        try:
-                            search_result_ = await self.t_me_uc_crawler.search(*self.splite_title(title))
-                        except Exception as e:
-                            utils.logger.error(f'{title}爬取资源发生错误：{str(e)}')
-                            continue
-
-                    # 将爬取的链接保存
-                    if search_result_.result[0].url not in cloud_disk_async_info['share_links']:
-                        cloud_disk_async_info['share_links'].append(search_result_.result[0].url)
-
-
-                    resource_quark= await self.get_need_sync_list(search_result_,resource)
-
-                    if len(resource_quark.file_list)>0:
-
-                        await self.save_to_cloud(resource_quark,resource)
-                    else:
-                        utils.logger.info(f'{title} | {resource_quark.url}无可更新的内容')
-
-                    try:
-                        if await self.is_next_need_update(resource.total_episodes,resource.cloud_storage_path):
-                            need_update=False
-                        else:
-                            need_update=True
-
-
-                    except Exception as e:
-                        utils.logger.error(f'{title}|判断网盘是否完全同步全网资源失败{e}')
-                        need_update=True
-
-                    cloud_disk_async_info.update({
-                        'last_async_time':datetime.now().isoformat(),
-                        'need_update':need_update,
-
-
-                    })
-                    flag_modified(resource,'cloud_disk_async_info')
-                    session.add(resource)
+            resource_ids = session.exec(statement).all()
+        # 各资源并发同步，同一账号的请求速率仍由 QuarkDisk 的限速器控制
+        semaphore = asyncio.Semaphore(self.SYNC_CONCURRENCY)
+
+        async def _sync(resource_id):
+            async with semaphore:
+                # 每个资源使用独立的 Session，提交时不会使其他协程持有的对象过期，一次提交失败也不影响其他资源
+                with Session(engine) as session:
+                    resource = session.get(Resource, resource_id)
                     try:
-                        session.commit()
+                        await self._sync_resource(session, resource)
                     except Exception as e:
-                        print(e)
-
-                    await asyncio.sleep(10)
-
-
-
-
-
-
+                        session.rollback()
+                        utils.logger.error(f'{resource.title}|同步发生错误：{e}')
+
+        await asyncio.gather(*[_sync(resource_id) for resource_id in resource_ids])
+
+    async def _sync_resource(self, session: Session, resource: Resource):
+        douban_episode_update = resource.douban_last_episode_update
+        if resource.cloud_disk_async_info is None:
+            resource.cloud_disk_async_info={}
+        cloud_disk_async_info = resource.cloud_disk_async_info
+        if cloud_disk_async_info is None:
+            cloud_disk_async_info = {}
+        cloud_disk_async_time = datetime.fromisoformat(
+            cloud_disk_async_info['last_async_time']) if cloud_disk_async_info.get('last_async_time') else None
+
+        is_skip_update = cloud_disk_async_info.get('is_skip_update', False)
+        is_force_update = cloud_disk_async_info.get('is_force_update', False)
+        need_update=cloud_disk_async_info.get('need_update', False)
+        total_episodes=resource.total_episodes
+        if not (((((cloud_disk_async_time is None) or (cloud_disk_async_time < douban_episode_update) or (need_update==True)) and is_skip_update == False ) or is_force_update)and (total_episodes!=''and total_episodes is not None)):
+            return
+        title = resource.title
+        pdir_path = resource.cloud_storage_path
+        total_episodes = resource.total_episodes
+
+        # 资源固定在存放它的账号上，之前记录过账号时按记录绑定
+        if cloud_disk_async_info.get('account') in self.pool.disks:
+            self.pool.pin(pdir_path, cloud_disk_async_info['account'])
+        async with self.pool.acquire(key=pdir_path, policy='sticky') as quark_disk:
+            # 从之前的分享链接中尝试同步资源
+            if cloud_disk_async_info.get('share_links',None) is None:
+                cloud_disk_async_info['share_links']=[]
+
+
+            need_call_other_crawler=False
+
+            if len(cloud_disk_async_info['share_links'])>0:
+                share_link=cloud_disk_async_info['share_links'][0]
+                try:
+                    search_result_=await self.quark_share_crawler.search(share_link,title=title)
+                except Exception as e:
+                    need_call_other_crawler=True
+                    utils.logger.error(f'{title}|{share_link} 从该链接同步资源发生错误 {str(e)}')
+            else:
+                need_call_other_crawler=True
+            # 调用电报爬虫爬取资源
+            if need_call_other_crawler:
+                try:
+                    search_result_ = await self.t_me_uc_crawler.search(*self.splite_title(title))
+                except Exception as e:
+                    utils.logger.error(f'{title}爬取资源发生错误：{str(e)}')
+                    return
+
+            # 将爬取的链接保存
+            if search_result_.result[0].url not in cloud_disk_async_info['share_links']:
+                cloud_disk_async_info['share_links'].append(search_result_.result[0].url)
+
+
+            resource_quark= await self.get_need_sync_list(search_result_,resource,quark_disk)
+
+            if len(resource_quark.file_list)>0:
+
+                await self.save_to_cloud(resource_quark,resource,quark_disk)
+            else:
+                utils.logger.info(f'{title} | {resource_quark.url}无可更新的内容')
+
+            try:
+                if await self.is_next_need_update(resource.total_episodes,resource.cloud_storage_path,quark_disk):
+                    need_update=False
+                else:
+                    need_update=True
+
+
+            except Exception as e:
+                utils.logger.error(f'{title}|判断网盘是否完全同步全网资源失败{e}')
+                need_update=True
+
+            cloud_disk_async_info.update({
+                'last_async_time':datetime.now().isoformat(),
+                'need_update':need_update,
+                'account':quark_disk.name,
+
+
+            })
+        flag_modified(resource,'cloud_disk_async_info')
+        session.add(resource)
+        try:
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            utils.logger.error(f'{title}|保存同步信息失败：{e}')
 
 
 async def main():
-    quark_disk=QuarkDisk(settings.STORAGE_CONFIG['quark'][0])
+    metrics.registry.start_snapshot_writer()
+    pool=QuarkDiskPool.from_settings(policy='sticky')
+    # 资源默认存放在主账号，只为主账号建立镜像
+    mirror=QuarkMirror(pool.primary)
+    await mirror.refresh()
     aria2=Aria2API()
     alistapi=AlistAPI()
     quark_share_crawler=QuarkShareCrawler()
     crawler=TMeUCQuarkCrawler(quark_share_crawler)
-    sync_cloud=SyncCloudDisk(quark_disk,aria2,alistapi,crawler,quark_share_crawler)
+    sync_cloud=SyncCloudDisk(pool,aria2,alistapi,crawler,quark_share_crawler,{pool.primary.name:mirror})
     await sync_cloud.start_async()
-    await quark_disk.close()
+    mirror.close()
+    await pool.close()
     await aria2.close()
     await alistapi.close()
     await crawler.close()
     await QuarkShareDirTree.close()
+    await QuarkTransport.close()
+    await metrics.registry.stop_snapshot_writer()
 
 if __name__ == '__main__':
     asyncio.run(main())
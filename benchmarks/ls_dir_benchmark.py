@@ -0,0 +1,103 @@
+"""
+对比 QuarkDisk.ls_dir / ParseQuarkShareLInk.ls_dir 串行分页与并发分页的耗时
+使用 fixtures/ls_dir_large.json 中按真实接口字段合成的目录列表（非抓包录制，fid、文件名等均为生成数据），
+由本地 aiohttp 服务按 _page/_size 切片返回，每个请求注入固定延迟模拟公网往返
+
+运行：python benchmarks/ls_dir_benchmark.py
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+from aiohttp import web
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [BASE_DIR, os.path.join(BASE_DIR, 'CloudDisk')]
+
+from QuarkDisk import ParseQuarkShareLInk, QuarkDisk, QuarkTransport
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'ls_dir_large.json')
+LATENCY = 0.12  # 单次请求注入的延迟（秒）
+DIR_SIZES = [50, 200, 480]  # 测试的目录条数
+HOST, PORT = '127.0.0.1', 18765
+
+
+class FixtureServer:
+    def __init__(self, fixture: dict):
+        self.entries = fixture['list']
+        self.total = len(self.entries)
+        self.request_count = 0
+        self.runner = None
+
+    async def _list(self, request: web.Request):
+        self.request_count += 1
+        await asyncio.sleep(LATENCY)
+        page = int(request.query.get('_page', 1))
+        size = int(request.query.get('_size', 50))
+        items = self.entries[(page - 1) * size: page * size]
+        return web.json_response({
+            'code': 0,
+            'message': 'ok',
+            'data': {'list': items},
+            'metadata': {'_total': self.total, '_page': page, '_size': size, '_count': len(items)},
+        })
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/1/clouddrive/file/sort', self._list)
+        app.router.add_get('/1/clouddrive/share/sharepage/detail', self._list)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, HOST, PORT).start()
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+async def _measure(server: FixtureServer, ls_dir, parallel: bool) -> tuple[float, int, int]:
+    server.request_count = 0
+    start = time.perf_counter()
+    result = await ls_dir(parallel)
+    elapsed = time.perf_counter() - start
+    file_list = result if isinstance(result, list) else result['list']
+    return elapsed, server.request_count, len(file_list)
+
+
+async def main():
+    with open(FIXTURE_PATH, encoding='utf-8') as f:
+        fixture = json.load(f)
+    if fixture.get('metadata', {}).get('synthetic'):
+        print(f'fixture: {fixture["metadata"].get("description", "合成数据")}')
+    server = FixtureServer(fixture)
+    await server.start()
+
+    quark_disk = QuarkDisk({'name': 'benchmark', 'cookie': ''})
+    quark_disk.BASE_URL = f'http://{HOST}:{PORT}'
+    share = ParseQuarkShareLInk('https://pan.quark.cn/s/benchmark')
+    share.BASE_URL = quark_disk.BASE_URL
+    share.pwd_id, share.stoken = 'benchmark', 'benchmark'
+    clients = {
+        'QuarkDisk.ls_dir': lambda parallel: quark_disk.ls_dir('0', parallel=parallel),
+        'ParseQuarkShareLInk.ls_dir': lambda parallel: share.ls_dir('0', parallel=parallel),
+    }
+    print(f'latency={LATENCY * 1000:.0f}ms')
+    print(f'{"client":<28}{"entries":>8}{"mode":>10}{"requests":>10}{"seconds":>10}')
+    try:
+        for size in DIR_SIZES:
+            server.entries = fixture['list'][:size]
+            server.total = size
+            for name, ls_dir in clients.items():
+                for parallel in (False, True):
+                    elapsed, request_count, count = await _measure(server, ls_dir, parallel)
+                    assert count == size, f'{name} 返回 {count} 条，期望 {size} 条'
+                    mode = 'parallel' if parallel else 'serial'
+                    print(f'{name:<28}{size:>8}{mode:>10}{request_count:>10}{elapsed:>10.3f}')
+    finally:
+        await QuarkTransport.close()
+        await server.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,291 @@
+import asyncio
+import base64
+import gzip
+import json
+import os
+import sys
+import time
+from collections import Counter
+from typing import Optional
+from urllib.parse import parse_qsl, urlsplit
+
+import aiohttp
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+import utils
+
+# 每次请求都会变化的参数（时间戳、随机延迟），不参与匹配
+VOLATILE_PARAMS = {'__t', '__dt'}
+
+
+class CassetteMiss(LookupError):
+    """回放模式下找不到匹配的录制请求"""
+
+
+class Cassette:
+    """
+    请求/响应录像带，以 gzip 压缩的 JSON 保存
+    请求以 (scope, 方法, 地址, 排序后的查询参数, 请求体) 为键，同一个键的多次请求按顺序保存为序列，
+    回放时依次返回，序列用完后重复最后一个（如任务轮询）
+    """
+    VERSION = 1
+
+    def __init__(self, path: str, mode: str = 'replay', latency: Optional[float] = None, latency_scale: float = 1.0):
+        """
+        :param path: 录像带文件路径
+        :param mode: record 录制 / replay 回放
+        :param latency: 回放时每个请求注入的固定延迟（秒），为 None 时使用录制时的耗时
+        :param latency_scale: 注入延迟的倍率
+        """
+        if mode not in ('record', 'replay'):
+            raise ValueError(f'未知的模式：{mode}')
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.latency_scale = latency_scale
+        self.interactions: dict[str, list[dict]] = {}
+        self._cursor: Counter = Counter()
+        self.dirty = False
+        if mode == 'replay':
+            self.load()
+
+    @staticmethod
+    def make_key(scope: str, method: str, url, params=None, json_body=None, data=None) -> str:
+        parts = urlsplit(str(url))
+        query = [(key, str(value)) for key, value in parse_qsl(parts.query, keep_blank_values=True)]
+        if params:
+            items = params.items() if hasattr(params, 'items') else params
+            query += [(str(key), str(value)) for key, value in items]
+        query = sorted((key, value) for key, value in query if key not in VOLATILE_PARAMS)
+        body = ''
+        if json_body is not None:
+            body = json.dumps(json_body, sort_keys=True, ensure_ascii=False, default=str)
+        elif data is not None:
+            body = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str) if isinstance(data, dict) else str(data)
+        query_str = '&'.join(f'{key}={value}' for key, value in query)
+        return f'{scope} {method.upper()} {parts.scheme}://{parts.netloc}{parts.path}?{query_str} {body}'
+
+    def load(self):
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            content = json.load(f)
+        self.interactions = {}
+        for interaction in content['interactions']:
+            self.interactions.setdefault(interaction['key'], []).append(interaction)
+        self._cursor.clear()
+
+    def save(self):
+        if self.mode != 'record' or not self.dirty:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        content = {
+            'version': self.VERSION,
+            'interactions': [interaction for sequence in self.interactions.values() for interaction in sequence],
+        }
+        tmp_path = f'{self.path}.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(content, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+    def record(self, key: str, method: str, url: str, status: int, headers, body: bytes, elapsed: float):
+        try:
+            encoded = {'text': body.decode('utf-8')}
+        except UnicodeDecodeError:
+            encoded = {'base64': base64.b64encode(body).decode('ascii')}
+        self.interactions.setdefault(key, []).append({
+            'key': key,
+            'method': method.upper(),
+            'url': str(url),
+            'status': status,
+            'headers': [[name, value] for name, value in headers.items()],
+            'elapsed': round(elapsed, 4),
+            **encoded,
+        })
+        self.dirty = True
+
+    def next(self, key: str) -> dict:
+        sequence = self.interactions.get(key)
+        if not sequence:
+            raise CassetteMiss(f'录像带中没有请求：{key}')
+        index = min(self._cursor[key], len(sequence) - 1)
+        self._cursor[key] += 1
+        return sequence[index]
+
+    def delay_for(self, interaction: dict) -> float:
+        latency = interaction.get('elapsed', 0) if self.latency is None else self.latency
+        return latency * self.latency_scale
+
+
+class _CassetteStream:
+    """StreamReader 的最小替代，支持 read 与 iter_chunked"""
+    def __init__(self, body: bytes):
+        self._body = body
+        self._offset = 0
+
+    async def read(self, n: int = -1) -> bytes:
+        end = len(self._body) if n < 0 else self._offset + n
+        data = self._body[self._offset:end]
+        self._offset += len(data)
+        return data
+
+    async def iter_chunked(self, n: int):
+        while self._offset < len(self._body):
+            yield await self.read(n)
+
+
+class CassetteResponse:
+    """与 aiohttp.ClientResponse 接口兼容的响应，body 已完整读入内存"""
+    def __init__(self, method: str, url, status: int, headers, body: bytes):
+        self.method = method
+        self.url = URL(str(url))
+        self.status = status
+        self.headers = CIMultiDictProxy(CIMultiDict(headers))
+        self._body = body
+        self.content = _CassetteStream(body)
+        self.closed = False
+
+    @classmethod
+    def from_interaction(cls, interaction: dict) -> 'CassetteResponse':
+        if 'base64' in interaction:
+            body = base64.b64decode(interaction['base64'])
+        else:
+            body = interaction.get('text', '').encode('utf-8')
+        return cls(interaction['method'], interaction['url'], interaction['status'], interaction['headers'], body)
+
+    @property
+    def ok(self) -> bool:
+        return self.status < 400
+
+    @property
+    def content_length(self) -> Optional[int]:
+        return len(self._body)
+
+    @property
+    def content_type(self) -> str:
+        return self.headers.get('Content-Type', 'application/octet-stream').split(';')[0].strip()
+
+    async def read(self) -> bytes:
+        return self._body
+
+    async def text(self, encoding: str = None, errors: str = 'strict') -> str:
+        return self._body.decode(encoding or 'utf-8', errors)
+
+    async def json(self, *, encoding: str = None, loads=json.loads, content_type: Optional[str] = 'application/json'):
+        if content_type is not None and content_type not in self.content_type:
+            raise aiohttp.ContentTypeError(None, (), status=self.status,
+                                           message=f'Attempt to decode JSON with unexpected mimetype: {self.content_type}')
+        return loads(await self.text(encoding))
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise aiohttp.ClientResponseError(None, (), status=self.status, message=f'HTTP {self.status}')
+
+    def release(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class _CassetteRequest:
+    """同时支持 `await session.request(...)` 与 `async with session.request(...)` 两种写法"""
+    def __init__(self, coro):
+        self._coro = coro
+        self._resp = None
+
+    def __await__(self):
+        return self._coro.__await__()
+
+    async def __aenter__(self) -> CassetteResponse:
+        self._resp = await self._coro
+        return self._resp
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._resp.release()
+
+
+class CassetteSession:
+    """
+    可替换 aiohttp.ClientSession 的录制/回放 session
+    录制模式下通过 inner 发出真实请求并写入录像带，回放模式下不访问网络，按录制耗时（或固定延迟）返回结果
+    """
+    def __init__(self, cassette: Cassette, inner: aiohttp.ClientSession = None, scope: str = ''):
+        """
+        :param cassette: 录像带
+        :param inner: 录制模式下实际发送请求的 session
+        :param scope: 区分不同账号的同一请求，通常为账号名
+        """
+        if cassette.mode == 'record' and inner is None:
+            raise ValueError('录制模式需要提供 inner session')
+        self.cassette = cassette
+        self.inner = inner
+        self.scope = scope
+        self.cookie_jar = inner.cookie_jar if inner is not None else aiohttp.DummyCookieJar()
+        self.headers = inner.headers if inner is not None else CIMultiDict()
+        self.closed = False
+
+    async def _request(self, method: str, url, *, params=None, json=None, data=None, **kwargs) -> CassetteResponse:
+        key = Cassette.make_key(self.scope, method, url, params=params, json_body=json, data=data)
+        if self.cassette.mode == 'replay':
+            interaction = self.cassette.next(key)
+            delay = self.cassette.delay_for(interaction)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            return CassetteResponse.from_interaction(interaction)
+        start = time.monotonic()
+        async with await self.inner.request(method, url, params=params, json=json, data=data, **kwargs) as resp:
+            body = await resp.read()
+            elapsed = time.monotonic() - start
+            self.cassette.record(key, method, resp.url, resp.status, resp.headers, body, elapsed)
+            return CassetteResponse(method.upper(), resp.url, resp.status, resp.headers, body)
+
+    def request(self, method: str, url, **kwargs) -> _CassetteRequest:
+        return _CassetteRequest(self._request(method, url, **kwargs))
+
+    def get(self, url, **kwargs) -> _CassetteRequest:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs) -> _CassetteRequest:
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs) -> _CassetteRequest:
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs) -> _CassetteRequest:
+        return self.request('DELETE', url, **kwargs)
+
+    async def close(self):
+        """录制模式下保存录像带，inner session 由其创建者负责关闭"""
+        self.closed = True
+        self.cassette.save()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+def main():
+    """查看录像带概况：python cassette.py <cassette.json.gz>"""
+    cassette = Cassette(sys.argv[1])
+    endpoints = Counter()
+    elapsed = 0.0
+    for sequence in cassette.interactions.values():
+        for interaction in sequence:
+            endpoints[f"{interaction['method']} {urlsplit(interaction['url']).path}"] += 1
+            elapsed += interaction.get('elapsed', 0)
+    utils.logger.info(f'共 {sum(endpoints.values())} 个请求，{len(cassette.interactions)} 个不同的键，录制耗时合计 {elapsed:.2f}s')
+    for endpoint, count in endpoints.most_common():
+        print(f'{count:>6}  {endpoint}')
+
+
+if __name__ == '__main__':
+    main()
@@ -15,7 +15,7 @@ from sqlmodel import Session, select
 
 import settings
 from CrawlerResource.crawler_douban import CrawlerDouban
-from QuarkDisk import QuarkDisk, ParseQuarkShareLInk
+from QuarkDisk import QuarkDisk, ParseQuarkShareLInk, QuarkTransport
 from database import engine
 from models.resource import Resource, ResourceCategory
 import logging
@@ -43,6 +43,7 @@ async def _del():
     await default_quark_disk.close()
     if share_context is not None:
         await share_context.close()
+    await QuarkTransport.close()
 async def _crawler_resource(tv_type:ResourceCategory):
     base_path=settings.STORAGE_BASE_PATH
     resources=[]
@@ -359,11 +360,10 @@ async def init_storage():
                         global default_quark_disk
                         to_pdir_path=r.storage_path
                         try:
-                           await  default_quark_disk.mkdir(to_pdir_path)
-                           logger.info(f"创建{to_pdir_path}成功")
+                           to_pdir_fid=await  default_quark_disk.ensure_dir(to_pdir_path)
                         except Exception as e:
                             logger.error(e)
-                        to_pdir_fid=(await default_quark_disk.get_fids([to_pdir_path]))[0]['fid']
+                            break
                         try:
                             if await  default_quark_disk.save_file(fid_list=fid_list,fid_token_list=share_fid_token_list,to_pdir_fid=to_pdir_fid,stoken=stoken,pwd_id=pwd_id):
                                 logger.info(f'✅转存到{to_pdir_path}成功')
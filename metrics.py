@@ -0,0 +1,227 @@
+import asyncio
+import bisect
+import json
+import os
+import re
+import tempfile
+import time
+from typing import Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+
+import settings
+import utils
+
+
+SNAPSHOT_PATH = os.path.join(settings.LOCAL_CACHE_DIR, 'metrics.json')
+SNAPSHOT_INTERVAL = 60
+# 请求耗时直方图的桶上界（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# 路径中较长的数字、十六进制串（如夸克 fid）替换为占位符，避免标签基数膨胀
+_ID_SEGMENT = re.compile(r'^(\d{3,}|[0-9a-fA-F]{16,}|[0-9a-fA-F-]{32,})$')
+
+
+def normalize_endpoint(url) -> str:
+    """将 url 归一化为 host + 路径模板，作为 endpoint 标签"""
+    parts = urlsplit(str(url))
+    segments = [':id' if _ID_SEGMENT.match(segment) else segment for segment in parts.path.split('/')]
+    return parts.netloc + ('/'.join(segments).rstrip('/') or '/')
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个桶为 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        result, total = [], 0
+        for bound, count in zip([*self.buckets, '+Inf'], self.counts):
+            total += count
+            result.append((str(bound), total))
+        return result
+
+
+class MetricsRegistry:
+    """
+    进程级指标注册表，所有出站 HTTP 请求共用
+    指标以 (名称, 标签) 为键，标签固定为 client/account/endpoint，错误指标额外带 code
+    可导出为 Prometheus 文本格式，或定期写入 JSON 快照文件
+    """
+    COUNTERS = {
+        'http_requests_total': '请求数（按 HTTP 状态码）',
+        'http_request_errors_total': '请求异常或接口错误码',
+        'http_request_bytes_total': '请求体字节数',
+        'http_response_bytes_total': '响应体字节数',
+    }
+    HISTOGRAMS = {
+        'http_request_duration_seconds': '从发出请求到收到响应头的耗时',
+        'quark_task_duration_seconds': '夸克后台任务从提交到完成的耗时',
+    }
+
+    def __init__(self):
+        self.counters: dict[tuple[str, tuple], float] = {}
+        self.histograms: dict[tuple[str, tuple], Histogram] = {}
+        self.started_at = time.time()
+        self._snapshot_task: Optional[asyncio.Task] = None
+        self._snapshot_path = SNAPSHOT_PATH
+
+    @staticmethod
+    def _labels(**labels) -> tuple:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, self._labels(**labels))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, self._labels(**labels))
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        self.histograms[key].observe(value)
+
+    def record_request(self, client: str, account: str, endpoint: str, status, seconds: float):
+        self.inc('http_requests_total', client=client, account=account, endpoint=endpoint, status=status)
+        self.observe('http_request_duration_seconds', seconds, client=client, account=account, endpoint=endpoint)
+
+    def record_error(self, client: str, account: str, endpoint: str, code):
+        """code 为接口错误码，或网络异常的类型名"""
+        self.inc('http_request_errors_total', client=client, account=account, endpoint=endpoint, code=code)
+
+    def clear(self):
+        self.counters.clear()
+        self.histograms.clear()
+        self.started_at = time.time()
+
+    @staticmethod
+    def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+        items = [*labels, *extra]
+        if not items:
+            return ''
+        escaped = [(key, value.replace('\\', '\\\\').replace('"', '\\"')) for key, value in items]
+        return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+    def render_prometheus(self) -> str:
+        """导出为 Prometheus 文本格式"""
+        lines = []
+        for name, help_text in self.COUNTERS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            for (key_name, labels), value in sorted(self.counters.items()):
+                if key_name == name:
+                    lines.append(f'{name}{self._format_labels(labels)} {value:g}')
+        for name, help_text in self.HISTOGRAMS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+            for (key_name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                if key_name != name:
+                    continue
+                for bound, count in histogram.cumulative():
+                    lines.append(f'{name}_bucket{self._format_labels(labels, (("le", bound),))} {count}')
+                lines.append(f'{name}_sum{self._format_labels(labels)} {histogram.sum:g}')
+                lines.append(f'{name}_count{self._format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> dict:
+        """当前指标的 JSON 友好视图，直方图附带平均值"""
+        return {
+            'started_at': self.started_at,
+            'generated_at': time.time(),
+            'counters': [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self.counters.items())
+            ],
+            'histograms': [
+                {'name': name, 'labels': dict(labels), 'count': histogram.count, 'sum': histogram.sum,
+                 'avg': histogram.sum / histogram.count if histogram.count else 0.0,
+                 'buckets': dict(histogram.cumulative())}
+                for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0])
+            ],
+        }
+
+    def write_snapshot(self, path: str = SNAPSHOT_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def start_snapshot_writer(self, path: str = SNAPSHOT_PATH, interval: float = SNAPSHOT_INTERVAL):
+        """后台定期写入快照文件，stop_snapshot_writer 时再写入最后一次"""
+        async def _run():
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    self.write_snapshot(path)
+                except OSError as e:
+                    utils.logger.error(f'写入指标快照失败：{e}')
+
+        if self._snapshot_task is None or self._snapshot_task.done():
+            self._snapshot_path = path
+            self._snapshot_task = asyncio.create_task(_run())
+
+    async def stop_snapshot_writer(self):
+        if self._snapshot_task is None:
+            return
+        self._snapshot_task.cancel()
+        await asyncio.gather(self._snapshot_task, return_exceptions=True)
+        self._snapshot_task = None
+        self.write_snapshot(self._snapshot_path)
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 9108):
+        """启动 Prometheus 文本格式的 /metrics 接口，返回 AppRunner，由调用方 cleanup"""
+        from aiohttp import web
+
+        async def _metrics(request):
+            return web.Response(text=self.render_prometheus(), content_type='text/plain', charset='utf-8')
+
+        app = web.Application()
+        app.router.add_get('/metrics', _metrics)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+registry = MetricsRegistry()
+
+
+def trace_config(client: str, account: str = '') -> aiohttp.TraceConfig:
+    """
+    生成记录请求数、耗时、收发字节数与网络异常的 TraceConfig，
+    创建 ClientSession 时通过 trace_configs=[trace_config(...)] 挂载
+    :param client: 客户端名，如 quark、alist、aria2、douban
+    :param account: 账号名，无账号区分的客户端留空
+    """
+    async def on_request_start(session, ctx, params):
+        ctx.start = time.monotonic()
+        ctx.endpoint = normalize_endpoint(params.url)
+
+    async def on_request_chunk_sent(session, ctx, params):
+        registry.inc('http_request_bytes_total', len(params.chunk),
+                     client=client, account=account, endpoint=ctx.endpoint)
+
+    async def on_response_chunk_received(session, ctx, params):
+        registry.inc('http_response_bytes_total', len(params.chunk),
+                     client=client, account=account, endpoint=ctx.endpoint)
+
+    async def on_request_end(session, ctx, params):
+        registry.record_request(client, account, ctx.endpoint, params.response.status,
+                                time.monotonic() - ctx.start)
+
+    async def on_request_exception(session, ctx, params):
+        registry.record_error(client, account, ctx.endpoint, type(params.exception).__name__)
+
+    config = aiohttp.TraceConfig()
+    config.on_request_start.append(on_request_start)
+    config.on_request_chunk_sent.append(on_request_chunk_sent)
+    config.on_response_chunk_received.append(on_response_chunk_received)
+    config.on_request_end.append(on_request_end)
+    config.on_request_exception.append(on_request_exception)
+    return config
@@ -1,6 +1,10 @@
+import os
 
 select_resource_num=20
 
+# 本地缓存目录（网盘元数据镜像等）
+LOCAL_CACHE_DIR=os.path.join(os.path.dirname(os.path.abspath(__file__)),'cache')
+
 # 网盘客户端配置
 STORAGE_BASE_PATH='/资源分享'
 STORAGE_CONFIG = {
@@ -33,6 +37,9 @@ STORAGE_CONFIG = {
     ]
 
 }
+# 参与账号池（QuarkDiskPool.from_settings）的夸克账号名，第一个为主账号
+# 默认只使用第一个账号；加入其他账号后，创建分享时会在这些账号上转存并各自创建分享
+QUARK_POOL_ACCOUNTS=[STORAGE_CONFIG['quark'][0]['name']]
 alist={
     'key':'alist-648b3796-2c2c-47bb-a83b-9dd09c1e9db6u6GSp5FkDhcxe8v5dxUjmipQ80skg14nS8gD2kgpl0p9hwUsqWg2eIBVZuppkptM'
 ,'url':'http://192.168.31.201:5244'
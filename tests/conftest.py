@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 与 benchmarks 一致：仓库根目录与 CloudDisk 都在导入路径上（Services 中以 from QuarkDisk import ... 导入）
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'CloudDisk'), os.path.dirname(os.path.abspath(__file__))]
+
+from QuarkDisk import CircuitBreaker, ParseQuarkShareLInk, QuarkDisk, RateLimiter, StokenStore, TaskPoller
+from Services.quark_share_dir_tree import QuarkShareDirTree, ShareTreeCache, ShareTreeSnapshotStore
+
+
+@pytest.fixture(autouse=True)
+def isolated_state(tmp_path, monkeypatch):
+    """各用例使用独立的熔断器、stoken 缓存、目录树缓存与快照，放宽限速并缩短任务轮询间隔（模拟器没有真实接口的速率要求）"""
+    monkeypatch.setattr(CircuitBreaker, '_breakers', {})
+    monkeypatch.setattr(QuarkDisk, '_ensure_dir_inflight', {})
+    monkeypatch.setattr(ParseQuarkShareLInk, 'stoken_store', StokenStore(str(tmp_path / 'stokens.json')))
+    monkeypatch.setattr(QuarkShareDirTree, 'cache', ShareTreeCache())
+    monkeypatch.setattr(QuarkShareDirTree, 'snapshot_store', ShareTreeSnapshotStore(str(tmp_path / 'share_trees.db')))
+    monkeypatch.setattr(TaskPoller, 'INITIAL_INTERVAL', 0.02)
+    monkeypatch.setattr(TaskPoller, 'MAX_INTERVAL', 0.1)
+    monkeypatch.setattr(RateLimiter, 'LIMITS', {name: (50, 50) for name in RateLimiter.LIMITS})
@@ -0,0 +1,24 @@
+from contextlib import asynccontextmanager
+
+from QuarkDisk import ParseQuarkShareLInk, QuarkDisk, QuarkTransport
+from QuarkEmulator import QuarkEmulator
+
+
+@asynccontextmanager
+async def emulated_disks(emulator: QuarkEmulator, *accounts: str):
+    """
+    启动模拟器并为每个账号创建指向它的 QuarkDisk，分享解析同样指向模拟器
+    退出时关闭账号、共用的 session 与模拟器
+    """
+    url = await emulator.start()
+    base_url = ParseQuarkShareLInk.BASE_URL
+    ParseQuarkShareLInk.BASE_URL = url
+    disks = [QuarkDisk({'name': account, 'cookie': f'__uid={account}', 'base_url': url}) for account in accounts]
+    try:
+        yield disks
+    finally:
+        for disk in disks:
+            await disk.close()
+        await QuarkTransport.close()
+        ParseQuarkShareLInk.BASE_URL = base_url
+        await emulator.stop()
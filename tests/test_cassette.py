@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from cassette import Cassette, CassetteMiss, CassetteSession
+from QuarkDisk import QuarkDisk, QuarkTransport
+from QuarkEmulator import QuarkEmulator
+from quark_env import emulated_disks
+
+
+def test_key_ignores_volatile_params_and_sequences_repeat_the_last(tmp_path):
+    key = Cassette.make_key('A', 'get', 'https://x/task?task_id=1', params={'__t': 1, 'pr': 'ucpro'})
+    assert key == Cassette.make_key('A', 'GET', 'https://x/task?pr=ucpro', params={'task_id': '1', '__t': 2})
+    assert key != Cassette.make_key('B', 'GET', 'https://x/task?pr=ucpro&task_id=1')
+
+    path = str(tmp_path / 'tape.json.gz')
+    cassette = Cassette(path, mode='record')
+    for status in (0, 2):
+        cassette.record(key, 'GET', 'https://x/task', 200, {}, f'{{"status": {status}}}'.encode(), 0.1)
+    cassette.save()
+
+    replay = Cassette(path)
+    assert [replay.next(key)['text'] for _ in range(3)] == ['{"status": 0}', '{"status": 2}', '{"status": 2}']
+    with pytest.raises(CassetteMiss):
+        replay.next('missing')
+
+
+def test_record_then_replay_without_network(tmp_path):
+    path = str(tmp_path / 'quark.json.gz')
+
+    async def run(disk: QuarkDisk):
+        fids = await disk.get_fids(['/lib', '/lib/目录0001'])
+        listing = await disk.ls_dir(fids[1]['fid'])
+        return [entry['fid'] for entry in fids], sorted(entry['file_name'] for entry in listing)
+
+    async def scenario():
+        emulator = QuarkEmulator()
+        emulator.populate('/lib', 2, 3, account='A')
+        QuarkTransport.use_cassette(Cassette(path, mode='record'))
+        try:
+            async with emulated_disks(emulator, 'A') as (disk,):
+                recorded = await run(disk)
+                base_url = emulator.base_url
+            requests = sum(emulator.request_counts.values())
+
+            # 模拟器已停止，回放只读录像带
+            QuarkTransport.use_cassette(Cassette(path, latency=0))
+            disk = QuarkDisk({'name': 'A', 'cookie': '__uid=A', 'base_url': base_url})
+            try:
+                assert isinstance(disk.session, CassetteSession)
+                assert await run(disk) == recorded
+            finally:
+                await disk.close()
+                await QuarkTransport.close()
+            assert sum(emulator.request_counts.values()) == requests
+            assert recorded[1] == ['S01E01.mp4', 'S01E02.mp4', 'S01E03.mp4']
+        finally:
+            QuarkTransport.use_cassette(None)
+
+    asyncio.run(scenario())
@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+import settings
+from QuarkDisk import CircuitBreaker, CircuitOpenError, QuarkTransport
+from QuarkDiskPool import QuarkDiskPool
+from QuarkEmulator import QuarkEmulator
+from quark_env import emulated_disks
+
+
+def _open(quark_disk):
+    for _ in range(CircuitBreaker.FAILURE_THRESHOLD):
+        quark_disk.circuit_breaker.record(False)
+
+
+def test_from_settings_uses_the_configured_accounts(monkeypatch):
+    configs = [{'name': name, 'cookie': ''} for name in ('a', 'b', 'c')]
+    monkeypatch.setattr(settings, 'STORAGE_CONFIG', {**settings.STORAGE_CONFIG, 'quark': configs})
+    monkeypatch.setattr(settings, 'QUARK_POOL_ACCOUNTS', ['a'])
+
+    async def scenario():
+        try:
+            assert [quark_disk.name for quark_disk in QuarkDiskPool.from_settings().quark_disks] == ['a']
+            pool = QuarkDiskPool.from_settings(names=['c', 'a'])
+            assert pool.primary.name == 'c'
+            with pytest.raises(ValueError):
+                QuarkDiskPool.from_settings(names=['a', 'missing'])
+        finally:
+            await QuarkTransport.close()
+
+    asyncio.run(scenario())
+
+
+def test_sticky_defaults_to_primary_and_honours_pins():
+    async def scenario():
+        emulator = QuarkEmulator()
+        async with emulated_disks(emulator, 'A', 'B') as disks:
+            pool = QuarkDiskPool(disks, policy='sticky')
+            assert (await pool.pick('/剧1')).name == 'A'
+            pool.pin('/剧2', 'B')
+            assert (await pool.pick('/剧2')).name == 'B'
+            # 熔断时不切换账号，数据只在绑定的账号中
+            _open(disks[1])
+            assert (await pool.pick('/剧2')).name == 'B'
+            with pytest.raises(KeyError):
+                pool.pin('/剧3', 'C')
+
+    asyncio.run(scenario())
+
+
+def test_least_loaded_skips_busy_and_open_accounts():
+    async def scenario():
+        emulator = QuarkEmulator()
+        async with emulated_disks(emulator, 'A', 'B', 'C') as disks:
+            pool = QuarkDiskPool(disks)
+            async with pool.use('A'):
+                assert (await pool.pick()).name == 'B'
+            _open(disks[1])
+            assert (await pool.pick(exclude=('A',))).name == 'C'
+            _open(disks[0])
+            _open(disks[2])
+            with pytest.raises(CircuitOpenError):
+                await pool.pick()
+
+    asyncio.run(scenario())
+
+
+def test_run_switches_account_when_one_is_open():
+    async def scenario():
+        emulator = QuarkEmulator()
+        async with emulated_disks(emulator, 'A', 'B') as disks:
+            pool = QuarkDiskPool(disks)
+            calls = []
+
+            async def operation(quark_disk):
+                calls.append(quark_disk.name)
+                if quark_disk.name == 'A':
+                    raise CircuitOpenError('A', 30)
+                return quark_disk.name
+
+            assert await pool.run(operation) == 'B'
+            assert calls == ['A', 'B']
+            stats = pool.stats()
+            # 熔断的账号记为失败，之后 least_loaded 优先选择正常的账号
+            assert (stats['A']['errors'], stats['A']['consecutive_errors'], stats['A']['completed']) == (1, 1, 0)
+            assert (stats['B']['errors'], stats['B']['completed']) == (0, 1)
+            assert stats['A']['in_flight'] == stats['B']['in_flight'] == 0
+            assert (await pool.pick()).name == 'B'
+
+    asyncio.run(scenario())
+
+
+def test_quota_picks_the_account_with_most_free_space():
+    async def scenario():
+        emulator = QuarkEmulator(total_capacity=10 * 1024 ** 3)
+        emulator.populate('/data', 1, 5, account='A', file_size=1024 ** 3)
+        emulator.populate('/data', 1, 2, account='B', file_size=1024 ** 3)
+        async with emulated_disks(emulator, 'A', 'B') as disks:
+            pool = QuarkDiskPool(disks, policy='quota')
+            assert (await pool.pick()).name == 'B'
+            assert pool.stats()['B']['free'] == 8 * 1024 ** 3
+
+    asyncio.run(scenario())
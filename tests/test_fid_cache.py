@@ -0,0 +1,128 @@
+import asyncio
+
+from QuarkDisk import FidCache
+from QuarkEmulator import QuarkEmulator
+from quark_env import emulated_disks
+
+
+def _entry(fid: str, path: str) -> dict:
+    return {'fid': fid, 'file_path': path}
+
+
+def test_get_normalizes_path():
+    cache = FidCache()
+    cache.put('/a/b/', _entry('1', '/a/b'))
+    assert cache.get('a/b')['fid'] == '1'
+    assert cache.stats()['hits'] == 1
+
+
+def test_invalidate_removes_descendants_only():
+    cache = FidCache()
+    for fid, path in [('1', '/a'), ('2', '/a/b'), ('3', '/a/b/c'), ('4', '/a/bc'), ('5', '/x')]:
+        cache.put(path, _entry(fid, path))
+    cache.invalidate('/a/b')
+    assert cache.get('/a/b') is None
+    assert cache.get('/a/b/c') is None
+    # 同名前缀的兄弟目录与父目录不受影响
+    assert cache.get('/a/bc')['fid'] == '4'
+    assert cache.get('/a')['fid'] == '1'
+    assert cache.get('/x')['fid'] == '5'
+
+
+def test_invalidate_without_cached_ancestor():
+    cache = FidCache()
+    cache.put('/a/b/c', _entry('3', '/a/b/c'))
+    cache.invalidate('/a')
+    assert cache.get('/a/b/c') is None
+
+
+def test_invalidate_root_keeps_root_entry():
+    cache = FidCache()
+    cache.put('/', _entry('0', '/'))
+    cache.put('/a', _entry('1', '/a'))
+    cache.invalidate('/')
+    assert cache.get('/a') is None
+    assert cache.get('/')['fid'] == '0'
+
+
+def test_invalidate_fid_uses_cached_path():
+    cache = FidCache()
+    cache.put('/a', _entry('1', '/a'))
+    cache.put('/a/b', _entry('2', '/a/b'))
+    cache.put('/x', _entry('5', '/x'))
+    cache.invalidate_fid('1')
+    assert cache.get('/a/b') is None
+    assert cache.get('/x')['fid'] == '5'
+
+
+def test_invalidate_uncached_fid_keeps_entries():
+    cache = FidCache()
+    cache.put('/', _entry('0', '/'))
+    cache.put('/a', _entry('1', '/a'))
+    # 文件的 fid 不会作为路径缓存，改名/删除文件不影响目录缓存
+    cache.invalidate_fid('file-fid')
+    assert cache.get('/a')['fid'] == '1'
+    assert cache.get('/')['fid'] == '0'
+
+
+def test_expired_and_evicted_entries():
+    cache = FidCache(max_size=2, ttl=-1)
+    cache.put('/a', _entry('1', '/a'))
+    assert cache.get('/a') is None
+
+    cache = FidCache(max_size=2)
+    cache.put('/a', _entry('1', '/a'))
+    cache.put('/b', _entry('2', '/b'))
+    cache.get('/a')
+    cache.put('/c', _entry('3', '/c'))
+    # /b 最久未使用，被淘汰
+    assert cache.get('/b') is None
+    assert cache.get('/a')['fid'] == '1'
+
+
+def test_invalidate_fid_after_ancestor_evicted():
+    cache = FidCache(max_size=3)
+    cache.put('/a', _entry('1', '/a'))
+    cache.put('/a/b', _entry('2', '/a/b'))
+    cache.put('/a/b/c', _entry('3', '/a/b/c'))
+    cache.put('/x', _entry('5', '/x'))
+    # /a 已被淘汰，按它的 fid 失效时仍能找到写入时记录的子路径
+    assert cache.stats()['size'] == 3
+    cache.invalidate_fid('1')
+    assert cache.get('/a/b') is None
+    assert cache.get('/a/b/c') is None
+    assert cache.get('/x')['fid'] == '5'
+
+
+def test_ensure_dir_is_memoized_and_invalidated_by_rename():
+    async def scenario():
+        emulator = QuarkEmulator(task_duration=0.01)
+        async with emulated_disks(emulator, 'A') as (disk,):
+            fid = await disk.ensure_dir('/a/b')
+            assert await disk.ensure_dir('/a/b/') == fid
+            assert emulator.request_counts['/1/clouddrive/file'] == 1
+            parent = (await disk.get_fids(['/a']))[0]['fid']
+            await disk.rename(parent, 'renamed')
+            # 父目录改名后旧路径不再命中缓存，重新查询发现不存在并创建新目录
+            assert await disk.ensure_dir('/a/b') != fid
+            assert emulator.request_counts['/1/clouddrive/file'] == 2
+
+    asyncio.run(scenario())
+
+
+def test_renaming_files_keeps_directory_cache():
+    async def scenario():
+        emulator = QuarkEmulator(task_duration=0.01)
+        async with emulated_disks(emulator, 'A') as (disk,):
+            dir_fid = await disk.ensure_dir('/show/S01')
+            drive = emulator.drive('A')
+            file_fids = [drive.add(dir_fid, f'{i}.mp4', 1)['fid'] for i in range(3)]
+            results = await disk.rename_many({fid: f'E{i}.mp4' for i, fid in enumerate(file_fids)})
+            assert all(result['code'] == 0 for result in results.values())
+            await disk.delete([file_fids[0]])
+            assert disk.fid_cache.get('/show/S01')['fid'] == dir_fid
+            path_list_requests = emulator.request_counts['/1/clouddrive/file/info/path_list']
+            assert await disk.ensure_dir('/show/S01') == dir_fid
+            assert emulator.request_counts['/1/clouddrive/file/info/path_list'] == path_list_requests
+
+    asyncio.run(scenario())
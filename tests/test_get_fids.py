@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+from QuarkDisk import GetFidsError
+from QuarkEmulator import CODE_NOT_FOUND, QuarkEmulator
+from quark_env import emulated_disks
+
+
+def test_get_fids_reports_failed_chunks_and_keeps_the_rest():
+    async def scenario():
+        emulator = QuarkEmulator()
+        paths = [f'/d/{i:03d}' for i in range(60)]
+        for path in paths:
+            emulator.drive('A').mkdir_p(path)
+        async with emulated_disks(emulator, 'A') as (disk,):
+            get_fids_chunk = disk._get_fids_chunk
+
+            async def flaky_chunk(chunk):
+                if '/d/055' in chunk:
+                    raise RuntimeError('path_list 失败')
+                return await get_fids_chunk(chunk)
+
+            disk._get_fids_chunk = flaky_chunk
+            with pytest.raises(GetFidsError) as exc_info:
+                await disk.get_fids(paths)
+            assert exc_info.value.failed_paths == paths[50:]
+            assert [entry['file_path'] for entry in exc_info.value.fids] == paths[:50]
+            # 成功分组的结果已写入缓存，再次请求只查询失败的分组
+            disk._get_fids_chunk = get_fids_chunk
+            assert len(await disk.get_fids(paths)) == 60
+            assert emulator.request_counts['/1/clouddrive/file/info/path_list'] == 2
+
+    asyncio.run(scenario())
+
+
+def test_get_fids_propagates_cancellation():
+    async def scenario():
+        emulator = QuarkEmulator()
+        async with emulated_disks(emulator, 'A') as (disk,):
+            async def cancelled_chunk(chunk):
+                raise asyncio.CancelledError()
+
+            disk._get_fids_chunk = cancelled_chunk
+            with pytest.raises(asyncio.CancelledError):
+                await disk.get_fids(['/a'])
+
+    asyncio.run(scenario())
+
+
+def test_ensure_dir_does_not_mkdir_when_lookup_fails():
+    async def scenario():
+        emulator = QuarkEmulator()
+        async with emulated_disks(emulator, 'A') as (disk,):
+            async def failed_chunk(chunk):
+                raise RuntimeError('path_list 超时')
+
+            disk._get_fids_chunk = failed_chunk
+            with pytest.raises(GetFidsError):
+                await disk.ensure_dir('/a')
+            assert emulator.request_counts['/1/clouddrive/file'] == 0
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_ensure_dir_creates_once():
+    async def scenario():
+        emulator = QuarkEmulator(latency=0.01)
+        async with emulated_disks(emulator, 'A') as (disk,):
+            fids = await asyncio.gather(*[disk.ensure_dir('/a/b') for _ in range(10)])
+            assert len(set(fids)) == 1
+            assert emulator.request_counts['/1/clouddrive/file'] == 1
+            assert emulator.drive('A').lookup('/a/b')['fid'] == fids[0]
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize('missing_path_code', [None, CODE_NOT_FOUND])
+def test_missing_paths_are_created_whichever_way_they_are_reported(missing_path_code):
+    async def scenario():
+        emulator = QuarkEmulator(missing_path_code=missing_path_code)
+        emulator.drive('A').mkdir_p('/a')
+        async with emulated_disks(emulator, 'A') as (disk,):
+            fids = await disk.get_fids(['/a', '/missing'])
+            assert [entry['file_path'] for entry in fids] == ['/a']
+            fid = await disk.ensure_dir('/b/c')
+            assert emulator.drive('A').lookup('/b/c')['fid'] == fid
+            assert emulator.request_counts['/1/clouddrive/file'] == 1
+
+    asyncio.run(scenario())
+
+
+def test_other_error_codes_are_not_treated_as_missing():
+    async def scenario():
+        emulator = QuarkEmulator(missing_path_code=31001)
+        async with emulated_disks(emulator, 'A') as (disk,):
+            with pytest.raises(GetFidsError):
+                await disk.ensure_dir('/b')
+            assert emulator.request_counts['/1/clouddrive/file'] == 0
+
+    asyncio.run(scenario())
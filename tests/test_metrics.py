@@ -0,0 +1,70 @@
+import asyncio
+import json
+import socket
+
+import aiohttp
+import pytest
+
+import metrics
+from QuarkEmulator import QuarkEmulator
+
+
+@pytest.fixture
+def registry(monkeypatch) -> metrics.MetricsRegistry:
+    registry = metrics.MetricsRegistry()
+    monkeypatch.setattr(metrics, 'registry', registry)
+    return registry
+
+
+def _counter(registry: metrics.MetricsRegistry, name: str, **labels) -> float:
+    return registry.counters.get((name, registry._labels(**labels)), 0)
+
+
+def _unused_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.mark.parametrize('url, endpoint', [
+    ('https://drive-pc.quark.cn/1/clouddrive/file/sort?pdir_fid=0', 'drive-pc.quark.cn/1/clouddrive/file/sort'),
+    ('http://127.0.0.1:8080/download/A/0123456789abcdef0123456789abcdef', '127.0.0.1:8080/download/A/:id'),
+    ('https://movie.douban.com/subject/35267208/', 'movie.douban.com/subject/:id'),
+    ('https://example.com', 'example.com/'),
+])
+def test_normalize_endpoint_collapses_ids(url, endpoint):
+    assert metrics.normalize_endpoint(url) == endpoint
+
+
+def test_trace_config_records_one_request(registry):
+    async def scenario():
+        emulator = QuarkEmulator()
+        emulator.drive('A').mkdir_p('/a')
+        base_url = await emulator.start()
+        body = json.dumps({'file_path': ['/a']}).encode()
+        try:
+            async with aiohttp.ClientSession(trace_configs=[metrics.trace_config('quark', 'A')]) as session:
+                async with session.post(f'{base_url}/1/clouddrive/file/info/path_list', data=body,
+                                        headers={'Cookie': '__uid=A', 'Content-Type': 'application/json'}) as resp:
+                    response_body = await resp.read()
+                with pytest.raises(aiohttp.ClientConnectionError):
+                    await session.get(f'http://127.0.0.1:{_unused_port()}/1/clouddrive/file/sort')
+        finally:
+            await emulator.stop()
+        return base_url, body, response_body
+
+    base_url, body, response_body = asyncio.run(scenario())
+    endpoint = metrics.normalize_endpoint(f'{base_url}/1/clouddrive/file/info/path_list')
+    labels = {'client': 'quark', 'account': 'A', 'endpoint': endpoint}
+    assert _counter(registry, 'http_requests_total', status=200, **labels) == 1
+    assert _counter(registry, 'http_request_bytes_total', **labels) == len(body)
+    assert _counter(registry, 'http_response_bytes_total', **labels) == len(response_body)
+    errors = [entry for entry in registry.snapshot()['counters'] if entry['name'] == 'http_request_errors_total']
+    assert len(errors) == 1 and errors[0]['value'] == 1
+    assert errors[0]['labels']['code'].startswith('ClientConnector')
+
+    text = registry.render_prometheus()
+    label_text = f'account="A",client="quark",endpoint="{endpoint}"'
+    assert f'http_requests_total{{{label_text},status="200"}} 1' in text
+    assert f'http_request_duration_seconds_bucket{{{label_text},le="+Inf"}} 1' in text
+    assert f'http_request_duration_seconds_count{{{label_text}}} 1' in text
@@ -0,0 +1,184 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+from QuarkDisk import (CircuitBreaker, CircuitBreakerMiddleware, CircuitOpenError, MiddlewareChain, RateLimiter,
+                       RequestContext, RetryMiddleware)
+from QuarkEmulator import QuarkEmulator
+from quark_env import emulated_disks
+
+BASE = 'https://drive-pc.quark.cn/1/clouddrive'
+
+
+class FakeResponse:
+    def __init__(self, status: int = 200, body: dict = None):
+        self.status = status
+        self.body = body if body is not None else {'code': 0, 'message': 'ok'}
+        self.released = False
+
+    async def json(self, content_type=None):
+        return self.body
+
+    def release(self):
+        self.released = True
+
+
+class FakeSend:
+    """依次返回 responses 中的响应，元素为异常时抛出"""
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    async def __call__(self, ctx):
+        self.calls += 1
+        response = self.responses.pop(0)
+        if isinstance(response, BaseException):
+            raise response
+        return response
+
+
+@pytest.fixture
+def fast_retry(monkeypatch):
+    monkeypatch.setattr(RetryMiddleware, 'BASE_DELAY', 0.001)
+
+
+def _open(breaker: CircuitBreaker):
+    for _ in range(breaker.FAILURE_THRESHOLD):
+        breaker.record(False)
+
+
+def test_breaker_opens_after_threshold_and_rejects():
+    breaker = CircuitBreaker('breaker-open')
+    for _ in range(breaker.FAILURE_THRESHOLD - 1):
+        breaker.record(False)
+    breaker.before_request()
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.available
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker('breaker-reset')
+    for _ in range(breaker.FAILURE_THRESHOLD - 1):
+        breaker.record(False)
+    breaker.record(True)
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_allows_a_single_probe(monkeypatch):
+    monkeypatch.setattr(CircuitBreaker, 'COOLDOWN', 0)
+    breaker = CircuitBreaker('breaker-probe')
+    _open(breaker)
+    breaker.before_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+    # 探测被取消时归还名额
+    breaker.release_probe()
+    breaker.before_request()
+    breaker.record(True)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.available
+
+
+def test_failed_probe_reopens(monkeypatch):
+    breaker = CircuitBreaker('breaker-reopen')
+    _open(breaker)
+    monkeypatch.setattr(CircuitBreaker, 'COOLDOWN', 0)
+    breaker.before_request()
+    monkeypatch.setattr(CircuitBreaker, 'COOLDOWN', 60)
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+
+def test_breaker_middleware_ignores_risk_codes_and_cancellation():
+    async def scenario():
+        breaker = CircuitBreaker('breaker-risk')
+        risk = FakeResponse(body={'code': 41026, 'message': '分享失败，文件涉及违规内容'})
+        chain = MiddlewareChain(FakeSend(*[risk] * 10), [CircuitBreakerMiddleware(breaker)])
+        for _ in range(10):
+            await chain(RequestContext('POST', f'{BASE}/share'))
+        assert breaker.state == CircuitBreaker.CLOSED and breaker.failures == 0
+
+        chain = MiddlewareChain(FakeSend(*[FakeResponse(429, {'code': 32003, 'message': '请求过于频繁'})] * 5),
+                                [CircuitBreakerMiddleware(breaker)])
+        for _ in range(5):
+            await chain(RequestContext('GET', f'{BASE}/file/sort'))
+        assert breaker.state == CircuitBreaker.OPEN
+
+        probe = CircuitBreaker('breaker-cancel')
+        chain = MiddlewareChain(FakeSend(asyncio.CancelledError()), [CircuitBreakerMiddleware(probe)])
+        with pytest.raises(asyncio.CancelledError):
+            await chain(RequestContext('GET', f'{BASE}/file/sort'))
+        assert probe.failures == 0
+
+    asyncio.run(scenario())
+
+
+def test_retry_idempotent_requests(fast_retry):
+    async def scenario():
+        send = FakeSend(FakeResponse(503), aiohttp.ServerDisconnectedError(), FakeResponse(200))
+        resp = await MiddlewareChain(send, [RetryMiddleware()])(RequestContext('GET', f'{BASE}/file/sort'))
+        assert resp.status == 200
+        assert send.calls == 3
+
+        send = FakeSend(*[FakeResponse(503)] * 5)
+        resp = await MiddlewareChain(send, [RetryMiddleware(retries=2)])(RequestContext('GET', f'{BASE}/file/sort'))
+        assert resp.status == 503
+        assert send.calls == 3
+
+    asyncio.run(scenario())
+
+
+def test_writes_are_not_replayed(fast_retry):
+    async def scenario():
+        send = FakeSend(FakeResponse(503), FakeResponse(200))
+        resp = await MiddlewareChain(send, [RetryMiddleware()])(RequestContext('POST', f'{BASE}/file/rename'))
+        assert resp.status == 503
+        assert send.calls == 1
+
+        send = FakeSend(aiohttp.ServerDisconnectedError(), FakeResponse(200))
+        with pytest.raises(aiohttp.ServerDisconnectedError):
+            await MiddlewareChain(send, [RetryMiddleware()])(RequestContext('POST', f'{BASE}/file/rename'))
+        assert send.calls == 1
+
+        # 只读的 POST 接口可以重试
+        send = FakeSend(FakeResponse(503), FakeResponse(200))
+        resp = await MiddlewareChain(send, [RetryMiddleware()])(RequestContext('POST', f'{BASE}/file/info/path_list'))
+        assert resp.status == 200
+
+    asyncio.run(scenario())
+
+
+def test_open_circuit_is_not_retried(fast_retry):
+    async def scenario():
+        breaker = CircuitBreaker('breaker-no-retry')
+        _open(breaker)
+        send = FakeSend(FakeResponse(200))
+        chain = MiddlewareChain(send, [RetryMiddleware(), CircuitBreakerMiddleware(breaker)])
+        with pytest.raises(CircuitOpenError):
+            await chain(RequestContext('GET', f'{BASE}/file/sort'))
+        assert send.calls == 0
+
+    asyncio.run(scenario())
+
+
+def test_risk_codes_do_not_throttle_or_trip_the_account():
+    async def scenario():
+        emulator = QuarkEmulator(task_duration=0.01)
+        dir_fids = emulator.populate('/src', CircuitBreaker.FAILURE_THRESHOLD + 2, 1, account='A')
+        for fid in dir_fids:
+            emulator.inject_risk(fid, 41026)
+        async with emulated_disks(emulator, 'A') as (disk,):
+            results = await disk.create_share_links(dir_fids)
+            assert {result['code'] for result in results.values()} == {41026}
+            assert disk.circuit_breaker.state == CircuitBreaker.CLOSED
+            assert disk.rate_limiter.buckets['share'].rate == RateLimiter.LIMITS['share'][0]
+
+    asyncio.run(scenario())
@@ -0,0 +1,100 @@
+import asyncio
+
+from QuarkEmulator import QuarkEmulator
+from Services.quark_mirror import QuarkMirror
+from quark_env import emulated_disks
+
+SORT = '/1/clouddrive/file/sort'
+
+
+def _names(file_list: list[dict]) -> set:
+    return {file['file_name'] for file in file_list}
+
+
+def test_refresh_skips_unchanged_file_only_dirs(tmp_path):
+    async def scenario():
+        emulator = QuarkEmulator()
+        dir_fids = emulator.populate('/root', 3, 2, account='A')
+        async with emulated_disks(emulator, 'A') as (disk,):
+            mirror = QuarkMirror(disk, str(tmp_path / 'mirror.db'))
+            stats = await mirror.refresh('/root')
+            assert (stats['listed'], stats['skipped']) == (4, 0)
+
+            # 只有 updated_at 变化的目录会重新列出
+            await asyncio.sleep(0.01)
+            emulator.drive('A').add(dir_fids[0], 'S01E99.mp4', 1)
+            stats = await mirror.refresh('/root')
+            assert (stats['listed'], stats['skipped']) == (2, 2)
+
+            requests = emulator.request_counts[SORT]
+            assert 'S01E99.mp4' in _names(await mirror.ls_dir(dir_fids[0]))
+            assert emulator.request_counts[SORT] == requests
+            mirror.close()
+
+    asyncio.run(scenario())
+
+
+def test_write_events_keep_mirror_consistent(tmp_path):
+    async def scenario():
+        emulator = QuarkEmulator(task_duration=0.01)
+        dir_fids = emulator.populate('/root', 2, 2, account='A')
+        async with emulated_disks(emulator, 'A') as (disk,):
+            mirror = QuarkMirror(disk, str(tmp_path / 'mirror.db'))
+            await mirror.refresh('/root')
+            root_fid = (await disk.get_fids(['/root']))[0]['fid']
+            files = await mirror.ls_dir(dir_fids[0])
+            requests = emulator.request_counts[SORT]
+
+            # 改名直接更新镜像，不需要重新列出
+            await disk.rename(files[0]['fid'], 'renamed.mp4')
+            assert 'renamed.mp4' in _names(await mirror.ls_dir(dir_fids[0]))
+            assert emulator.request_counts[SORT] == requests
+
+            # 删除目录时连同镜像中的子树一起删除
+            await disk.delete([dir_fids[1]])
+            assert dir_fids[1] not in {file['fid'] for file in await mirror.ls_dir(root_fid)}
+            assert mirror.conn.execute("SELECT COUNT(*) FROM entries WHERE pdir_fid = ?",
+                                       (dir_fids[1],)).fetchone()[0] == 0
+
+            # 新建目录使父目录过期，下次读取时重新列出
+            await disk.ensure_dir('/root/new')
+            assert 'new' in _names(await mirror.ls_dir(root_fid))
+            assert emulator.request_counts[SORT] == requests + 1
+            mirror.close()
+
+    asyncio.run(scenario())
+
+
+def test_mkdir_with_new_intermediate_dirs_marks_every_level(tmp_path):
+    async def scenario():
+        emulator = QuarkEmulator(task_duration=0.01)
+        emulator.populate('/root', 1, 1, account='A')
+        async with emulated_disks(emulator, 'A') as (disk,):
+            mirror = QuarkMirror(disk, str(tmp_path / 'mirror.db'))
+            await mirror.refresh('/root')
+            root_fid = (await disk.get_fids(['/root']))[0]['fid']
+            assert 'show' not in _names(await mirror.ls_dir(root_fid))
+
+            # /root/show 与 /root/show/S01 随 S01/E01 一并创建，各级目录的列表都要重新读取
+            await disk.ensure_dir('/root/show/S01/E01')
+            assert 'show' in _names(await mirror.ls_dir(root_fid))
+            show_fid = (await disk.get_fids(['/root/show']))[0]['fid']
+            assert _names(await mirror.ls_dir(show_fid)) == {'S01'}
+            mirror.close()
+
+    asyncio.run(scenario())
+
+
+def test_close_unregisters_the_write_listener(tmp_path):
+    async def scenario():
+        emulator = QuarkEmulator(task_duration=0.01)
+        emulator.populate('/root', 1, 1, account='A')
+        async with emulated_disks(emulator, 'A') as (disk,):
+            mirror = QuarkMirror(disk, str(tmp_path / 'mirror.db'))
+            await mirror.refresh('/root')
+            mirror.close()
+            assert disk._write_listeners == []
+            # 之后的写操作不再写入已关闭的连接
+            await disk.ensure_dir('/root/after-close')
+
+    asyncio.run(scenario())
@@ -0,0 +1,187 @@
+import asyncio
+import json
+import os
+import re
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from QuarkEmulator import QuarkEmulator
+from RangedDownloader import RangedDownloader
+from quark_env import emulated_disks
+
+CHUNK_SIZE = 64 * 1024
+DATA = os.urandom(CHUNK_SIZE * 6 + 123)
+
+
+class FileServer:
+    """
+    本地文件服务
+    ranged 为 False 时忽略 Range，返回不带 Content-Length 的完整（或截断的）响应体；
+    fail_starts 中的分段起点返回 500，truncate_starts 中的分段起点只返回一半数据
+    """
+    def __init__(self, ranged: bool = True, truncate_body: bool = False):
+        self.ranged = ranged
+        self.truncate_body = truncate_body
+        self.fail_starts: set[int] = set()
+        self.truncate_starts: set[int] = set()
+        self.range_starts: list[int] = []
+        self.runner = None
+        self.url = None
+
+    async def _get(self, request: web.Request):
+        match = re.match(r'bytes=(\d+)-(\d+)', request.headers.get('Range', ''))
+        if not self.ranged or match is None:
+            if match is not None:
+                # 探测请求：不支持 Range 的服务端返回带 Content-Length 的完整响应
+                return web.Response(body=DATA)
+            resp = web.StreamResponse()
+            resp.enable_chunked_encoding()
+            await resp.prepare(request)
+            await resp.write(DATA[:len(DATA) // 2] if self.truncate_body else DATA)
+            await resp.write_eof()
+            return resp
+        start, end = int(match.group(1)), int(match.group(2))
+        if end > start:
+            # 不记录 bytes=0-0 的探测请求
+            self.range_starts.append(start)
+        if start in self.fail_starts:
+            return web.Response(status=500)
+        body = DATA[start:end + 1]
+        if start in self.truncate_starts:
+            self.truncate_starts.discard(start)
+            body = body[:len(body) // 2]
+        return web.Response(status=206, body=body, headers={'Content-Range': f'bytes {start}-{end}/{len(DATA)}'})
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get('/file', self._get)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/file"
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.runner.cleanup()
+
+
+def _read(path) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_interrupted_download_resumes_missing_chunks(tmp_path):
+    dest = str(tmp_path / 'dest.bin')
+
+    async def scenario():
+        async with FileServer() as server, aiohttp.ClientSession() as session:
+            downloader = RangedDownloader(session, connections=2, chunk_size=CHUNK_SIZE)
+            failed_start = CHUNK_SIZE * 4
+            server.fail_starts.add(failed_start)
+            with pytest.raises(RuntimeError):
+                await downloader.download(server.url, dest, expected_size=len(DATA))
+            with open(f'{dest}.progress', encoding='utf-8') as f:
+                done = set(json.load(f)['done'])
+            assert 4 not in done and done
+
+            # 恢复后只请求未完成的分段
+            server.fail_starts.clear()
+            server.range_starts.clear()
+            await downloader.download(server.url, dest, expected_size=len(DATA))
+            assert {start // CHUNK_SIZE for start in server.range_starts} == set(range(7)) - done
+            assert _read(dest) == DATA
+            assert not os.path.exists(f'{dest}.progress')
+
+    asyncio.run(scenario())
+
+
+def test_truncated_chunk_is_retried(tmp_path):
+    dest = str(tmp_path / 'dest.bin')
+
+    async def scenario():
+        async with FileServer() as server, aiohttp.ClientSession() as session:
+            server.truncate_starts.add(CHUNK_SIZE * 2)
+            downloader = RangedDownloader(session, connections=3, chunk_size=CHUNK_SIZE)
+            await downloader.download(server.url, dest)
+            assert server.range_starts.count(CHUNK_SIZE * 2) == 2
+            assert _read(dest) == DATA
+
+    asyncio.run(scenario())
+
+
+def test_progress_for_another_size_is_ignored(tmp_path):
+    dest = str(tmp_path / 'dest.bin')
+    with open(dest, 'wb') as f:
+        f.write(b'\0' * len(DATA))
+    with open(f'{dest}.progress', 'w', encoding='utf-8') as f:
+        json.dump({'size': len(DATA) + 1, 'chunk_size': CHUNK_SIZE, 'done': list(range(7))}, f)
+
+    async def scenario():
+        async with FileServer() as server, aiohttp.ClientSession() as session:
+            downloader = RangedDownloader(session, chunk_size=CHUNK_SIZE)
+            await downloader.download(server.url, dest)
+            assert _read(dest) == DATA
+
+    asyncio.run(scenario())
+
+
+def test_stream_download_without_range(tmp_path):
+    dest = str(tmp_path / 'dest.bin')
+
+    async def scenario():
+        async with FileServer(ranged=False) as server, aiohttp.ClientSession() as session:
+            await RangedDownloader(session, chunk_size=CHUNK_SIZE).download(server.url, dest)
+            assert _read(dest) == DATA
+
+    asyncio.run(scenario())
+
+
+def test_truncated_stream_body_is_detected(tmp_path):
+    dest = str(tmp_path / 'dest.bin')
+
+    async def scenario():
+        async with FileServer(ranged=False, truncate_body=True) as server, aiohttp.ClientSession() as session:
+            with pytest.raises(RuntimeError, match='数据不完整'):
+                await RangedDownloader(session, chunk_size=CHUNK_SIZE).download(server.url, dest)
+
+    asyncio.run(scenario())
+
+
+def test_size_mismatch_with_expected_size(tmp_path):
+    async def scenario():
+        async with FileServer() as server, aiohttp.ClientSession() as session:
+            with pytest.raises(RuntimeError, match='文件大小不一致'):
+                await RangedDownloader(session).download(server.url, str(tmp_path / 'dest.bin'),
+                                                         expected_size=len(DATA) - 1)
+
+    asyncio.run(scenario())
+
+
+def test_download_to_against_the_emulator(tmp_path):
+    async def scenario():
+        emulator = QuarkEmulator()
+        drive = emulator.drive('A')
+        folder = drive.mkdir_p('/电影')
+        # 三个分段，最后一段不满
+        size = RangedDownloader.CHUNK_SIZE * 2 + 7
+        fid = drive.add(folder['fid'], 'movie.mkv', 1, size)['fid']
+        async with emulated_disks(emulator, 'A') as (disk,):
+            path = await disk.download_to(fid, str(tmp_path), connections=2)
+            assert path == str(tmp_path / 'movie.mkv')
+            assert _read(path) == QuarkEmulator.file_content(fid, 0, size)
+
+            url = f'{emulator.base_url}/download/A/{fid}'
+            async with aiohttp.ClientSession() as session:
+                async with session.get(url, headers={'Range': 'bytes=-5'}) as resp:
+                    assert resp.status == 206
+                    assert resp.headers['Content-Range'] == f'bytes {size - 5}-{size - 1}/{size}'
+                    assert await resp.read() == QuarkEmulator.file_content(fid, size - 5, size)
+                async with session.get(url, headers={'Range': f'bytes={size}-'}) as resp:
+                    assert resp.status == 416
+                async with session.get(f'{emulator.base_url}/download/A/missing') as resp:
+                    assert resp.status == 404
+
+    asyncio.run(scenario())
@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+import pytest
+
+from QuarkDisk import RateLimiter, RetryMiddleware, TokenBucket
+from QuarkEmulator import QuarkEmulator
+from quark_env import emulated_disks
+
+
+def test_bucket_allows_burst_then_paces():
+    async def scenario():
+        bucket = TokenBucket(rate=20, burst=3, min_rate=1)
+        start = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire()
+        assert time.monotonic() - start < 0.03
+        await bucket.acquire()
+        assert time.monotonic() - start >= 0.04
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_acquires_are_serialized():
+    async def scenario():
+        bucket = TokenBucket(rate=50, burst=1, min_rate=1)
+        start = time.monotonic()
+        await asyncio.gather(*[bucket.acquire() for _ in range(6)])
+        # 首个令牌来自突发容量，其余 5 个按 50/s 发放
+        assert time.monotonic() - start >= 0.09
+
+    asyncio.run(scenario())
+
+
+def test_throttle_halves_rate_down_to_min_and_recover_is_linear():
+    bucket = TokenBucket(rate=4, burst=4, min_rate=1)
+    bucket.throttle()
+    assert bucket.rate == 2
+    assert bucket.tokens <= 0
+    for _ in range(5):
+        bucket.throttle()
+    assert bucket.rate == 1
+    bucket.recover()
+    assert bucket.rate == pytest.approx(1.2)
+    for _ in range(100):
+        bucket.recover()
+    assert bucket.rate == 4
+
+
+def test_classify_endpoints():
+    base = 'https://drive-pc.quark.cn/1/clouddrive'
+    assert RateLimiter.classify(f'{base}/file/sort?pdir_fid=0') == 'list'
+    assert RateLimiter.classify(f'{base}/file/info/path_list') == 'list'
+    assert RateLimiter.classify(f'{base}/file') == 'write'
+    assert RateLimiter.classify(f'{base}/file/rename') == 'write'
+    assert RateLimiter.classify(f'{base}/share/sharepage/save') == 'write'
+    assert RateLimiter.classify(f'{base}/share') == 'share'
+    assert RateLimiter.classify(f'{base}/share/sharepage/detail') == 'list'
+
+
+def test_server_throttling_slows_down_only_that_class(monkeypatch):
+    monkeypatch.setattr(RetryMiddleware, 'BASE_DELAY', 0.01)
+
+    async def scenario():
+        emulator = QuarkEmulator(rate_limit=3)
+        emulator.populate('/src', 1, 1, account='A')
+        async with emulated_disks(emulator, 'A') as (disk,):
+            await asyncio.gather(*[disk.ls_dir('0') for _ in range(8)], return_exceptions=True)
+            buckets = disk.rate_limiter.buckets
+            assert buckets['list'].rate < RateLimiter.LIMITS['list'][0]
+            assert buckets['write'].rate == RateLimiter.LIMITS['write'][0]
+
+    asyncio.run(scenario())
@@ -0,0 +1,47 @@
+import asyncio
+
+from QuarkEmulator import CODE_NAME_CONFLICT, CODE_NOT_FOUND, QuarkEmulator
+from quark_env import emulated_disks
+
+RENAME = '/1/clouddrive/file/rename'
+
+
+def _add_files(emulator: QuarkEmulator, *names: str) -> list[str]:
+    drive = emulator.drive('A')
+    folder = drive.mkdir_p('/show/S01')
+    return [drive.add(folder['fid'], name, 1)['fid'] for name in names]
+
+
+def test_rename_many_skips_names_that_already_match():
+    async def scenario():
+        emulator = QuarkEmulator()
+        fids = _add_files(emulator, 'a.mp4', 'S01E02.mp4', 'c.mp4')
+        async with emulated_disks(emulator, 'A') as (disk,):
+            mapping = {fids[0]: 'S01E01.mp4', fids[1]: 'S01E02.mp4', fids[2]: 'S01E03.mp4'}
+            current_names = {fids[0]: 'a.mp4', fids[1]: 'S01E02.mp4', fids[2]: 'c.mp4'}
+            results = await disk.rename_many(mapping, current_names)
+            assert list(results) == fids
+            assert [results[fid]['skipped'] for fid in fids] == [False, True, False]
+            assert all(result['code'] == 0 for result in results.values())
+            # 名称已正确的文件不发请求
+            assert emulator.request_counts[RENAME] == 2
+            assert set(emulator.drive('A').lookup('/show/S01')['children']) == set(mapping.values())
+
+    asyncio.run(scenario())
+
+
+def test_rename_many_reports_per_item_failures():
+    async def scenario():
+        emulator = QuarkEmulator()
+        fids = _add_files(emulator, 'a.mp4', 'b.mp4', 'taken.mp4')
+        async with emulated_disks(emulator, 'A') as (disk,):
+            results = await disk.rename_many({fids[0]: 'S01E01.mp4', fids[1]: 'taken.mp4', 'missing': 'S01E03.mp4'})
+            # 一个失败不影响其他文件，每个 fid 都有结果
+            assert results[fids[0]] == {'file_name': 'S01E01.mp4', 'code': 0, 'message': 'ok', 'skipped': False}
+            assert results[fids[1]]['code'] == CODE_NAME_CONFLICT
+            assert results['missing']['code'] == CODE_NOT_FOUND
+            assert not any(results[fid]['skipped'] for fid in results)
+            children = emulator.drive('A').lookup('/show/S01')['children']
+            assert set(children) == {'S01E01.mp4', 'b.mp4', 'taken.mp4'}
+
+    asyncio.run(scenario())
@@ -0,0 +1,154 @@
+import asyncio
+
+import pytest
+
+from QuarkDisk import QuarkDisk, SaveBatcher
+from QuarkEmulator import QuarkEmulator
+from quark_env import emulated_disks
+
+
+class FakeDrive:
+    """
+    记录每次转存调用；fail_when(fid_list) 为 True 时转存失败，
+    partial 为 True 时失败前先写入前一半文件，模拟合并转存部分完成后报错
+    """
+    def __init__(self, fail_when=lambda fid_list: False, partial: bool = False):
+        self.fail_when = fail_when
+        self.partial = partial
+        self.calls: list[list] = []
+        self.dirs: dict[str, list] = {}
+
+    async def save(self, fid_list, fid_token_list, to_pdir_fid, pwd_id, stoken):
+        self.calls.append(list(fid_list))
+        await asyncio.sleep(0)
+        saved = self.dirs.setdefault(to_pdir_fid, [])
+        if self.fail_when(fid_list):
+            if self.partial:
+                saved += [f'{fid}.mp4' for fid in fid_list[:len(fid_list) // 2]]
+            raise RuntimeError(f'转存失败：{fid_list}')
+        saved += [f'{fid}.mp4' for fid in fid_list]
+        return True
+
+    async def list_names(self, to_pdir_fid):
+        return set(self.dirs.get(to_pdir_fid, []))
+
+
+def _submit(batcher: SaveBatcher, fids: list, to_pdir_fid: str = 'dir', pwd_id: str = 'share'):
+    return batcher.submit(fids, [f't-{fid}' for fid in fids], to_pdir_fid, pwd_id, 'stoken',
+                          [f'{fid}.mp4' for fid in fids])
+
+
+def test_concurrent_submits_are_merged_and_deduplicated():
+    async def scenario():
+        drive = FakeDrive()
+        batcher = SaveBatcher(drive.save, drive.list_names)
+        results = await asyncio.gather(_submit(batcher, ['a']), _submit(batcher, ['b', 'a']),
+                                       _submit(batcher, ['c'], to_pdir_fid='other'))
+        assert results == [True, True, True]
+        assert sorted(map(sorted, drive.calls)) == [['a', 'b'], ['c']]
+        assert batcher.stats() == {'requests': 3, 'batches': 2, 'pending': 0}
+
+    asyncio.run(scenario())
+
+
+def test_full_batch_is_flushed_before_the_window():
+    async def scenario():
+        drive = FakeDrive()
+        batcher = SaveBatcher(drive.save, window=10, max_batch=3)
+        await asyncio.wait_for(asyncio.gather(*[_submit(batcher, [fid]) for fid in 'abc']), timeout=1)
+        assert drive.calls == [['a', 'b', 'c']]
+
+    asyncio.run(scenario())
+
+
+def test_failed_batch_falls_back_to_single_requests():
+    async def scenario():
+        drive = FakeDrive(fail_when=lambda fid_list: 'bad' in fid_list)
+        batcher = SaveBatcher(drive.save, drive.list_names)
+        ok, bad = await asyncio.gather(_submit(batcher, ['a', 'b']), _submit(batcher, ['bad']),
+                                       return_exceptions=True)
+        assert ok is True
+        assert isinstance(bad, RuntimeError)
+        assert drive.calls[1:] in ([['a', 'b'], ['bad']], [['bad'], ['a', 'b']])
+
+    asyncio.run(scenario())
+
+
+def test_fallback_skips_files_saved_by_the_failed_batch():
+    async def scenario():
+        drive = FakeDrive(fail_when=lambda fid_list: len(fid_list) == 4, partial=True)
+        batcher = SaveBatcher(drive.save, drive.list_names)
+        results = await asyncio.gather(_submit(batcher, ['a']), _submit(batcher, ['b']), _submit(batcher, ['c', 'd']))
+        assert results == [True, True, True]
+        # a、b 已经在失败的合并转存中落盘，逐个重试时只转存剩余的文件
+        assert drive.calls == [['a', 'b', 'c', 'd'], ['c', 'd']]
+        assert sorted(drive.dirs['dir']) == ['a.mp4', 'b.mp4', 'c.mp4', 'd.mp4']
+
+    asyncio.run(scenario())
+
+
+def test_fallback_resubmits_everything_when_listing_fails():
+    async def scenario():
+        drive = FakeDrive(fail_when=lambda fid_list: len(fid_list) == 2, partial=True)
+
+        async def list_names(to_pdir_fid):
+            raise RuntimeError('列目录失败')
+
+        batcher = SaveBatcher(drive.save, list_names)
+        assert await asyncio.gather(_submit(batcher, ['a']), _submit(batcher, ['b'])) == [True, True]
+        assert sorted(map(sorted, drive.calls[1:])) == [['a'], ['b']]
+
+    asyncio.run(scenario())
+
+
+def test_single_request_failure_is_not_retried():
+    async def scenario():
+        drive = FakeDrive(fail_when=lambda fid_list: True)
+        batcher = SaveBatcher(drive.save, drive.list_names)
+        with pytest.raises(RuntimeError):
+            await _submit(batcher, ['a'])
+        assert drive.calls == [['a']]
+
+    asyncio.run(scenario())
+
+
+def test_close_flushes_pending_batches():
+    async def scenario():
+        drive = FakeDrive()
+        batcher = SaveBatcher(drive.save, window=10)
+        waiter = asyncio.ensure_future(_submit(batcher, ['a']))
+        await asyncio.sleep(0)
+        await batcher.close()
+        assert await waiter is True
+        assert drive.calls == [['a']]
+
+    asyncio.run(scenario())
+
+
+def test_batched_save_against_emulator():
+    async def scenario():
+        emulator = QuarkEmulator(task_duration=0.01)
+        dir_fids = emulator.populate('/src', 1, 4, account='A')
+        async with emulated_disks(emulator, 'A', 'B') as (source, target):
+            share = await QuarkDisk.parse_share_url(await source.create_share_link(dir_fids, 'batch'))
+            episodes = (await share.ls_dir(dir_fids[0]))['list']
+            to_pdir_fid = await target.ensure_dir('/dst')
+
+            results = await asyncio.gather(
+                *[target.save_file([file['fid']], [file['share_fid_token']], to_pdir_fid, share.pwd_id,
+                                   share.stoken, batch=True, file_names=[file['file_name']]) for file in episodes],
+                target.save_file(['bad'], ['bad'], to_pdir_fid, share.pwd_id, share.stoken, batch=True),
+                return_exceptions=True)
+            assert results[:4] == [True] * 4
+            assert isinstance(results[4], Exception)
+            names = sorted(file['file_name'] for file in await target.ls_dir(to_pdir_fid))
+            assert names == sorted(file['file_name'] for file in episodes)
+
+            # 默认不合并，立即单独转存
+            requests = emulator.request_counts['/1/clouddrive/share/sharepage/save']
+            await target.save_file([episodes[0]['fid']], [episodes[0]['share_fid_token']],
+                                   await target.ensure_dir('/dst2'), share.pwd_id, share.stoken)
+            assert emulator.request_counts['/1/clouddrive/share/sharepage/save'] == requests + 1
+            assert target.save_batcher.stats()['requests'] == 5
+
+    asyncio.run(scenario())
@@ -0,0 +1,90 @@
+import asyncio
+
+from QuarkEmulator import QuarkEmulator
+from Services.quark_share_dir_tree import QuarkShareDirTree, ShareTreeCache
+from quark_env import emulated_disks
+
+
+class FakeTree:
+    def __init__(self, share_link: str):
+        self.share_link = share_link
+        self.closed = False
+
+    async def close_(self):
+        self.closed = True
+
+
+def test_hit_returns_the_same_tree():
+    cache = ShareTreeCache()
+    tree = cache.get('a', FakeTree)
+    assert cache.get('a', FakeTree) is tree
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_lru_eviction_does_not_close_the_evicted_tree():
+    async def scenario():
+        cache = ShareTreeCache(max_size=2)
+        a = cache.get('a', FakeTree)
+        cache.get('b', FakeTree)
+        cache.get('a', FakeTree)
+        c = cache.get('c', FakeTree)
+        await asyncio.sleep(0)
+        # b 最久未使用被淘汰，仍在使用的树不会被关闭
+        assert [tree.share_link for tree in cache.values()] == ['a', 'c']
+        assert cache.stats()['evictions'] == 1
+        assert not any(tree.closed for tree in (a, c))
+        b = cache.get('b', FakeTree)
+        assert not b.closed
+        assert cache.stats()['evictions'] == 2
+
+    asyncio.run(scenario())
+
+
+def test_expired_entry_is_replaced_without_closing():
+    async def scenario():
+        cache = ShareTreeCache(ttl=-1)
+        old = cache.get('a', FakeTree)
+        new = cache.get('a', FakeTree)
+        await asyncio.sleep(0)
+        assert new is not old
+        assert not old.closed
+        assert cache.stats()['evictions'] == 1
+
+    asyncio.run(scenario())
+
+
+def test_close_closes_cached_trees():
+    async def scenario():
+        cache = ShareTreeCache()
+        trees = [cache.get(link, FakeTree) for link in 'ab']
+        await cache.close()
+        assert all(tree.closed for tree in trees)
+        assert cache.stats()['size'] == 0
+
+    asyncio.run(scenario())
+
+
+def test_evicted_tree_keeps_working_for_its_holder(monkeypatch):
+    monkeypatch.setattr(QuarkShareDirTree, 'cache', ShareTreeCache(max_size=1))
+
+    async def scenario():
+        emulator = QuarkEmulator()
+        dir_fids = emulator.populate('/src', 2, 2, account='A')
+        links = [emulator.create_share([fid], account='A') for fid in dir_fids]
+        async with emulated_disks(emulator):
+            held = QuarkShareDirTree.get_quark_share_tree(links[0])
+            await held.parse(1)
+            client = held.ParseQuarkShareLInk
+            other = QuarkShareDirTree.get_quark_share_tree(links[1])
+            await other.parse(1)
+            assert QuarkShareDirTree.cache.stats()['evictions'] == 1
+            await asyncio.sleep(0)
+            # 被淘汰的树仍可继续使用，分享客户端未被置空
+            assert held.ParseQuarkShareLInk is client
+            assert await held.ensure_share_client() is client
+            node = await held.get_node_info('/目录0000/S01E02.mp4')
+            assert node['file_name'] == 'S01E02.mp4'
+            # 再次获取时创建新的树
+            assert QuarkShareDirTree.get_quark_share_tree(links[0]) is not held
+
+    asyncio.run(scenario())
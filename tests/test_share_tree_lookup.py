@@ -0,0 +1,63 @@
+import asyncio
+
+from QuarkEmulator import QuarkEmulator
+from Services.quark_share_dir_tree import QuarkShareDirTree
+from quark_env import emulated_disks
+
+DETAIL = '/1/clouddrive/share/sharepage/detail'
+
+
+def _make_share(emulator: QuarkEmulator, seasons: int = 5) -> str:
+    drive = emulator.drive('A')
+    show = drive.mkdir_p('/剧')
+    for season in range(1, seasons + 1):
+        season_node = drive.add(show['fid'], f'S{season}', 0)
+        drive.add(season_node['fid'], 'E1.mp4', 1)
+    return emulator.create_share([show['fid']], account='A')
+
+
+def test_lookup_lists_only_directories_on_the_path():
+    async def scenario():
+        emulator = QuarkEmulator()
+        link = _make_share(emulator)
+        async with emulated_disks(emulator):
+            tree = QuarkShareDirTree(link)
+            node = await tree.get_node_info('/剧/S3/E1.mp4')
+            assert node['file_name'] == 'E1.mp4'
+            # 根目录、/剧、/剧/S3 各一次
+            assert emulator.request_counts[DETAIL] == 3
+            assert await tree.get_node_info('/剧/S9') is None
+            assert emulator.request_counts[DETAIL] == 3
+            # 已列出的目录直接复用
+            assert (await tree.get_node_info('/剧/S3', expand=False))['file_name'] == 'S3'
+            assert emulator.request_counts[DETAIL] == 3
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_lookups_share_listings():
+    async def scenario():
+        emulator = QuarkEmulator(latency=0.01)
+        link = _make_share(emulator)
+        async with emulated_disks(emulator):
+            tree = QuarkShareDirTree(link)
+            nodes = await asyncio.gather(*[tree.get_node_info(f'/剧/S{season}/E1.mp4') for season in (1, 2, 1, 2)])
+            assert [node['file_name'] for node in nodes] == ['E1.mp4'] * 4
+            # 根目录与 /剧 只列出一次，S1、S2 各一次
+            assert emulator.request_counts[DETAIL] == 4
+
+    asyncio.run(scenario())
+
+
+def test_parse_after_lookup_expands_the_remaining_frontier():
+    async def scenario():
+        emulator = QuarkEmulator()
+        link = _make_share(emulator, seasons=3)
+        async with emulated_disks(emulator):
+            tree = QuarkShareDirTree(link)
+            await tree.get_node_info('/剧/S1/E1.mp4')
+            await tree.parse(2, use_snapshot=False)
+            assert tree.last_parse_stats['requests'] == 2
+            assert len(tree.get_video_node_info()) == 3
+
+    asyncio.run(scenario())
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from QuarkEmulator import QuarkEmulator
+from Services.quark_share_dir_tree import QuarkShareDirTree, all_of, is_video, only_season, prefer_4k, skip_extras
+from quark_env import emulated_disks
+
+
+def _dir(name: str) -> dict:
+    return {'file_name': name, 'file_type': 0}
+
+
+@pytest.mark.parametrize('name, keep', [
+    ('Season 1', True), ('花絮', False), ('Extras', False), ('trailer', False), ('Sample', False), ('S01', True),
+    ('[Featurettes]', False), ('Bonus Features', False), ('01 Samples', False), ('第一季 幕后花絮', False),
+    # 名称中包含这些单词的剧集目录不能被剪掉
+    ('Extraordinary Attorney Woo', True), ('Trailer Park Boys', True), ('The Bonus Family', True),
+    ('Samples of Life S01', True),
+])
+def test_skip_extras(name, keep):
+    assert skip_extras(_dir(name), []) is keep
+
+
+def test_prefer_4k():
+    siblings = [_dir('4K'), _dir('1080P'), _dir('字幕')]
+    assert prefer_4k(_dir('4K'), siblings)
+    assert not prefer_4k(_dir('1080P'), siblings)
+    # 没有清晰度标记的目录与没有 4K 同级时保留
+    assert prefer_4k(_dir('字幕'), siblings)
+    assert prefer_4k(_dir('1080P'), [_dir('1080P'), _dir('720P')])
+
+
+@pytest.mark.parametrize('name, keep', [
+    ('S02', True), ('Season 2', True), ('第2季', True), ('S01', False), ('第 3 季', False), ('特别篇', True),
+    ('S2E01', True), ('1080P', True),
+])
+def test_only_season(name, keep):
+    assert only_season(2)(_dir(name), []) is keep
+
+
+def test_all_of_and_is_video():
+    predicate = all_of(skip_extras, only_season(1))
+    assert predicate(_dir('S01'), [])
+    assert not predicate(_dir('S01 花絮'), [])
+    assert not predicate(_dir('S02'), [])
+    assert is_video({'file_name': 'E01.mkv'})
+    assert not is_video({'file_name': 'E01.srt'})
+
+
+def _make_share(emulator: QuarkEmulator) -> str:
+    """
+    /剧/4K/E1-E3.mp4、/剧/1080P/E1-E3.mp4、/剧/花絮/clip.mp4
+    """
+    drive = emulator.drive('A')
+    show = drive.mkdir_p('/剧')
+    for name, files in [('4K', ['E1.mp4', 'E2.mp4', 'E3.mp4']), ('1080P', ['E1.mp4', 'E2.mp4', 'E3.mp4']),
+                        ('花絮', ['clip.mp4'])]:
+        folder = drive.add(show['fid'], name, 0)
+        for file_name in files:
+            drive.add(folder['fid'], file_name, 1)
+    return emulator.create_share([show['fid']], account='A')
+
+
+def test_dir_predicate_prunes_listings_and_pruned_dirs_stay_expandable():
+    async def scenario():
+        emulator = QuarkEmulator()
+        link = _make_share(emulator)
+        async with emulated_disks(emulator):
+            tree = QuarkShareDirTree(link)
+            predicate = all_of(skip_extras, prefer_4k)
+            await tree.parse(3, use_snapshot=False, dir_predicate=predicate, file_predicate=is_video)
+            # 根目录、/剧、/剧/4K
+            assert tree.last_parse_stats['requests'] == 3
+            assert len(tree.get_video_node_info()) == 3
+            assert len(tree.get_video_node_info(dir_predicate=predicate)) == 3
+
+            # 不带条件再次 parse 时展开被剪掉的目录
+            await tree.parse(3)
+            assert tree.last_parse_stats['requests'] == 2
+            assert len(tree.get_video_node_info()) == 7
+            assert len(tree.get_video_node_info(dir_predicate=predicate)) == 3
+
+    asyncio.run(scenario())
+
+
+def test_stop_when_ends_traversal_early():
+    async def scenario():
+        emulator = QuarkEmulator()
+        link = _make_share(emulator)
+        async with emulated_disks(emulator):
+            tree = QuarkShareDirTree(link)
+            tree.concurrency = 1
+            await tree.parse(3, use_snapshot=False, file_predicate=is_video, stop_when=lambda files: len(files) >= 1)
+            # 列出第一个子目录后找到文件即停止，其余两个目录留在 frontier 中
+            assert tree.last_parse_stats['requests'] == 3
+            assert len(tree.frontier) == 2
+            await tree.parse(3)
+            assert tree.last_parse_stats['requests'] == 2
+            assert len(tree.get_video_node_info()) == 7
+            assert not tree.frontier
+
+    asyncio.run(scenario())
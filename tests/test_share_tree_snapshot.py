@@ -0,0 +1,181 @@
+import asyncio
+import sqlite3
+
+from QuarkDisk import ParseQuarkShareLInk, StokenStore
+from QuarkEmulator import QuarkEmulator
+from Services.quark_share_dir_tree import QuarkShareDirTree, ShareTreeSnapshotStore
+from quark_env import emulated_disks
+
+TOKEN = '/1/clouddrive/share/sharepage/token'
+NODES = [['0', '/', 0, None, None, -1, 'expanded', None],
+         ['d', '剧', 0, '0', 't-d', 0, 'truncated', [1, 1]]]
+
+
+def _store(tmp_path, **kwargs) -> ShareTreeSnapshotStore:
+    return ShareTreeSnapshotStore(str(tmp_path / 'snapshots.db'), **kwargs)
+
+
+def test_store_round_trip_and_delete(tmp_path):
+    store = _store(tmp_path)
+    store.save('link', 'pwd', '', 'stoken', [1, 1], 2, NODES)
+    snapshot = store.load('link')
+    assert snapshot['nodes'] == NODES
+    assert (snapshot['pwd_id'], snapshot['stoken'], snapshot['max_deep']) == ('pwd', 'stoken', 2)
+    store.delete('link')
+    assert store.load('link') is None
+    store.close()
+
+
+def test_store_rejects_expired_corrupt_and_unordered_snapshots(tmp_path):
+    store = _store(tmp_path, max_age=-1)
+    store.save('link', 'pwd', '', 'stoken', [1, 1], 2, NODES)
+    assert store.load('link') is None
+
+    store = _store(tmp_path)
+    store.save('unordered', 'pwd', '', 'stoken', [1, 1], 2, list(reversed(NODES)))
+    assert store.load('unordered') is None
+    store.save('foreign', 'pwd', '', 'stoken', [1, 1], 2, [NODES[0], ['d', '剧', 0, 'sharer-dir', 't-d', 0, None, None]])
+    assert store.load('foreign') is None
+    store.conn.execute("UPDATE share_trees SET nodes = ? WHERE share_link = 'link'", (b'not zlib',))
+    assert store.load('link') is None
+    store.close()
+
+
+def _make_share(emulator: QuarkEmulator) -> tuple[str, str]:
+    """分享 /剧，其下有 S1、S2 两季各两集，返回 (分享链接, /剧 的 fid)"""
+    drive = emulator.drive('A')
+    show = drive.mkdir_p('/剧')
+    for season in ('S1', 'S2'):
+        season_node = drive.add(show['fid'], season, 0)
+        for episode in ('E1.mp4', 'E2.mp4'):
+            drive.add(season_node['fid'], episode, 1)
+    return emulator.create_share([show['fid']], account='A'), show['fid']
+
+
+async def _parse(link: str, **kwargs) -> QuarkShareDirTree:
+    # 每次新建目录树，相当于一次新的运行
+    tree = QuarkShareDirTree(link)
+    await tree.parse(3, **kwargs)
+    return tree
+
+
+def _paths(tree: QuarkShareDirTree) -> set:
+    paths, stack = set(), [('', tree.tree)]
+    while stack:
+        prefix, node = stack.pop()
+        for child in node['child'] if isinstance(node.get('child'), list) else []:
+            path = f"{prefix}/{child['file_name']}"
+            paths.add(path)
+            stack.append((path, child))
+    return paths
+
+
+def test_unchanged_snapshot_needs_only_the_root_listing(tmp_path, monkeypatch):
+    async def scenario():
+        emulator = QuarkEmulator()
+        link, _ = _make_share(emulator)
+        async with emulated_disks(emulator):
+            first = await _parse(link)
+            assert first.last_parse_stats['requests'] == 4
+
+            # 新的运行没有缓存的 stoken，使用快照中的 stoken
+            monkeypatch.setattr(ParseQuarkShareLInk, 'stoken_store', StokenStore(str(tmp_path / 'new_run.json')))
+            tokens = emulator.request_counts[TOKEN]
+            second = await _parse(link)
+            assert second.last_parse_stats['requests'] == 1
+            assert emulator.request_counts[TOKEN] == tokens
+            assert _paths(second) == _paths(first)
+            assert (await second.get_node_info('/剧/S2/E1.mp4'))['file_name'] == 'E1.mp4'
+
+    asyncio.run(scenario())
+
+
+def test_changed_directory_is_relisted_without_its_unchanged_subdirs():
+    async def scenario():
+        emulator = QuarkEmulator()
+        link, show_fid = _make_share(emulator)
+        async with emulated_disks(emulator):
+            first = await _parse(link)
+            await asyncio.sleep(0.01)
+            emulator.drive('A').add(show_fid, 'poster.jpg', 1)
+            second = await _parse(link)
+            # 根目录与 /剧 各列出一次，S1、S2 未变化，沿用快照
+            assert second.last_parse_stats['requests'] == 2
+            assert _paths(second) == _paths(first) | {'/剧/poster.jpg'}
+
+    asyncio.run(scenario())
+
+
+def test_refresh_skips_the_snapshot():
+    async def scenario():
+        emulator = QuarkEmulator()
+        link, _ = _make_share(emulator)
+        async with emulated_disks(emulator):
+            await _parse(link)
+            tree = await _parse(link, refresh=True)
+            assert tree.last_parse_stats['requests'] == 4
+            tree = await _parse(link, use_snapshot=False)
+            assert tree.last_parse_stats['requests'] == 4
+
+    asyncio.run(scenario())
+
+
+def test_expired_snapshot_stoken_is_refreshed():
+    async def scenario():
+        emulator = QuarkEmulator()
+        link, _ = _make_share(emulator)
+        async with emulated_disks(emulator):
+            first = await _parse(link)
+            emulator.expire_stokens()
+            tokens = emulator.request_counts[TOKEN]
+            second = await _parse(link)
+            assert emulator.request_counts[TOKEN] == tokens + 1
+            assert _paths(second) == _paths(first)
+
+    asyncio.run(scenario())
+
+
+def test_snapshot_save_failure_does_not_fail_parse(monkeypatch):
+    def broken_save(*args, **kwargs):
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(QuarkShareDirTree.snapshot_store, 'save', broken_save)
+
+    async def scenario():
+        emulator = QuarkEmulator()
+        link, _ = _make_share(emulator)
+        async with emulated_disks(emulator):
+            tree = await _parse(link)
+            assert '/剧/S1/E2.mp4' in _paths(tree)
+
+    asyncio.run(scenario())
+
+
+def test_changed_dir_expanded_beyond_max_deep_is_relisted():
+    async def scenario():
+        emulator = QuarkEmulator()
+        drive = emulator.drive('A')
+        _, show_fid = _make_share(emulator)
+        other = drive.mkdir_p('/其他')
+        link = emulator.create_share([show_fid, other['fid']], account='A')
+        async with emulated_disks(emulator):
+            season_fid = drive.lookup('/剧/S1')['fid']
+            first = QuarkShareDirTree(link)
+            # get_node_info 按需列出 S1，S1 的子节点深度超过之后 parse 的 max_deep；parse 列出 /其他 后写入快照
+            assert await first.get_node_info('/剧/S1/E1.mp4') is not None
+            await first.parse(1)
+            assert first.last_parse_stats['requests'] == 1
+            await asyncio.sleep(0.01)
+            drive.add(season_fid, 'E3.mp4', 1)
+            drive.add(show_fid, 'poster.jpg', 1)
+
+            second = QuarkShareDirTree(link)
+            await second.parse(1)
+            assert second.last_parse_stats['requests'] == 2
+            # S1 变化但未在校验中重新列出，视为未列出，查找时重新列出而不是返回旧的子节点
+            assert second.nodes[season_fid].state == 'truncated'
+            assert (await second.get_node_info('/剧/S1/E3.mp4'))['file_name'] == 'E3.mp4'
+            snapshot = QuarkShareDirTree.snapshot_store.load(link)
+            assert not any(row[3] == season_fid for row in snapshot['nodes'])
+
+    asyncio.run(scenario())
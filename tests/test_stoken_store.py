@@ -0,0 +1,65 @@
+import asyncio
+
+from QuarkDisk import ParseQuarkShareLInk, QuarkDisk, StokenStore
+from QuarkEmulator import QuarkEmulator
+from quark_env import emulated_disks
+
+TOKEN = '/1/clouddrive/share/sharepage/token'
+
+
+def test_entries_persist_across_instances(tmp_path):
+    path = str(tmp_path / 'stokens.json')
+    StokenStore(path).put('pwd', '', 'stoken-1')
+    store = StokenStore(path)
+    assert store.get('pwd', '') == 'stoken-1'
+    assert store.get('pwd', 'passcode') is None
+    assert store.stats() == {'size': 1, 'hits': 1, 'misses': 1}
+
+
+def test_expired_entries_are_ignored_and_pruned(tmp_path):
+    path = str(tmp_path / 'stokens.json')
+    StokenStore(path).put('old', '', 'stoken-old')
+    store = StokenStore(path, max_age=-1)
+    assert store.get('old', '') is None
+    store.put('new', '', 'stoken-new')
+    assert StokenStore(path).stats()['size'] == 0
+
+
+def test_invalidate_keeps_a_newer_stoken(tmp_path):
+    store = StokenStore(str(tmp_path / 'stokens.json'))
+    store.put('pwd', '', 'stoken-2')
+    # 另一个协程已经刷新为 stoken-2，过期的 stoken-1 不应删掉它
+    store.invalidate('pwd', '', 'stoken-1')
+    assert store.get('pwd', '') == 'stoken-2'
+    store.invalidate('pwd', '', 'stoken-2')
+    assert store.get('pwd', '') is None
+
+
+def test_corrupt_file_starts_empty(tmp_path):
+    path = tmp_path / 'stokens.json'
+    path.write_text('{not json', encoding='utf-8')
+    store = StokenStore(str(path))
+    assert store.get('pwd', '') is None
+    store.put('pwd', '', 'stoken')
+    assert StokenStore(str(path)).get('pwd', '') == 'stoken'
+
+
+def test_share_client_reuses_and_refreshes_stokens():
+    async def scenario():
+        emulator = QuarkEmulator()
+        dir_fids = emulator.populate('/src', 1, 1, account='A')
+        link = emulator.create_share(dir_fids, account='A')
+        async with emulated_disks(emulator):
+            first = await QuarkDisk.parse_share_url(link)
+            second = await QuarkDisk.parse_share_url(link)
+            assert second.stoken == first.stoken
+            assert emulator.request_counts[TOKEN] == 1
+
+            # 服务端拒绝 stoken 后 ls_dir 自动刷新并重试，新的 stoken 写回缓存
+            emulator.expire_stokens()
+            listing = await second.ls_dir('0')
+            assert [file['file_name'] for file in listing['list']] == ['目录0000']
+            assert emulator.request_counts[TOKEN] == 2
+            assert ParseQuarkShareLInk.stoken_store.get(second.pwd_id, second.passcode) == second.stoken != first.stoken
+
+    asyncio.run(scenario())
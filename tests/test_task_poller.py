@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+import metrics
+from QuarkDisk import TaskPoller
+
+
+class FakeTasks:
+    """按轮询次数返回任务状态：polls 次查询之后完成"""
+    def __init__(self, polls: dict[str, int], responses: dict[str, dict] = None):
+        self.polls = polls
+        self.responses = responses or {}
+        self.queries: dict[str, int] = {}
+
+    async def query(self, task_id: str, retry_index: int) -> dict:
+        self.queries[task_id] = self.queries.get(task_id, 0) + 1
+        if task_id in self.responses:
+            return self.responses[task_id]
+        status = 2 if self.queries[task_id] >= self.polls[task_id] else 0
+        return {'code': 0, 'data': {'status': status, 'task_title': task_id}}
+
+
+def _task_histograms(account: str) -> list:
+    return [histogram for (name, labels), histogram in metrics.registry.histograms.items()
+            if name == 'quark_task_duration_seconds' and ('account', account) in labels]
+
+
+def test_tasks_are_polled_until_finished():
+    async def scenario():
+        tasks = FakeTasks({'a': 1, 'b': 3, 'c': 5})
+        poller = TaskPoller(tasks.query, account='poller-finish')
+        results = await asyncio.gather(*[poller.wait(task_id) for task_id in 'abc'])
+        assert [resp['data']['task_title'] for resp in results] == ['a', 'b', 'c']
+        assert tasks.queries == {'a': 1, 'b': 3, 'c': 5}
+        assert poller.stats()['completed'] == 3
+        assert poller.stats()['pending'] == 0
+        assert sum(histogram.count for histogram in _task_histograms('poller-finish')) == 3
+
+    asyncio.run(scenario())
+
+
+def test_same_task_id_is_polled_once():
+    async def scenario():
+        tasks = FakeTasks({'a': 2})
+        poller = TaskPoller(tasks.query)
+        first, second = await asyncio.gather(poller.wait('a'), poller.wait('a'))
+        assert first is second
+        assert tasks.queries == {'a': 2}
+
+    asyncio.run(scenario())
+
+
+def test_error_code_finishes_task():
+    async def scenario():
+        tasks = FakeTasks({}, responses={'a': {'code': 32001, 'message': '任务不存在'}})
+        poller = TaskPoller(tasks.query, account='poller-error')
+        resp = await poller.wait('a')
+        assert resp['code'] == 32001
+        histogram, = _task_histograms('poller-error')
+        assert histogram.count == 1
+
+    asyncio.run(scenario())
+
+
+def test_malformed_response_fails_only_that_task():
+    async def scenario():
+        tasks = FakeTasks({'ok': 3}, responses={'bad': {'code': 0, 'data': None}})
+        poller = TaskPoller(tasks.query)
+        bad, ok = await asyncio.gather(poller.wait('bad'), poller.wait('ok'), return_exceptions=True)
+        assert isinstance(bad, TypeError)
+        assert ok['data']['status'] == 2
+        # 轮询协程仍然存活，后续任务正常完成
+        tasks.polls['later'] = 1
+        assert (await poller.wait('later'))['data']['task_title'] == 'later'
+
+    asyncio.run(scenario())
+
+
+def test_query_exception_fails_only_that_task():
+    async def scenario():
+        tasks = FakeTasks({'ok': 2})
+
+        async def query(task_id, retry_index):
+            if task_id == 'boom':
+                raise RuntimeError('网络异常')
+            return await tasks.query(task_id, retry_index)
+
+        poller = TaskPoller(query)
+        boom, ok = await asyncio.gather(poller.wait('boom'), poller.wait('ok'), return_exceptions=True)
+        assert isinstance(boom, RuntimeError)
+        assert ok['data']['status'] == 2
+
+    asyncio.run(scenario())
+
+
+def test_close_cancels_pending_waiters():
+    async def scenario():
+        tasks = FakeTasks({'a': 10 ** 6})
+        poller = TaskPoller(tasks.query)
+        waiter = asyncio.ensure_future(poller.wait('a'))
+        await asyncio.sleep(0.05)
+        await poller.close()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert poller.stats()['pending'] == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,44 @@
+import asyncio
+
+from QuarkDisk import QuarkDisk, QuarkTransport
+
+
+def _disk(name: str) -> QuarkDisk:
+    return QuarkDisk({'name': name, 'cookie': f'__uid={name}', 'base_url': 'http://127.0.0.1:9'})
+
+
+def test_accounts_share_one_connector_with_separate_sessions():
+    async def scenario():
+        a, b = _disk('transport-a'), _disk('transport-b')
+        try:
+            assert a.session is not b.session
+            assert a.session.connector is b.session.connector
+        finally:
+            await a.close()
+            await b.close()
+            await QuarkTransport.close()
+
+    asyncio.run(scenario())
+
+
+def test_session_is_closed_only_after_the_last_release():
+    async def scenario():
+        first, second = _disk('transport-shared'), _disk('transport-shared')
+        session = first.session
+        try:
+            assert second.session is session
+            await first.close()
+            assert not session.closed
+            # 重复 close 不会多释放一次引用
+            await first.close()
+            assert not session.closed
+            await second.close()
+            assert session.closed
+            # 之后新建的客户端获得新的 session
+            third = _disk('transport-shared')
+            assert third.session is not session and not third.session.closed
+            await third.close()
+        finally:
+            await QuarkTransport.close()
+
+    asyncio.run(scenario())
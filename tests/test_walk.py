@@ -0,0 +1,60 @@
+import asyncio
+import posixpath
+
+from QuarkEmulator import QuarkEmulator
+from quark_env import emulated_disks
+
+SORT = '/1/clouddrive/file/sort'
+
+
+def _make_tree(emulator: QuarkEmulator):
+    """
+    /lib/A/S01/E01.mp4、/lib/A/S01/E02.mp4、/lib/A/poster.jpg、/lib/B/E01.mp4、/lib/readme.txt
+    """
+    drive = emulator.drive('A')
+    for path in ('/lib/A/S01', '/lib/B'):
+        drive.mkdir_p(path)
+    for path in ('/lib/A/S01/E01.mp4', '/lib/A/S01/E02.mp4', '/lib/A/poster.jpg', '/lib/B/E01.mp4', '/lib/readme.txt'):
+        parent, name = posixpath.split(path)
+        drive.add(drive.lookup(parent)['fid'], name, 1)
+
+
+def test_walk_yields_every_entry_after_its_parent():
+    async def scenario():
+        emulator = QuarkEmulator()
+        _make_tree(emulator)
+        async with emulated_disks(emulator, 'A') as (disk,):
+            paths = [path async for path, _ in disk.walk('/lib')]
+            assert set(paths) == {'/lib/A', '/lib/A/S01', '/lib/A/S01/E01.mp4', '/lib/A/S01/E02.mp4',
+                                  '/lib/A/poster.jpg', '/lib/B', '/lib/B/E01.mp4', '/lib/readme.txt'}
+            assert len(paths) == len(set(paths))
+            # 目录总是先于其下的条目产出
+            for path in paths:
+                parent = posixpath.dirname(path)
+                if parent != '/lib':
+                    assert paths.index(parent) < paths.index(path)
+            # 遍历到的目录写入 fid_cache
+            assert disk.fid_cache.get('/lib/A/S01')['fid'] == emulator.drive('A').lookup('/lib/A/S01')['fid']
+
+    asyncio.run(scenario())
+
+
+def test_walk_depth_limit_and_predicate():
+    async def scenario():
+        emulator = QuarkEmulator()
+        _make_tree(emulator)
+        async with emulated_disks(emulator, 'A') as (disk,):
+            requests = emulator.request_counts[SORT]
+            paths = {path async for path, _ in disk.walk('/lib', max_depth=0)}
+            # 只列出 /lib，子目录本身产出但不再列出
+            assert paths == {'/lib/A', '/lib/B', '/lib/readme.txt'}
+            assert emulator.request_counts[SORT] == requests + 1
+
+            paths = {path async for path, _ in disk.walk('/lib', max_depth=1)}
+            assert '/lib/A/S01' in paths and '/lib/A/S01/E01.mp4' not in paths
+
+            paths = {path async for path, _ in disk.walk('/lib', predicate=lambda name: name != 'A')}
+            assert '/lib/A' in paths and '/lib/A/poster.jpg' not in paths
+            assert '/lib/B/E01.mp4' in paths
+
+    asyncio.run(scenario())